@@ -2,7 +2,7 @@
 Use one of them to manage your imap_storage connection(s)
 """
 from .connection.config import Config
-from .connection.imap import Imap
+from .connection.pool import ImapPool
 from .storage.storage import Storage
 
 __all__ = ['AccountManager', 'Account']
@@ -62,7 +62,7 @@ class Account:
     def __init__(self, config, id_, unsafe=False):
         self.id_ = id_
         self.config = config
-        self.imap = Imap(config, unsafe)
+        self.imap = ImapPool(config, unsafe)
         self.smtp = None
         self.storage = Storage(self.imap)
 
@@ -0,0 +1,15 @@
+"""asyncio API, see AsyncAccount
+The library code never starts an event loop, await it in your own one
+"""
+from .account import AsyncAccount
+from .imap import AsyncImap
+from .storage import AsyncStorage, AsyncDirectory, AsyncEmail, AsyncBlobStore
+
+__all__ = (
+    'AsyncAccount',
+    'AsyncImap',
+    'AsyncStorage',
+    'AsyncDirectory',
+    'AsyncEmail',
+    'AsyncBlobStore',
+    )
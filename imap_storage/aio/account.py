@@ -0,0 +1,54 @@
+"""AsyncAccount class
+asyncio counterpart of Account, many accounts can share one event loop
+"""
+from .imap import AsyncImap
+from .storage import AsyncStorage
+
+__all__ = ['AsyncAccount']
+
+
+class AsyncAccount:
+    """one pipelined connection and its storage, use it as
+    ``async with AsyncAccount(config, id_) as account:``
+    or await *connect* and *close*
+    :param config: Config object
+    :param id_: Id of the account
+    :param unsafe: Workaround for invalid ssl certificates (unproductive only)
+    :param use_ssl: False connects without TLS (local test servers)
+    """
+    def __init__(self, config, id_, unsafe=False, use_ssl=True):
+        self.id_ = id_
+        self.config = config
+        self.imap = AsyncImap(config, unsafe, use_ssl)
+        self.storage = AsyncStorage(self.imap)
+
+    async def connect(self):
+        """connect and log in
+        :returns: self
+        """
+        await self.imap.connect()
+        return self
+
+    def is_ok(self):
+        """Tests if the Account is ok
+        :returns: True if the imap connection of the account is open
+        """
+        return self.imap.is_ok()
+
+    async def close(self):
+        """close the account connection
+        :returns: True if imap logged out
+        """
+        return await self.imap.logout()
+
+    async def __aenter__(self):
+        return await self.connect()
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def __repr__(self):
+        return 'AsyncAccount: {}'.format(str(self))
+
+    def __str__(self):
+        return str(self.id_)
@@ -0,0 +1,513 @@
+"""AsyncImap class
+IMAP client on asyncio streams for the commands that imap_storage uses.
+Commands are pipelined: every coroutine sends its command without waiting
+for the ones before, the responses are matched by their tags.
+"""
+import asyncio
+import re
+import ssl
+from collections import OrderedDict, deque
+from imapclient import exceptions
+from imapclient.imap_utf7 import decode as decode_utf7, encode as encode_utf7
+from imapclient.response_parser import parse_fetch_response, parse_response
+from ..connection.imap import FolderCache, Imap, copied_uids, uid_pieces
+from ..connection.uidset import UidSet
+
+__all__ = ['AsyncImap', 'quote']
+
+LITERAL_RE = re.compile(br'\{(\d+)\+?\}$')
+SPECIALS = re.compile(br'[^\x21-\x7e]|[()"\\{%]')
+UID_RE = re.compile(br'[( ]UID (\d+)')
+UNSOLICITED = 100  # untagged responses without a command that are kept
+
+
+def quote(value):
+    """
+    :param value: str, bytes or int argument of a command
+    :returns: value as atom if possible, else as quoted string (bytes)
+    """
+    if isinstance(value, int):
+        return str(value).encode('ascii')
+    if isinstance(value, str):
+        value = value.encode('utf-8')
+    if value and not SPECIALS.search(value):
+        return value
+    return b'"' + value.replace(b'\\', b'\\\\').replace(b'"', b'\\"') + b'"'
+
+
+class Command:
+    """a sent command that waits for its tagged response
+    Untagged responses that arrive while it is the oldest pending command
+    belong to it, like servers answer pipelined commands in order. FETCH
+    responses belong to the oldest command that has their UID in uids.
+    :param tag: tag of the command as bytes
+    :param name: command like b'UID FETCH'
+    :param uids: UidSet of a UID FETCH
+    """
+    def __init__(self, tag, name, uids=None):
+        self.tag = tag
+        self.name = name
+        self.uids = uids
+        self.untagged = []  # [(type, items)], items like imaplib has them
+        self.text = None  # text of the tagged response
+        self.done = asyncio.get_event_loop().create_future()
+
+    def responses(self, kind):
+        """
+        :param kind: type of the untagged responses, e.g. b'FETCH'
+        :returns: items of all these responses as list
+        """
+        return [item for type_, items in self.untagged if type_ == kind
+                for item in items]
+
+
+class AsyncImap:  # pylint: disable=too-many-instance-attributes
+    """Imap connection on asyncio streams
+    Nothing happens before *connect* is awaited, it has to run in the
+    event loop that uses the connection afterwards.
+    :param config: Config Object with correct data
+    :param unsafe: Workaround for invalid ssl certificates (unproductive only)
+    :param use_ssl: False connects without TLS (local test servers)
+    """
+    clean_folder_path = Imap.clean_folder_path
+
+    def __init__(self, config, unsafe=False, use_ssl=True):
+        self.config = config
+        self.ssl_context = None
+        if use_ssl:
+            self.ssl_context = ssl.create_default_context()
+            if unsafe:
+                self.ssl_context.check_hostname = False
+                self.ssl_context.verify_mode = ssl.CERT_NONE
+        self.capabilities = set()
+        self.current_folder = None
+        self.folders = FolderCache()
+        # the last untagged responses without a command
+        self.unsolicited = deque(maxlen=UNSOLICITED)
+        self._reader = None
+        self._writer = None
+        self._reading = None  # task of *_read_loop*
+        self._pending = OrderedDict()  # {tag: Command}
+        self._continuation = None
+        self._tag = 0
+        self._write_lock = None  # locks are created in the loop (connect)
+        self._select = None
+        self._users = 0  # commands that need current_folder
+
+    async def connect(self):
+        """open the connection, log in and create config.directory"""
+        self._write_lock = asyncio.Lock()
+        self._select = asyncio.Condition()
+        self._reader, self._writer = await asyncio.open_connection(
+            self.config.imap.host, int(self.config.imap.port),
+            ssl=self.ssl_context)
+        greeting = await self._read_response()
+        if not greeting[0].startswith(b'* OK'):
+            raise exceptions.LoginError('Unable to connect')
+        self._reading = asyncio.ensure_future(self._read_loop())
+        try:
+            await self.command(b'LOGIN', quote(self.config.imap.user),
+                               quote(self.config.imap.password))
+        except exceptions.IMAPClientError as error:
+            raise exceptions.LoginError(str(error))
+        await self.command(b'CAPABILITY')
+        await self.create_folder(self.config.directory)
+
+    async def logout(self):
+        """log out and close the connection
+        :returns: True if the server confirmed the LOGOUT
+        """
+        try:
+            await self.command(b'LOGOUT')
+            result = True
+        except (exceptions.IMAPClientError, OSError,
+                asyncio.IncompleteReadError):
+            result = False
+        if self._reading is not None:
+            self._reading.cancel()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        return result
+
+    def is_ok(self):
+        """
+        :returns: True if the connection is open
+        """
+        return self._writer is not None and self._reading is not None \
+            and not self._reading.done()
+
+    def has_capability(self, name):
+        """
+        :param name: capability like 'UIDPLUS'
+        :returns: True if the server announced it
+        """
+        return name.upper().encode('ascii') in self.capabilities
+
+    # ### Protocol ###
+    async def command(self, name, *args, literal=None, uids=None):
+        """send a command and wait for its tagged response
+        Other coroutines send their commands meanwhile (pipelining)
+        :param name: command like b'UID FETCH'
+        :param args: arguments as bytes (see *quote*)
+        :param literal: bytes that follow args as literal (APPEND)
+        :param uids: UidSet of a UID FETCH, see Command
+        :returns: Command with the untagged responses
+        :raises IMAPClientError: if the server answers NO or BAD
+        """
+        if not self.is_ok():
+            raise exceptions.IMAPClientError('Not connected')
+        self._tag += 1
+        tag = 'A{:04d}'.format(self._tag).encode('ascii')
+        command = Command(tag, name, uids)
+        line = b' '.join((tag, name) + args)
+        async with self._write_lock:
+            self._pending[tag] = command
+            if literal is None:
+                self._writer.write(line + b'\r\n')
+            elif self.has_capability('LITERAL+'):
+                self._writer.write(b'%s {%d+}\r\n%s\r\n' % (
+                    line, len(literal), literal))
+            else:
+                self._continuation = asyncio.get_event_loop().create_future()
+                self._writer.write(b'%s {%d}\r\n' % (line, len(literal)))
+                await asyncio.wait([self._continuation, command.done],
+                                   return_when=asyncio.FIRST_COMPLETED)
+                if not command.done.done():
+                    self._writer.write(literal + b'\r\n')
+                self._continuation = None
+            await self._writer.drain()
+        status, command.text = await command.done
+        if status != b'OK':
+            raise exceptions.IMAPClientError('{} failed: {}'.format(
+                name.decode('ascii'), command.text.decode('utf-8', 'replace')))
+        return command
+
+    async def _read_response(self):
+        """read one response including its literals
+        :returns: list of bytes and (bytes, literal) tuples like imaplib
+        """
+        items = []
+        line = await self._reader.readline()
+        while True:
+            if not line.endswith(b'\n'):
+                raise ConnectionResetError('Connection closed by server')
+            line = line.rstrip(b'\r\n')
+            match = LITERAL_RE.search(line)
+            if not match:
+                items.append(line)
+                return items
+            items.append((line, await self._reader.readexactly(
+                int(match.group(1)))))
+            line = await self._reader.readline()
+
+    async def _read_loop(self):
+        """dispatch the responses until the connection is lost
+        The pending commands fail with the error that ends it
+        """
+        try:
+            while True:
+                self._dispatch(await self._read_response())
+        except asyncio.CancelledError:
+            self._fail(ConnectionResetError('Connection closed'))
+            raise
+        except Exception as error:  # pylint: disable=broad-except
+            self._fail(error)  # lost or a response that can not be read
+            if self._writer is not None:
+                self._writer.close()
+
+    def _fail(self, error):
+        """set error on all pending commands"""
+        for command in self._pending.values():
+            if not command.done.done():
+                command.done.set_exception(error)
+        self._pending.clear()
+        if self._continuation and not self._continuation.done():
+            self._continuation.set_exception(error)
+
+    def _dispatch(self, items):
+        first = items[0][0] if isinstance(items[0], tuple) else items[0]
+        if first.startswith(b'+'):
+            if self._continuation and not self._continuation.done():
+                self._continuation.set_result(first)
+        elif first.startswith(b'* '):
+            kind, data = self._untagged(first[2:])
+            if isinstance(items[0], tuple):
+                items[0] = (data, items[0][1])
+            else:
+                items[0] = data
+            if kind == b'CAPABILITY':
+                self.capabilities = set(data.upper().split())
+            command = self._owner(kind, items)
+            if command is not None:
+                command.untagged.append((kind, items))
+            else:
+                self.unsolicited.append((kind, items))
+        else:
+            tag, status, text = (first.split(b' ', 2) + [b'', b''])[:3]
+            command = self._pending.pop(tag, None)
+            if command is not None and not command.done.done():
+                command.done.set_result((status.upper(), text))
+
+    def _owner(self, kind, items):
+        """
+        :returns: pending command that an untagged response belongs to,
+            see Command, or None
+        """
+        if kind == b'FETCH':
+            for item in items:
+                match = UID_RE.search(
+                    item[0] if isinstance(item, tuple) else item)
+                if match:
+                    uid = int(match.group(1))
+                    for command in self._pending.values():
+                        if command.uids is not None and uid in command.uids:
+                            return command
+                    break
+        return next(iter(self._pending.values()), None)
+
+    @staticmethod
+    def _untagged(line):
+        """
+        :param line: untagged response without '* '
+        :returns: (type, data) like imaplib, b'5 FETCH (..)' -> FETCH, 5 (..)
+        """
+        parts = line.split(b' ', 2)
+        if parts[0].isdigit() and len(parts) > 1:
+            return parts[1].upper(), b' '.join(parts[:1] + parts[2:])
+        return parts[0].upper(), b' '.join(parts[1:])
+
+    # ### Folders ###
+    def selected(self, folder):
+        """async context manager that selects folder for the commands
+        inside, they are pipelined with the ones of other coroutines for
+        the same folder. Another folder is selected when they are done.
+        :param folder: folder path
+        """
+        return _Selected(self, self.clean_folder_path(folder))
+
+    async def list_folders(self, refresh=False):
+        """folders below config.directory
+        LIST is only sent if the folders are not cached yet
+        :param refresh: send LIST even if the folders are cached
+        :returns: sorted list of folder paths
+        """
+        if refresh or not self.folders.loaded:
+            directory = self.config.directory
+            command = await self.command(
+                b'LIST', b'""', quote(encode_utf7(directory) + b'*'))
+            folders = []
+            for kind, items in command.untagged:
+                if kind == b'LIST':
+                    name = parse_response(items)[2]
+                    name = decode_utf7(name) if isinstance(name, bytes) \
+                        else str(name)
+                    if name.startswith(directory):
+                        folders.append(name)
+            self.folders.load(folders)
+        return list(self.folders)
+
+    async def create_folder(self, folder):
+        """
+        :param folder: folder path
+        :returns: True if the folder has been created
+        """
+        folder = self.clean_folder_path(folder)
+        if not self.folders.loaded:
+            await self.list_folders()
+        if folder in self.folders:
+            return False
+        try:
+            await self.command(b'CREATE', quote(encode_utf7(folder)))
+        except exceptions.IMAPClientError:
+            # maybe created by another client or as parent of a subfolder
+            if folder not in await self.list_folders(refresh=True):
+                raise
+            return False
+        self.folders.add(folder)
+        return True
+
+    async def delete_folder(self, folder, allow_base=False):
+        """delete folder and all sub folders recursive
+        :returns: list of deleted folders and subfolders
+        """
+        deleted = []
+        folder = self.clean_folder_path(folder)
+        folders = [fldr for fldr in await self.list_folders()
+                   if fldr == folder or fldr.startswith(folder + '.')]
+        for fldr in sorted(folders, reverse=True):  # subfolders first
+            if allow_base or fldr != self.config.directory:
+                async with self._select:
+                    while self._users:
+                        await self._select.wait()
+                    try:
+                        await self.command(b'DELETE', quote(encode_utf7(fldr)))
+                    except exceptions.IMAPClientError:
+                        continue
+                    if self.current_folder == fldr:
+                        self.current_folder = None
+                self.folders.discard(fldr)
+                deleted.append(fldr)
+        return deleted
+
+    async def uninstall(self):
+        """delete root folder (self.config.directory) and logout"""
+        await self.delete_folder(self.config.directory, allow_base=True)
+        return await self.logout()
+
+    # ### Messages of the selected folder ###
+    async def search(self, criteria=None):
+        """UID SEARCH in the selected folder
+        :param criteria: list like ['HEADER', 'Message-ID', '<..>'],
+            default are the messages with config.tag in the subject
+        :returns: sorted list of uids
+        """
+        criteria = criteria or ['SUBJECT', self.config.tag]
+        command = await self.command(
+            b'UID SEARCH', *(quote(value) for value in criteria))
+        return sorted(int(uid) for item in command.responses(b'SEARCH')
+                      for uid in item.split())
+
+    async def fetch(self, messages, data):
+        """UID FETCH, long uid sets are split into several commands that
+        are sent at once
+        :param messages: uids as list, UidSet or sequence set like '1:3'
+        :param data: fetch item or list of fetch items
+        :returns: {uid: {item: value}}
+        """
+        if not messages:
+            raise AttributeError('No message uids')
+        if isinstance(data, str):
+            data = [data]
+        items = '({})'.format(' '.join(data)).encode('ascii')
+        pieces = uid_pieces(messages)
+        commands = await asyncio.gather(*(
+            self.command(b'UID FETCH', str(piece).encode('ascii'), items,
+                         uids=piece if isinstance(piece, UidSet) else None)
+            for piece in pieces))
+        fetched = parse_fetch_response(
+            [item for command in commands
+             for item in command.responses(b'FETCH')], True, True)
+        if not all(isinstance(piece, UidSet) for piece in pieces):
+            return fetched  # '*', every uid may be requested
+        uid_set = UidSet.from_ranges(
+            uid_range for piece in pieces for uid_range in piece.ranges)
+        return {  # drop unsolicited responses of other messages
+            uid: values for uid, values in fetched.items() if uid in uid_set}
+
+    async def append(self, folder, msg, flags=()):
+        """
+        :param folder: folder path
+        :param msg: message as str or bytes
+        :param flags: flags of the new message
+        :returns: text of the tagged response (with APPENDUID)
+        """
+        if isinstance(msg, str):
+            msg = msg.encode('utf-8')
+        msg = re.sub(br'\r?\n|\r', b'\r\n', msg)
+        args = [quote(encode_utf7(self.clean_folder_path(folder)))]
+        if flags:
+            args.append('({})'.format(' '.join(flags)).encode('ascii'))
+        command = await self.command(b'APPEND', *args, literal=msg)
+        return command.text
+
+    async def add_flags(self, messages, flags):
+        """UID STORE +FLAGS.SILENT, long uid sets are split
+        :param messages: uids
+        :param flags: list of flags as bytes, e.g. [b'\\Deleted']
+        """
+        await self._store(messages, b'+FLAGS.SILENT', flags)
+
+    async def remove_flags(self, messages, flags):
+        """UID STORE -FLAGS.SILENT, see *add_flags*"""
+        await self._store(messages, b'-FLAGS.SILENT', flags)
+
+    async def _store(self, messages, name, flags):
+        flags = b'(' + b' '.join(flags) + b')'
+        await asyncio.gather(*(
+            self.command(b'UID STORE', str(piece).encode('ascii'), name, flags)
+            for piece in uid_pieces(messages)))
+
+    async def expunge(self, messages):
+        """expunge messages that are flagged \\Deleted, with UIDPLUS only
+        these uids, else all of the selected folder
+        :param messages: uids
+        """
+        if self.has_capability('UIDPLUS'):
+            await asyncio.gather(*(
+                self.command(b'UID EXPUNGE', str(piece).encode('ascii'))
+                for piece in uid_pieces(messages)))
+        else:
+            await self.command(b'EXPUNGE')
+
+    async def delete_messages(self, messages):
+        """delete messages of the selected folder, with UIDPLUS only
+        exactly these uids are expunged
+        :param messages: uids
+        :returns: True
+        """
+        if not uid_pieces(messages):
+            return True
+        await self.add_flags(messages, [b'\\Deleted'])
+        await self.expunge(messages)
+        return True
+
+    async def copy_messages(self, messages, folder):
+        """UID COPY of messages of the selected folder to folder, long uid
+        sets are split into commands that are sent at once
+        :param messages: uids
+        :param folder: path of the target folder
+        :returns: {uid: new uid} from COPYUID, empty without UIDPLUS
+        """
+        return await self._transfer(b'UID COPY', messages, folder)
+
+    async def move_messages(self, messages, folder):
+        """UID MOVE (RFC 6851) of messages of the selected folder to folder,
+        without MOVE a UID COPY followed by *delete_messages*
+        :param messages: uids
+        :param folder: path of the target folder
+        :returns: {uid: new uid} from COPYUID, empty without UIDPLUS
+        """
+        if not self.has_capability('MOVE'):
+            copied = await self._transfer(b'UID COPY', messages, folder)
+            await self.delete_messages(messages)
+            return copied
+        return await self._transfer(b'UID MOVE', messages, folder)
+
+    async def _transfer(self, name, messages, folder):
+        folder = quote(encode_utf7(self.clean_folder_path(folder)))
+        commands = await asyncio.gather(*(
+            self.command(name, str(piece).encode('ascii'), folder)
+            for piece in uid_pieces(messages)))
+        copied = {}
+        for command in commands:  # COPY: tagged OK, MOVE: untagged OK
+            for text in [command.text] + command.responses(b'OK'):
+                copied.update(copied_uids(text) or {})
+        return copied
+
+    def __str__(self):
+        return self.config.imap.user
+
+
+class _Selected:
+    """see AsyncImap.selected"""
+    def __init__(self, imap, folder):
+        self.imap = imap
+        self.folder = folder
+
+    async def __aenter__(self):
+        imap = self.imap
+        async with imap._select:  # pylint: disable=protected-access
+            while imap.current_folder != self.folder and imap._users:
+                await imap._select.wait()  # pylint: disable=W0212
+            if imap.current_folder != self.folder:
+                await imap.command(b'SELECT', quote(encode_utf7(self.folder)))
+                imap.current_folder = self.folder
+            imap._users += 1  # pylint: disable=protected-access
+        return imap
+
+    async def __aexit__(self, *exc_info):
+        imap = self.imap
+        async with imap._select:  # pylint: disable=protected-access
+            imap._users -= 1  # pylint: disable=protected-access
+            imap._select.notify_all()  # pylint: disable=protected-access
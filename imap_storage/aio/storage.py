@@ -0,0 +1,659 @@
+"""AsyncStorage, AsyncDirectory and AsyncEmail classes
+asyncio counterparts of Storage, Directory and Email. Head, body and
+files are the ones of Email, everything that talks to the server is a
+coroutine (load, save, delete, ...).
+New files are always stored inside of their email, configs that store
+them apart (Config.chunk_size, Config.dedup and Config.layout 'split')
+are refused. Files that the synchronous API stored in chunk messages or
+in the blob folder are read, moved, copied and deleted like the others.
+"""
+import asyncio
+from base64 import b64decode
+from ..connection.imap import appended_uids
+from ..storage.blobs import BLOB_FOLDER, BLOB_HEADER, REF_HEADER, BlobStore
+from ..storage.directory import CHUNK_HEADER, Directory
+from ..storage.email.email import Email, FIELDS
+from ..storage.email.head import message_id, parse_header_fields
+from ..storage.storage import Storage, field_items, parse_fields
+
+__all__ = ['AsyncStorage', 'AsyncDirectory', 'AsyncEmail', 'AsyncBlobStore']
+
+LOAD_ITEMS = ['BODY.PEEK[HEADER]', 'BODYSTRUCTURE', 'BODY.PEEK[1.1]']
+
+
+class AsyncEmail(Email):
+    """Email of an AsyncDirectory
+    Fields, head, body and file metadata are there after *load*, the data
+    of the files after *load_files*. Accessing them before raises
+    RuntimeError instead of fetching them.
+    """
+    async def load(self, fields=FIELDS):
+        """fetch fields, head, body and file metadata with one FETCH
+
+        Returns:
+            AsyncEmail: self
+        """
+        await self.directory.load([self], fields)
+        return self
+
+    async def load_files(self):
+        """fetch the stored data of all files of this email at once,
+        chunked files and blobs with one SEARCH and one FETCH each
+
+        Returns:
+            list: self.files
+        """
+        await self._load_parts()
+        await asyncio.gather(*(
+            self._load_apart(file) for file in self.files
+            if file.stored_apart
+            and file._data is None))  # pylint: disable=protected-access
+        return self.files
+
+    async def _load_apart(self, file):
+        """fetch the data of a file in chunk messages or in a blob"""
+        if file.chunks:
+            data = await self.directory.load_chunks(file)
+        else:
+            data = await self.directory.storage.blobs.get(file.blob)
+        file._data = data  # pylint: disable=protected-access
+
+    async def _load_parts(self):
+        """fetch the files that are stored in this email, the ones that
+        are stored apart stay there on save
+        """
+        files = {file.part: file for file in self.files
+                 if file.part is not None
+                 and file._data is None}  # pylint: disable=protected-access
+        if files:
+            parts = await self.directory.fetch_parts(self, sorted(files))
+            for part, file in files.items():
+                encoding = file.encoding
+                file.data = parts.get(part, b'')
+                file.encoding = encoding  # still as it is stored
+
+    async def read_file(self, file):
+        """
+        Args:
+            file(File): file of this email
+
+        Returns:
+            bytes: decoded data of file
+        """
+        await self.load_files()
+        return file.read()
+
+    async def save(self):
+        """Produce new Email from body, head and files, save it, delete old
+
+        Returns:
+            int: new uid
+        """
+        if self.uid is not None:
+            await self._load_parts()
+        self.uid = await self.directory.save_message(self)
+        return self.uid
+
+    async def remove_file_by_attrib(self, attrib, value):
+        """remove file from email and save it
+        eg. await remove_file_by_attrib('id', 'ldsKLfds')
+
+        Returns:
+            int: new uid
+        """
+        await self._load_parts()
+        names = set()
+        for bad in self.body.xml.xpath(
+                "//*[@{}=\'{}\']".format(attrib, value)):
+            names.add(bad.get('name'))
+            bad.getparent().remove(bad)
+        removed = [file for file in self.files if file.name in names]
+        self._files = [file for file in self.files if file.name not in names]
+        uid = await self.save()
+        await self.directory.delete_apart(removed)
+        return uid
+
+    async def remove_file(self, file):
+        """removes file object from email and save it
+
+        Args:
+            file(File): File object to delete from email
+        """
+        return await self.remove_file_by_attrib('name', file.name)
+
+    async def move_to(self, directory):
+        """move this email to directory on the server, nothing is
+        downloaded (see AsyncDirectory.move_emails)
+
+        Args:
+            directory(AsyncDirectory): target directory
+
+        Returns:
+            int: new uid or None if the server has no UIDPLUS
+        """
+        await self.directory.move_emails([self], directory)
+        return self.uid
+
+    async def copy_to(self, directory):
+        """copy this email to directory on the server, nothing is
+        downloaded (see AsyncDirectory.copy_emails)
+
+        Args:
+            directory(AsyncDirectory): target directory
+
+        Returns:
+            AsyncEmail: the loaded copy or None if the server has no UIDPLUS
+        """
+        uid = (await self.directory.copy_emails([self], directory))[self.uid]
+        return await directory.email_by_uid(uid) if uid else None
+
+    async def delete(self):
+        """delete this email
+
+        Returns:
+            bool: True if success
+        """
+        return await self.directory.delete_emails([self])
+
+
+class AsyncDirectory:
+    """asyncio counterpart of Directory"""
+    email_class = AsyncEmail
+    new_email = Directory.new_email
+    item_name = Directory.item_name
+    url = Directory.url
+    data_message = Directory.data_message
+
+    def __init__(self, storage, folder):
+        self.storage = storage
+        self.imap = storage.imap
+        self.folder = folder.replace(' ', '_')
+        self.path = self.folder
+
+    def selected(self):
+        """async context manager, see AsyncImap.selected"""
+        return self.imap.selected(self.path)
+
+    def _not_loaded(self, *args, **kwargs):
+        raise RuntimeError(
+            'Not loaded, await AsyncEmail.load or load_files first')
+
+    # Email and File fetch lazily with these, AsyncEmail loads explicitly
+    prefetch = fetch_head = fetch_body = fetch_files = fetch_payloads = \
+        fetch_part = fetch_chunks = _not_loaded
+
+    async def uids(self):
+        """
+        Returns:
+            list: sorted uids of the emails in this directory
+        """
+        async with self.selected() as imap:
+            return await imap.search()
+
+    async def emails(self, fields=FIELDS):
+        """emails with their listing fields, one SEARCH and one FETCH
+
+        Args:
+            fields(tuple, optional): see Storage.get_fields
+
+        Returns:
+            list: AsyncEmail objects ordered by uid
+        """
+        uids = await self.uids()
+        emails = [self.email_class(self, uid) for uid in uids]
+        if emails and fields:
+            async with self.selected() as imap:
+                fetched = await imap.fetch(uids, field_items(fields))
+            for email in emails:
+                email.set_fields(parse_fields(fetched.get(email.uid, {}),
+                                              fields))
+        return emails
+
+    async def load(self, emails, fields=FIELDS):
+        """fetch fields, head, body and file metadata of emails at once
+
+        Args:
+            emails(list): AsyncEmail objects of this directory
+            fields(tuple, optional): see Storage.get_fields
+
+        Returns:
+            list: uids that have been found
+        """
+        emails = {email.uid: email for email in emails if email.uid}
+        if not emails:
+            return []
+        async with self.selected() as imap:
+            fetched = await imap.fetch(
+                sorted(emails), field_items(fields) + LOAD_ITEMS)
+        for uid, data in fetched.items():
+            email = emails[uid]
+            email.set_fields(parse_fields(data, fields))
+            email.head = data[b'BODY[HEADER]'].decode('utf-8')
+            body = data.get(b'BODY[1.1]')
+            email.set_files(data[b'BODYSTRUCTURE'],
+                            body.decode('utf-8') if body is not None else None)
+        return sorted(fetched)
+
+    async def email_by_uid(self, uid):
+        """
+        Args:
+            uid(int): uid of the email
+
+        Returns:
+            AsyncEmail: loaded email or None
+        """
+        email = self.email_class(self, int(uid))
+        if await self.load([email]):
+            return email
+        return None
+
+    async def files(self):
+        """List files of all emails inside this directory
+        Only metadata, one SEARCH and one FETCH
+
+        Returns:
+            list: of files
+        """
+        emails = [self.email_class(self, uid) for uid in await self.uids()]
+        await self.load(emails)
+        return [file for email in emails for file in email.files]
+
+    async def file_by_name(self, name):
+        """
+        Args:
+            name(str): name of the file
+
+        Returns:
+            File: first file with this name or None
+        """
+        for file in await self.files():
+            if file.name == name:
+                return file
+        return None
+
+    async def add_file_email(self, file):
+        """Create new Email with one file
+
+        Args:
+            file(File): object to append as file to the directory
+
+        Returns:
+            AsyncEmail: new created file Email or False if the name exists
+        """
+        if await self.file_by_name(file.name) is not None:
+            return False
+        email = self.new_email(file.name)
+        email.add_file(file)
+        await email.save()
+        return email
+
+    async def fetch_parts(self, email, parts):
+        """fetch parts of an email as they are stored (still encoded)
+
+        Args:
+            email(AsyncEmail): email of the parts
+            parts(list): part numbers, e.g. ['2', '3']
+
+        Returns:
+            dict: {part: bytes}
+        """
+        items = ['BODY.PEEK[{}]'.format(part) for part in parts]
+        async with self.selected() as imap:
+            fetched = await imap.fetch([email.uid], items)
+        data = fetched.get(email.uid, {})
+        return {part: data.get('BODY[{}]'.format(part).encode()) or b''
+                for part in parts}
+
+    async def save_message(self, msg_obj):
+        """save msg_obj to imap directory, delete the old message
+
+        Returns:
+            int: new uid or False if it has not been found
+        """
+        old_uid = msg_obj.uid
+        msg_id = msg_obj.head.set_message_id(message_id())
+        plain = str(msg_obj.plain)
+        async with self.selected() as imap:
+            result = await imap.append(self.path, plain)
+            uids = appended_uids(result)
+            if not uids:  # no UIDPLUS
+                uids = await imap.search(['HEADER', 'Message-ID', msg_id])
+            if old_uid:
+                await imap.delete_messages([old_uid])
+        return uids[-1] if uids else False
+
+    async def delete_email(self, email_uid_or_obj):
+        """
+        Args:
+            email_uid_or_obj: AsyncEmail or uid
+
+        Returns:
+            bool: True if success
+        """
+        uid = getattr(email_uid_or_obj, 'uid', email_uid_or_obj)
+        return await self.delete_emails([self.email_class(self, uid)])
+
+    async def delete_emails(self, emails):
+        """delete emails with one UID STORE and one UID EXPUNGE
+        Their chunks are deleted with them, their blobs are released.
+
+        Args:
+            emails(list): AsyncEmail objects of this directory
+
+        Returns:
+            bool: True if success
+        """
+        emails = [email for email in emails if email.uid]
+        if not emails:
+            return True
+        uids, blobs = await self._stored_with(emails)
+        async with self.selected() as imap:
+            result = await imap.delete_messages(uids)
+        for digest in blobs:
+            await self.storage.blobs.release(digest)
+        return result
+
+    async def _stored_with(self, emails):
+        """messages and blobs that belong to emails, loads the emails
+        whose files are unknown
+        :returns: tuple ([uids of the emails and their chunks], [blobs])
+        """
+        await self.load([email for email in emails
+                         if not email.files_loaded])
+        uids, blobs = [], []
+        for email in emails:
+            uids.append(int(email.uid))
+            for file in email.files:
+                if file.chunked:
+                    uids.extend((await self.chunk_uids(file)).values())
+                elif file.blob:
+                    blobs.append(file.blob)
+        return uids, blobs
+
+    async def delete_apart(self, files):
+        """delete the chunk messages and release the blobs of files that
+        have been removed from their email
+
+        Args:
+            files(list): File objects
+        """
+        uids = []
+        for file in files:
+            if file.chunked:
+                uids.extend((await self.chunk_uids(file)).values())
+            elif file.blob:
+                await self.storage.blobs.release(file.blob)
+        if uids:
+            async with self.selected() as imap:
+                await imap.delete_messages(uids)
+
+    async def move_emails(self, emails, directory):
+        """move emails with their chunk messages to another directory on
+        the server (UID MOVE or UID COPY and UID EXPUNGE), nothing is
+        downloaded or uploaded. The AsyncEmail objects move with them.
+
+        Args:
+            emails(list): AsyncEmail objects of this directory
+            directory(AsyncDirectory): target directory
+
+        Returns:
+            dict: {old uid: new uid} of the emails, new uid is None if
+                the server has no UIDPLUS
+        """
+        moved = await self._transfer(emails, directory, move=True)
+        for email in emails:
+            if email.uid in moved:
+                email.directory = directory
+                email.uid = moved[email.uid]
+        return moved
+
+    async def copy_emails(self, emails, directory):
+        """copy emails with their chunk messages to another directory on
+        the server, like *move_emails*. Their blobs get a reference more.
+
+        Args:
+            emails(list): AsyncEmail objects of this directory
+            directory(AsyncDirectory): target directory
+
+        Returns:
+            dict: {old uid: new uid} of the emails, new uid is None if
+                the server has no UIDPLUS
+        """
+        return await self._transfer(emails, directory)
+
+    async def _transfer(self, emails, directory, move=False):
+        """UID MOVE or UID COPY of emails to directory, see *move_emails*
+        :returns: {old uid: new uid or None}
+        """
+        emails = [email for email in emails if email.uid]
+        if not emails:
+            return {}
+        uids, blobs = await self._stored_with(emails)
+        await self.imap.create_folder(directory.path)
+        async with self.selected() as imap:
+            if move:
+                copied = await imap.move_messages(uids, directory.path)
+            else:
+                copied = await imap.copy_messages(uids, directory.path)
+        if blobs and not move:
+            await self.storage.blobs.retain(blobs)
+        return {email.uid: copied.get(email.uid) for email in emails}
+
+    # ### Files of the synchronous API ###
+    async def _chunk_messages(self, file, items):
+        """search the chunk messages of a file and fetch items of them
+        :returns: {index: (uid, {item: value})}
+        """
+        header = 'BODY.PEEK[HEADER.FIELDS ({})]'.format(CHUNK_HEADER)
+        async with self.selected() as imap:
+            uids = await imap.search(['HEADER', CHUNK_HEADER, file.id_])
+            fetched = await imap.fetch(uids, [header] + items) if uids \
+                else {}
+        chunks = {}
+        for uid, data in fetched.items():
+            for key, value in data.items():
+                if key.startswith(b'BODY[HEADER'):
+                    value = parse_header_fields(value).get(
+                        CHUNK_HEADER.lower(), '').split()
+                    if len(value) == 3 and value[0] == file.id_:
+                        chunks[int(value[1])] = (uid, data)
+        return chunks
+
+    async def chunk_uids(self, file):
+        """
+        Args:
+            file(File): chunked file
+
+        Returns:
+            dict: {index: uid} of its chunk messages
+        """
+        return {index: uid for index, (uid, _) in
+                (await self._chunk_messages(file, [])).items()}
+
+    async def load_chunks(self, file):
+        """fetch and decode all chunks of a file, they are searched
+        instead of trusting the stored uids (see Directory.fetch_chunk)
+
+        Args:
+            file(File): chunked file with chunks
+
+        Returns:
+            bytes: data of the file
+        """
+        chunks = await self._chunk_messages(file, ['BODY.PEEK[1]'])
+        data = []
+        for index, _, size in file.chunks:
+            if index not in chunks:
+                raise KeyError('Chunk {} of {} is missing'.format(
+                    index, file.name))
+            chunk = b64decode(b''.join(
+                (chunks[index][1].get(b'BODY[1]') or b'').split()))
+            if len(chunk) != size:
+                raise ValueError('Chunk {} of {} is incomplete'.format(
+                    index, file.name))
+            data.append(chunk)
+        return b''.join(data)
+
+    async def delete(self):
+        """delete this directory and its subdirectories
+
+        Returns:
+            list: of deleted paths
+        """
+        return await self.storage.delete_directory(self.path)
+
+    __hash__ = Directory.__hash__
+    __lt__ = Directory.__lt__
+    __eq__ = Directory.__eq__
+    __ne__ = Directory.__ne__
+    __repr__ = Directory.__repr__
+    __str__ = Directory.__str__
+
+
+class AsyncBlobStore:
+    """asyncio counterpart of BlobStore for the blobs that the synchronous
+    API stored: they are read, retained and released with the same
+    reference markers, new ones are not stored (see AsyncStorage)
+    :param storage: AsyncStorage object
+    """
+    digest = staticmethod(BlobStore.digest)
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.path = storage.clean_folder_path(BLOB_FOLDER)
+        self.directory = AsyncDirectory(storage, self.path)
+
+    async def _search(self, imap, header, value):
+        return await imap.search(['UNDELETED', 'HEADER', header, value])
+
+    async def get(self, digest):
+        """
+        :param digest: hash of the blob
+        :returns: data of the blob as bytes
+        """
+        await self.storage.imap.create_folder(self.path)
+        async with self.directory.selected() as imap:
+            uids = await self._search(imap, BLOB_HEADER, digest)
+            if not uids:
+                raise KeyError('Blob {} is not stored'.format(digest))
+            fetched = await imap.fetch(uids[:1], ['BODY.PEEK[1]'])
+        data = b64decode(b''.join(
+            (fetched.get(uids[0], {}).get(b'BODY[1]') or b'').split()))
+        if self.digest(data) != digest:
+            raise ValueError('Blob {} is damaged'.format(digest))
+        return data
+
+    async def retain(self, digests):
+        """add a reference to stored blobs, see BlobStore.retain
+        :param digests: hashes of the blobs, once per reference
+        :raises KeyError: if a blob is not stored
+        """
+        digests = list(digests)
+        await self.storage.imap.create_folder(self.path)
+        async with self.directory.selected() as imap:
+            await asyncio.gather(*(imap.append(
+                self.path, self.directory.data_message(
+                    'blob ref {}'.format(digest), {REF_HEADER: digest}, b''))
+                                   for digest in digests))
+            for digest in set(digests):
+                if not await self._search(imap, BLOB_HEADER, digest):
+                    for _ in range(digests.count(digest)):
+                        await self.release(digest)
+                    raise KeyError('Blob {} is not stored'.format(digest))
+
+    async def release(self, digest):
+        """remove a reference, sweep the blob if it was the last one, see
+        BlobStore.release
+        :param digest: hash of the blob
+        :returns: number of references left
+        """
+        await self.storage.imap.create_folder(self.path)
+        async with self.directory.selected() as imap:
+            markers = await self._search(imap, REF_HEADER, digest)
+            if markers:
+                await imap.delete_messages(markers[:1])
+            if len(markers) <= 1 and imap.has_capability('UIDPLUS'):
+                uids = await self._search(imap, BLOB_HEADER, digest)
+                if uids:
+                    await imap.add_flags(uids, [b'\\Deleted'])
+                    if await self._search(imap, REF_HEADER, digest):
+                        await imap.remove_flags(uids, [b'\\Deleted'])
+                    else:
+                        await imap.expunge(uids)
+        return max(len(markers) - 1, 0)
+
+
+class AsyncStorage:
+    """asyncio counterpart of Storage
+    :raises ValueError: if the config stores files apart from their emails
+    """
+    clean_folder_path = Storage.clean_folder_path
+    work = None  # there are no transactions (see Storage.transaction)
+
+    def __init__(self, imap):
+        config = imap.config
+        if config.chunk_size or config.dedup or config.layout != 'inline':
+            raise ValueError(
+                'The asyncio API stores files inside of their emails, it '
+                'needs Config.chunk_size None, Config.dedup False and '
+                "Config.layout 'inline'")
+        self.imap = imap
+        self._blobs = None
+
+    @property
+    def blobs(self):
+        """AsyncBlobStore of the blobs that the synchronous API stored"""
+        if self._blobs is None:
+            self._blobs = AsyncBlobStore(self)
+        return self._blobs
+
+    async def directories(self):
+        """
+        Returns:
+            list: AsyncDirectory objects of all folders
+        """
+        blob_folder = self.clean_folder_path(BLOB_FOLDER)
+        return sorted(AsyncDirectory(self, path)
+                      for path in await self.imap.list_folders()
+                      if path != blob_folder)
+
+    async def directory_by_path(self, path):
+        """
+        Args:
+            path(str): path of the directory
+
+        Returns:
+            AsyncDirectory: or None if the folder does not exist
+        """
+        path = self.clean_folder_path(path)
+        if path in await self.imap.list_folders():
+            return AsyncDirectory(self, path)
+        return None
+
+    async def new_directory(self, path):
+        """create the folder if it does not exist
+
+        Args:
+            path(str): path of the directory
+
+        Returns:
+            AsyncDirectory: of path
+        """
+        path = self.clean_folder_path(path)
+        await self.imap.create_folder(path)
+        return AsyncDirectory(self, path)
+
+    async def delete_directory(self, path):
+        """Delete directory and its subdirectories
+
+        Args:
+            path(str): directory path to delete
+
+        Returns:
+            list: of paths(str) that have been deleted at imap
+        """
+        return await self.imap.delete_folder(self.clean_folder_path(path))
+
+    async def uninstall(self):
+        """deletes the complete storage directory recursive and log out"""
+        return await self.imap.uninstall()
@@ -13,6 +13,10 @@ class Config:
         self.directory = 'storage'
         self.tag = self.TAG
         self.domain = None
+        self.chunk_size = None  # bytes, larger files are stored in chunks
+        self.dedup = False  # store equal payloads only once (blob folder)
+        self.codec = None  # compress payloads: 'zlib', 'lzma' or 'zstd'
+        self.layout = 'inline'  # 'split': every file in a blob message
 
     def is_ok(self):
         """Tests if this config seems to be ok
@@ -48,6 +52,11 @@ class _ImapConfig:  # pylint: disable=too-few-public-methods
         self.password = None
         self.host = None
         self.port = 993
+        self.pool_min = 1
+        self.pool_max = 4
+        self.pool_max_idle = 60  # seconds until an idle connection is tested
+        self.optimistic = True  # no NOOP before commands, reconnect on error
+        self.idle_probe = 30  # seconds until optimistic mode sends NOOP
 
     def is_ok(self):
         """tests if imap connection is ok"""
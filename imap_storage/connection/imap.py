@@ -2,21 +2,169 @@
 This class represents the connection layer
 Many of them are reimplementation of IMAPClient methods
 """
-from builtins import ConnectionResetError
+from builtins import ConnectionResetError, BrokenPipeError
+from contextlib import contextmanager
+from functools import wraps
+import re
 import ssl
-from imaplib import IMAP4
+import threading
+from time import time
+from imaplib import IMAP4, CRLF, MapCRLF
 from imapclient import IMAPClient, exceptions
+from imapclient.imapclient import seq_to_parenstr_upper
+from imapclient.response_parser import parse_fetch_response
 from imap_storage.tools.timer import timer
+from .uidset import UidSet
 
-__all__ = ['Imap', 'timer']
+__all__ = ['Imap', 'FolderCache', 'timer', 'response_code', 'uid_pieces',
+           'appended_uids', 'copied_uids']
+
+CONNECTION_LOST = (IMAP4.abort, ConnectionResetError, BrokenPipeError)
+FOLDER_ERRORS = ('TRYCREATE', 'NONEXISTENT')
+RESPONSE_CODE_RE = re.compile(r'\[([A-Za-z0-9-]+)(?: ([^\]]*))?\]')
+
+
+def response_code(text, name):
+    """arguments of a response code in the text of a response
+    :param text: e.g. b'[APPENDUID 38505 3955] APPEND completed'
+    :param name: name of the code, e.g. 'APPENDUID'
+    :returns: list of the arguments as str or None if there is no such code
+    """
+    if isinstance(text, bytes):
+        text = text.decode('utf-8', 'replace')
+    for match in RESPONSE_CODE_RE.finditer(text or ''):
+        if match.group(1).upper() == name:
+            return (match.group(2) or '').split()
+    return None
+
+
+def uid_pieces(messages):
+    """uid sets to send in one command each
+    :param messages: uids as list, UidSet or sequence set like '1:3'
+    :returns: list of UidSet, a sequence set with '*' (the highest uid)
+        can not be expanded, it is returned unchanged as only item
+    """
+    if isinstance(messages, bytes):
+        messages = messages.decode('ascii')
+    if isinstance(messages, str) and '*' in messages:
+        return [messages]
+    return UidSet(messages).split()
+
+
+def appended_uids(text):
+    """uids of appended messages from an APPENDUID response code (RFC 4315)
+    :param text: text of the tagged response of APPEND or MULTIAPPEND
+    :returns: list of uids in the order of the messages or None if the
+        response has no APPENDUID (the server has no UIDPLUS)
+    """
+    args = response_code(text, 'APPENDUID')
+    if args is None or len(args) != 2:
+        return None
+    return UidSet.expand(args[1])
+
+
+def copied_uids(text):
+    """uids of copied or moved messages from a COPYUID response code
+    :param text: text of the tagged response of COPY or of the untagged OK
+        of MOVE
+    :returns: {source uid: new uid} or None if there is no COPYUID
+    """
+    args = response_code(text, 'COPYUID')
+    if args is None or len(args) != 3:
+        return None
+    return dict(zip(UidSet.expand(args[1]), UidSet.expand(args[2])))
+
+
+def reconnecting(idempotent=True):
+    """decorator for Imap commands that need a working connection
+    Not optimistic: the connection is tested (NOOP) before every command.
+    Optimistic: the command runs directly. If the connection was lost, it
+    reconnects and retries idempotent commands once. Only if the connection
+    was idle longer than config.imap.idle_probe a NOOP is sent first.
+    Decorated methods accept connect=False to skip all of this.
+    :param idempotent: command can be sent twice without harm
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(self, *args, **kwargs):
+            connect = kwargs.pop('connect', True)
+            if self._busy or not connect:  # pylint: disable=protected-access
+                return func(self, *args, **kwargs)
+            self._busy = True  # pylint: disable=protected-access
+            try:
+                return self.execute(func, idempotent, *args, **kwargs)
+            finally:
+                self._busy = False  # pylint: disable=protected-access
+        return wrapper
+    return decorator
+
+
+class FolderCache:
+    """Folders below config.directory that are known to exist
+    It is filled by one LIST and updated locally afterwards.
+    All connections of an ImapPool share one FolderCache, so every access
+    holds a lock.
+    """
+    def __init__(self):
+        self.folders = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        """
+        :returns: True if the folders have been listed
+        """
+        return self.folders is not None
+
+    def load(self, folders):
+        """replace the cached folders by a new LIST result"""
+        folders = set(folders)
+        with self._lock:
+            self.folders = folders
+
+    def add(self, folder):
+        """folder has been created"""
+        with self._lock:
+            if self.folders is not None:
+                self.folders.add(folder)
+
+    def discard(self, folder):
+        """folder has been deleted"""
+        with self._lock:
+            if self.folders is not None:
+                self.folders.discard(folder)
+
+    def rename(self, old, new):
+        """folder and its subfolders have been renamed"""
+        with self._lock:
+            if self.folders is not None:
+                for folder in [fldr for fldr in self.folders
+                               if fldr == old or fldr.startswith(old + '.')]:
+                    self.folders.discard(folder)
+                    self.folders.add(new + folder[len(old):])
+
+    def invalidate(self):
+        """forget all folders, the next access will LIST again"""
+        with self._lock:
+            self.folders = None
+
+    def __contains__(self, folder):
+        with self._lock:
+            return self.folders is not None and folder in self.folders
+
+    def __iter__(self):
+        with self._lock:
+            return iter(sorted(self.folders or ()))
 
 
 class Imap(IMAPClient):
     """Imap connection class
     :param config: Config Object with correct data
     :param unsafe: Workaround for invalid ssl certificates (unproductive only)
+    :param folders: FolderCache to share with other connections
     """
-    def __init__(self, config, unsafe=False):  # pylint: disable=W0231
+    def __init__(self, config, unsafe=False, folders=None):
+        # pylint: disable=W0231
         self.config = config
         self.unsafe = unsafe
         if unsafe:
@@ -25,21 +173,29 @@ class Imap(IMAPClient):
             self.ssl_context.verify_mode = ssl.CERT_NONE
         else:
             self.ssl_context = None
+        self.optimistic = config.imap.optimistic
         self.current_folder = None
+        self.select_state = None  # uid_state of the last SELECT
+        self.qresync = False
+        self.capability_set = None  # cached after login, see *negotiate*
+        self.last_used = 0
+        self._busy = False
+        self.folders = folders or FolderCache()
         self.init()
         self.connect()
-        self._folders = None
 
     def init(self):
         """initialize or reinitialize imap connection"""
         host = self.config.imap.host
         port = self.config.imap.port
         ssl_context = self.ssl_context or None
-        if hasattr(self, '_imap'):
+        if hasattr(self, '_imap') and not self.logout():
             try:
-                self.logout()
+                self.shutdown()
             except OSError:
                 pass
+        self.current_folder = None
+        self.capability_set = None
         super().__init__(host, port=port, ssl_context=ssl_context)
 
     def connect(self):
@@ -48,10 +204,67 @@ class Imap(IMAPClient):
             self.init()
         if self.state() == 'NONAUTH':
             self.login(self.config.imap.user, self.config.imap.password)
+            self.negotiate()
         if self.state() == 'AUTH':
             self.create_folder(self.config.directory, connect=False)
         if self.state() != 'SELECTED':
             raise exceptions.LoginError('Unable to connect')
+        self.last_used = time()
+
+    def negotiate(self):
+        """cache the capabilities of the server once after login (from the
+        response of LOGIN or with one CAPABILITY) and enable QRESYNC
+        """
+        self.capability_set = frozenset(
+            capability.upper() for capability in
+            IMAPClient.capabilities(self))
+        self.qresync = self.has_capability('QRESYNC') and \
+            b'QRESYNC' in self.enable('QRESYNC')
+
+    def capabilities(self):
+        """
+        :returns: tuple of the capabilities (bytes), cached after login
+        """
+        if self.capability_set is None:
+            return IMAPClient.capabilities(self)
+        return tuple(sorted(self.capability_set))
+
+    def has_capability(self, capability):
+        """
+        :param capability: name like 'UIDPLUS'
+        :returns: True if the server has it, without a round trip after
+            login
+        """
+        if self.capability_set is None:
+            return IMAPClient.has_capability(self, capability)
+        if isinstance(capability, str):
+            capability = capability.encode('ascii')
+        return capability.upper() in self.capability_set
+
+    def reconnect(self):
+        """open a new connection and select the folder that was selected"""
+        folder = self.current_folder
+        self.init()
+        self.connect()
+        if folder:
+            self.select_folder(folder, connect=False)
+
+    def execute(self, func, idempotent, *args, **kwargs):
+        """run func(self, *args, **kwargs) as described in *reconnecting*
+        :returns: result of func
+        """
+        if not self.optimistic or \
+                time() - self.last_used > self.config.imap.idle_probe:
+            self.connect()
+        try:
+            result = func(self, *args, **kwargs)
+        except CONNECTION_LOST:
+            self.reconnect()
+            if not idempotent:
+                raise
+            result = func(self, *args, **kwargs)
+        self.last_used = time()
+        return result
 
     def is_ok(self):
         """ test if the imap connection is ok
@@ -72,6 +285,13 @@ class Imap(IMAPClient):
             return False
         return True
 
+    @contextmanager
+    def connection(self, folder=None):  # pylint: disable=unused-argument
+        """counterpart of ImapPool.connection for a single connection
+        :param folder: ignored, there is only this connection
+        """
+        yield self
+
     def state(self):
         """get the state of the imap connection
         :returns: IMAP4.Commands
@@ -94,47 +314,165 @@ class Imap(IMAPClient):
             folder = folder[0:-1]
         return folder
 
+    def folder_error(self, error):
+        """forget the cached folders if error says that a folder is missing
+        :param error: exception of a failed command
+        :returns: True if the cache has been invalidated
+        """
+        if any(code in str(error) for code in FOLDER_ERRORS):
+            self.folders.invalidate()
+            return True
+        return False
+
+    def pipeline(self, commands):
+        """send independent commands at once and read the responses after
+        all of them are sent, so together they cost about one round trip.
+        The untagged responses are collected in self._imap.untagged_responses
+        :param commands: list of tuples (name, args) or (name, args,
+            literal), name like 'CREATE' or 'UID', args as str or bytes,
+            e.g. ('FETCH', '1:5', '(FLAGS)'), literal as bytes after args.
+            Without LITERAL+ a literal waits for the continuation of the
+            server (one round trip each)
+        :returns: list of tuples (typ, data) of the tagged responses
+        :raises IMAPClientError: if one of them failed, after all are read
+        :raises IMAP4.abort: if the connection is lost (not wrapped)
+        """
+        # pylint: disable=protected-access
+        tags = [self._send_command(*command) for command in commands]
+        results, error = [], None
+        for (name, *_), tag in zip(commands, tags):
+            try:
+                results.append(self._imap._command_complete(name, tag))
+            except CONNECTION_LOST:  # for the retry of *reconnecting*
+                raise
+            except IMAP4.error as err:  # BAD, read the others anyway
+                results.append(('BAD', [str(err).encode()]))
+                error = error or err
+        if error is not None:
+            raise exceptions.IMAPClientError(str(error))
+        return results
+
+    def _send_command(self, name, args, literal=None):
+        """send a command without reading the response
+        :returns: tag of the command
+        """
+        # pylint: disable=protected-access
+        if literal is None:
+            return self._imap._command(name, *args)
+        if not self.has_capability('LITERAL+'):
+            self._imap.literal = literal
+            return self._imap._command(name, *args)
+        tag = self._imap._new_tag()
+        line = b' '.join([tag, name.encode('ascii')] + [
+            arg.encode('ascii') if isinstance(arg, str) else arg
+            for arg in args if arg is not None])
+        self._imap.send(line + b' {%d+}\r\n' % len(literal) + literal + CRLF)
+        return tag
+
     # ### Overrides of IMAPClient methods: ###
     @timer
-    def list_folders(self, connect=True):  # pylint: disable=arguments-differ
-        if connect:
-            self.connect()
-        directory = self.config.directory
-        folders = IMAPClient.list_folders(self, directory=directory)
-        folders = [folder[2] for folder in folders
-                   if folder[2].startswith(directory)]
-        return folders
+    @reconnecting()
+    def list_folders(self, refresh=False):
+        # pylint: disable=arguments-differ
+        """folders below config.directory
+        LIST is only sent if the folders are not cached yet
+        :param refresh: send LIST even if the folders are cached
+        :returns: sorted list of folder paths
+        """
+        if refresh or not self.folders.loaded:
+            directory = self.config.directory
+            folders = IMAPClient.list_folders(self, directory=directory)
+            self.folders.load(folder[2] for folder in folders
+                              if folder[2].startswith(directory))
+        return list(self.folders)
 
     @timer
-    def create_folder(self, folder, connect=True):
-        # pylint: disable=arguments-differ
+    @reconnecting()
+    def create_folder(self, folder):
         response = False
-        if connect:
-            self.connect()
         folder = self.clean_folder_path(folder)
-        if folder not in self.list_folders(connect=connect):
-            response = IMAPClient.create_folder(self, folder)
+        if not self.folders.loaded:
+            self.list_folders()
+        if folder not in self.folders:
+            try:
+                response = IMAPClient.create_folder(self, folder)
+            except exceptions.IMAPClientError:
+                # maybe created by another client or as parent of a subfolder
+                if folder not in self.list_folders(refresh=True):
+                    raise
+            else:
+                self.folders.add(folder)
         if self.current_folder != folder:
-            self.select_folder(folder, connect=connect)
+            self.select_folder(folder)
         return response
 
     @timer
-    def select_folder(self, folder, connect=True):
-        # pylint: disable=arguments-differ
+    @reconnecting()
+    def create_folders(self, folders):
+        """create the missing ones of folders with pipelined CREATEs
+        Nothing is selected, unlike *create_folder*
+        :param folders: folder paths, parents before their subfolders
+        :returns: list of the created folders
+        """
+        folders = [self.clean_folder_path(folder) for folder in folders]
+        if not self.folders.loaded:
+            self.list_folders()
+        missing = [folder for folder in folders if folder not in self.folders]
+        results = self.pipeline(
+            [('CREATE', (self._normalise_folder(folder),))
+             for folder in missing])
+        created = []
+        for folder, (typ, _) in zip(missing, results):
+            if typ == 'OK':
+                self.folders.add(folder)
+                created.append(folder)
+        if len(created) < len(missing):
+            # maybe created by another client or as parent of a subfolder
+            existing = self.list_folders(refresh=True)
+            failed = [fldr for fldr in missing if fldr not in existing]
+            if failed:
+                raise exceptions.IMAPClientError(
+                    'Could not create {}'.format(', '.join(failed)))
+        return created
+
+    @timer
+    @reconnecting()
+    def rename_folder(self, old_name, new_name):
+        """rename folder and its subfolders
+        :returns: server response
+        """
+        old_name = self.clean_folder_path(old_name)
+        new_name = self.clean_folder_path(new_name)
+        response = IMAPClient.rename_folder(self, old_name, new_name)
+        self.folders.rename(old_name, new_name)
+        if self.current_folder == old_name:
+            self.current_folder = new_name
+        return response
+
+    @timer
+    @reconnecting()
+    def select_folder(self, folder):  # pylint: disable=arguments-differ
         """selects folder if exist"""
-        if connect:
-            self.connect()
         if folder != 'INBOX':
             folder = self.clean_folder_path(folder)
         if folder == self.current_folder:
             return True
         try:
-            result = IMAPClient.select_folder(self, folder)[b'READ-WRITE']
-            if result:
+            response = IMAPClient.select_folder(self, folder)
+            if response[b'READ-WRITE']:
                 self.current_folder = folder
+                self.select_state = (
+                    response.get(b'UIDVALIDITY'),
+                    response.get(b'UIDNEXT'),
+                    response.get(b'EXISTS'),
+                    response.get(b'HIGHESTMODSEQ'),
+                    )
                 return True
             return False
-        except IMAP4.error:
+        except CONNECTION_LOST:  # for the retry of *reconnecting*
+            raise
+        except IMAP4.error as error:
+            self.folder_error(error)
             return False
 
     def logout(self):
@@ -145,13 +483,62 @@ class Imap(IMAPClient):
         return result
 
     @timer
+    @reconnecting()
+    def uid_state(self, folder=None):
+        """cheap fingerprint of a folder that changes with every added
+        or removed message. Uses the response of a SELECT that has just
+        been sent, else STATUS (UIDVALIDITY UIDNEXT MESSAGES HIGHESTMODSEQ)
+        :param folder: folder path, default is self.current_folder
+        :returns: tuple (UIDVALIDITY, UIDNEXT, MESSAGES, HIGHESTMODSEQ)
+            HIGHESTMODSEQ is None if the server has no CONDSTORE
+        """
+        folder = self.clean_folder_path(folder) if folder \
+            else self.current_folder
+        if folder == self.current_folder and self.select_state \
+                and None not in self.select_state[:3]:
+            state, self.select_state = self.select_state, None
+            return state
+        what = ['UIDVALIDITY', 'UIDNEXT', 'MESSAGES']
+        if self.has_capability('CONDSTORE'):
+            what.append('HIGHESTMODSEQ')
+        status = IMAPClient.folder_status(self, folder, what)
+        return (
+            status[b'UIDVALIDITY'],
+            status[b'UIDNEXT'],
+            status[b'MESSAGES'],
+            status.get(b'HIGHESTMODSEQ'),
+            )
+
+    @timer
+    @reconnecting()
+    def changes_since(self, modseq):
+        """messages of the selected folder that changed after modseq
+        Needs CONDSTORE, vanished messages are only reported with QRESYNC
+        :param modseq: HIGHESTMODSEQ of an earlier uid_state
+        :returns: tuple ([changed uids], [vanished uids])
+        """
+        modifiers = ['CHANGEDSINCE {}'.format(modseq)]
+        if self.qresync:
+            modifiers.append('VANISHED')
+        data = self._command_and_check(
+            'fetch', '1:*', '(UID)', '({})'.format(' '.join(modifiers)),
+            uid=True,
+            )
+        changed = parse_fetch_response(
+            [item for item in data if item], self.normalise_times, True)
+        vanished = UidSet()
+        for item in self._imap.untagged_responses.pop('VANISHED', []):
+            vanished |= UidSet(item.split()[-1])
+        return sorted(changed), list(vanished)
+
+    @timer
+    @reconnecting()
     def search(self, folder=None, criteria=None, charset=None):
         # pylint: disable=arguments-differ
         """Get messages on current selected Imap folder
         criteria could also be 'ALL'
         :returns: All Message [ids] with *self.config.tag* in subject
         """
-        self.connect()
         self.select_folder(folder or self.current_folder)
         criteria = criteria or ['SUBJECT', self.config.tag]
         # self.connect()
@@ -159,26 +546,164 @@ class Imap(IMAPClient):
         return sorted(ret)
 
     @timer
+    @reconnecting()
     def fetch(self, messages, data, modifiers=None):
-        self.connect()
+        """UID FETCH with the uids as compressed uid set (1:3,7)
+        Long sets are split into several commands that are pipelined, the
+        results are merged
+        :param messages: uids as list, UidSet or sequence set like '1:3'
+        :returns: {uid: {item: value}}
+        """
         if not messages:
             raise AttributeError('No message uids')
-        return IMAPClient.fetch(self, messages, data, modifiers=modifiers)
+        if isinstance(messages, (float, int)):
+            messages = [int(messages)]
+        pieces = uid_pieces(messages)
+        args = [seq_to_parenstr_upper(data)]
+        if modifiers:
+            args.append(seq_to_parenstr_upper(modifiers))
+        untagged = self._imap.untagged_responses
+        untagged.pop('FETCH', None)  # unsolicited from before
+        for typ, text in self.pipeline(
+                [('UID', ['FETCH', str(piece)] + args)
+                 for piece in pieces]):
+            if typ != 'OK':
+                untagged.pop('FETCH', None)
+                raise exceptions.IMAPClientError(
+                    'UID FETCH failed: {}'.format(text))
+        fetched = parse_fetch_response(
+            [item for item in untagged.pop('FETCH', []) if item],
+            self.normalise_times, True)
+        if not all(isinstance(piece, UidSet) for piece in pieces):
+            return fetched  # '*', every uid may be requested
+        uid_set = UidSet.from_ranges(
+            uid_range for piece in pieces for uid_range in piece.ranges)
+        return {  # drop unsolicited responses of other messages
+            uid: values for uid, values in fetched.items() if uid in uid_set}
+
+    def iter_fetch(self, messages, data, chunk_size=1000, modifiers=None):
+        """UID FETCH chunk by chunk, only one chunk is held in memory
+        :param messages: uids as list, UidSet or sequence set like '1:3'
+        :param chunk_size: uids per FETCH command
+        :returns: generator of (uid, {item: value}), ordered by uid
+        """
+        if isinstance(messages, (float, int)):
+            messages = [int(messages)]
+        elif not all(isinstance(piece, UidSet)
+                     for piece in uid_pieces(messages)):  # '*'
+            messages = self.search(criteria=['UID', messages])
+        chunk = []
+        for uid in UidSet(messages):
+            chunk.append(uid)
+            if len(chunk) >= chunk_size:
+                yield from sorted(self.fetch(chunk, data, modifiers).items())
+                chunk = []
+        if chunk:
+            yield from sorted(self.fetch(chunk, data, modifiers).items())
 
     @timer
+    @reconnecting(idempotent=False)
     def append(self, folder, msg, flags=(), msg_time=None):
-        self.connect()
-        return IMAPClient.append(
-            self, folder, msg, flags=flags, msg_time=msg_time
-            )
+        self.select_state = None
+        try:
+            return IMAPClient.append(
+                self, folder, msg, flags=flags, msg_time=msg_time
+                )
+        except exceptions.IMAPClientError as error:
+            self.folder_error(error)
+            raise
+
+    @timer
+    @reconnecting(idempotent=False)
+    def append_messages(self, folder, msgs):
+        """append msgs with one MULTIAPPEND (RFC 3502) if the server supports
+        it, else with pipelined APPENDs
+        :param msgs: list of messages as str or bytes
+        :returns: list of the tagged response texts (bytes), one for
+            MULTIAPPEND, one per message else (see *appended_uids*)
+        :raises IMAPClientError: if a message could not be appended
+        """
+        self.select_state = None
+        msgs = [MapCRLF.sub(CRLF, msg.encode('utf-8') if isinstance(
+            msg, str) else msg) for msg in msgs]
+        if not msgs:
+            return []
+        try:
+            if self.has_capability('MULTIAPPEND'):
+                results = [self.multiappend(folder, msgs)]
+            else:
+                folder = self._normalise_folder(folder)
+                results = self.pipeline(
+                    [('APPEND', (folder,), msg) for msg in msgs])
+            for typ, data in results:
+                if typ != 'OK':
+                    raise exceptions.IMAPClientError(
+                        'APPEND failed: {}'.format(data[0]))
+        except exceptions.IMAPClientError as error:
+            self.folder_error(error)
+            raise
+        return [data[0] for _, data in results]
 
     @timer
+    @reconnecting(idempotent=False)
+    def copy_messages(self, messages, folder):
+        """UID COPY of messages of the selected folder to folder
+        Long uid sets are split into pipelined commands
+        :param messages: uids as list, UidSet or sequence set like '1:3'
+        :param folder: path of the target folder
+        :returns: {uid: new uid} from COPYUID, empty without UIDPLUS
+        :raises IMAPClientError: if a COPY failed
+        """
+        return self._transfer('COPY', messages, folder)
+
+    @timer
+    @reconnecting(idempotent=False)
+    def move_messages(self, messages, folder):
+        """UID MOVE (RFC 6851) of messages of the selected folder to folder,
+        without MOVE a UID COPY followed by *delete_messages*
+        :param messages: uids as list, UidSet or sequence set like '1:3'
+        :param folder: path of the target folder
+        :returns: {uid: new uid} from COPYUID, empty without UIDPLUS
+        :raises IMAPClientError: if a MOVE or COPY failed
+        """
+        if not self.has_capability('MOVE'):
+            copied = self._transfer('COPY', messages, folder)
+            self.delete_messages(messages)
+            return copied
+        return self._transfer('MOVE', messages, folder)
+
+    def _transfer(self, name, messages, folder):
+        """pipelined UID COPY or UID MOVE, see *copy_messages*"""
+        pieces = uid_pieces(messages)
+        if not pieces:
+            return {}
+        self.select_state = None
+        folder = self._normalise_folder(self.clean_folder_path(folder))
+        untagged = self._imap.untagged_responses
+        try:
+            results = self.pipeline([('UID', (name, str(piece), folder))
+                                     for piece in pieces])
+            for typ, data in results:
+                if typ != 'OK':
+                    raise exceptions.IMAPClientError(
+                        '{} failed: {}'.format(name, data[0]))
+        except exceptions.IMAPClientError as error:
+            self.folder_error(error)
+            raise
+        # COPY has COPYUID in the tagged OK, MOVE in an untagged one
+        texts = [data[0] for _, data in results] + untagged.pop('OK', [])
+        copied = {}
+        for text in texts:
+            copied.update(copied_uids(text) or {})
+        return copied
+
+    @timer
+    @reconnecting()
     def delete_folder(self, folder, allow_base=False):
         # pylint: disable=arguments-differ
         """delete folder and all sub folders recursive
         :returns: list of deleted folders and subfolders
         """
-        self.connect()
         deleted = []
         folder = self.clean_folder_path(folder)
         folders = [fldr for fldr in self.list_folders()
@@ -187,27 +712,66 @@ class Imap(IMAPClient):
         for fldr in folders:
             if allow_base or fldr != self.config.directory:
                 self.select_folder(self.config.directory)
-                response = IMAPClient.delete_folder(self, fldr)
-                if 'Delete completed'.encode() in response:
-                    deleted.append(fldr)
+                try:
+                    IMAPClient.delete_folder(self, fldr)
+                except CONNECTION_LOST:
+                    raise
+                except exceptions.IMAPClientError as error:
+                    self.folder_error(error)
+                    continue
+                self.folders.discard(fldr)
+                if self.current_folder == fldr:
+                    self.current_folder = None
+                deleted.append(fldr)
         return deleted
 
     @timer
+    @reconnecting()
     def delete_messages(self, messages, silent=False):
-        """delete message on the server
+        """delete messages of the selected folder on the server
+        UID STORE and, with UIDPLUS, UID EXPUNGE for exactly these uids
+        (else EXPUNGE) in one pipeline, long uid sets are split. The result
+        is checked with the EXPUNGE or VANISHED responses, no SEARCH after.
         :param messages: message uid(s) to delete
-        :returns: bool if uids are not in self.uids anymore
+        :param silent: unused, the flags of the messages are needed
+        :returns: bool if all uids that existed have been expunged
         """
-        self.connect()
-        if isinstance(messages, (str, float, int)):
+        # pylint: disable=unused-argument
+        if isinstance(messages, (float, int)):
             messages = [int(messages)]
-        IMAPClient.delete_messages(self, messages, silent=silent)
-        self.expunge()
-        return all(uid not in self.search() for uid in messages)
+        pieces = uid_pieces(messages)
+        if not pieces:
+            return True
+        self.select_state = None
+        untagged = self._imap.untagged_responses
+        for name in ('EXPUNGE', 'VANISHED'):
+            untagged.pop(name, None)  # unsolicited from before
+        untagged.pop('FETCH', None)
+        commands = [('UID', ('STORE', str(piece), '+FLAGS', '(\\Deleted)'))
+                    for piece in pieces]
+        if self.has_capability('UIDPLUS'):  # in the same round trip
+            commands += [('UID', ('EXPUNGE', str(piece))) for piece in pieces]
+        else:
+            commands.append(('EXPUNGE', ()))
+        for typ, text in self.pipeline(commands):
+            if typ != 'OK':
+                raise exceptions.IMAPClientError(
+                    'Deleting failed: {}'.format(text))
+        existing = set(parse_fetch_response(
+            [item for item in untagged.pop('FETCH', []) if item],
+            self.normalise_times, True))
+        expunged = len(untagged.pop('EXPUNGE', []))
+        vanished = UidSet()
+        for item in untagged.pop('VANISHED', []):
+            vanished |= UidSet(item.split()[-1])
+        if vanished:
+            return not UidSet(existing) - vanished
+        return expunged >= len(existing)
 
     @timer
+    @reconnecting()
     def expunge(self, messages=None):
-        self.connect()
+        self.select_state = None
         return IMAPClient.expunge(self, messages=messages)
 
     def uninstall(self):
@@ -0,0 +1,234 @@
+"""Imap connection pool
+Thread-safe pool of Imap connections that belong to the same Config.
+It can be used wherever a single Imap connection is expected:
+every method call is forwarded to a checked out connection, generators
+keep it until they are exhausted or closed.
+"""
+import threading
+from contextlib import contextmanager
+from imaplib import IMAP4
+from inspect import isgeneratorfunction
+from time import time
+from .imap import Imap, FolderCache
+
+__all__ = ['ImapPool']
+
+
+class ImapPool:
+    """Pool of Imap connections
+    A thread keeps its connection while it is inside of *connection()*,
+    so all calls of a compound operation run on the same socket.
+    :param config: Config Object with correct data
+    :param unsafe: Workaround for invalid ssl certificates (unproductive only)
+    :param min_size: connections that are opened at once and kept open
+    :param max_size: maximum of connections that are open at the same time
+    """
+    BROKEN = (IMAP4.abort, OSError)
+
+    def __init__(self, config, unsafe=False, min_size=None, max_size=None):
+        self.config = config
+        self.unsafe = unsafe
+        self.min_size = config.imap.pool_min if min_size is None else min_size
+        self.max_size = max(
+            config.imap.pool_max if max_size is None else max_size,
+            self.min_size,
+            1,
+            )
+        self.max_idle = config.imap.pool_max_idle
+        self.folders = FolderCache()
+        self._idle = []  # [(imap, last_used), ...] most recent last
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._local = threading.local()
+        for _ in range(self.min_size):
+            self._size += 1
+            self._idle.append((self._new(), time()))
+
+    @property
+    def size(self):
+        """
+        :returns: number of open connections (idle and checked out)
+        """
+        return self._size
+
+    def _new(self):
+        """open a new connection, the slot must be reserved before"""
+        try:
+            return Imap(self.config, self.unsafe, self.folders)
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+    def _discard(self, imap):
+        """logout connection and free its slot"""
+        imap.logout()
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    def _pick(self, folder):
+        """take an idle connection, prefer one that has folder selected
+        Must be called with self._cond acquired
+        """
+        if folder is not None:
+            for i, (imap, _) in enumerate(reversed(self._idle)):
+                if imap.current_folder == folder:
+                    return self._idle.pop(len(self._idle) - 1 - i)
+        return self._idle.pop()
+
+    def _acquire(self, folder=None, timeout=None):
+        """get a healthy connection that is not used by another thread"""
+        if folder is not None and folder != 'INBOX':
+            folder = self.clean_folder_path(folder)
+        while True:
+            with self._cond:
+                if not self._cond.wait_for(
+                        lambda: self._closed or self._idle
+                        or self._size < self.max_size, timeout):
+                    raise TimeoutError('No free Imap connection')
+                if self._closed:
+                    raise IMAP4.error('Imap pool is closed')
+                if self._idle:
+                    imap, last_used = self._pick(folder)
+                else:
+                    self._size += 1
+                    imap, last_used = None, None
+            if imap is None:
+                return self._new()
+            if time() - last_used < self.max_idle or imap.is_ok():
+                return imap
+            self._discard(imap)
+
+    def _release(self, imap, broken=False):
+        """give connection back to the pool or close it"""
+        if broken or self._closed:
+            self._discard(imap)
+            return
+        # other connections may change the folder while this one is idle
+        imap.select_state = None
+        now = time()
+        expired = []
+        with self._cond:
+            self._idle.append((imap, now))
+            while len(self._idle) > self.min_size and \
+                    now - self._idle[0][1] > self.max_idle:
+                expired.append(self._idle.pop(0)[0])
+            self._cond.notify()
+        for old in expired:
+            self._discard(old)
+
+    def checkout(self, folder=None, timeout=None):
+        """get a connection for exclusive use of the current thread
+        Nested checkouts of a thread return the same connection
+        :param folder: prefer a connection that has this folder selected
+        :param timeout: seconds to wait for a free connection (None: forever)
+        :returns: Imap connection, give it back with *checkin()*
+        """
+        local = self._local
+        if getattr(local, 'imap', None) is not None:
+            local.depth += 1
+            return local.imap
+        imap = self._acquire(folder, timeout)
+        local.imap, local.depth = imap, 1
+        return imap
+
+    def checkin(self, imap, broken=False):
+        """give back a connection that was taken by *checkout()*
+        :param imap: the connection to give back
+        :param broken: close the connection instead of reusing it
+        """
+        local = self._local
+        if getattr(local, 'imap', None) is imap:
+            local.depth -= 1
+            if local.depth:
+                return
+            local.imap = None
+        self._release(imap, broken=broken)
+
+    @contextmanager
+    def connection(self, folder=None, timeout=None):
+        """context manager for checkout and checkin
+        Connections that raise connection errors are evicted from the pool
+        :param folder: prefer a connection that has this folder selected
+        """
+        imap = self.checkout(folder, timeout)
+        try:
+            yield imap
+        except self.BROKEN:
+            self.checkin(imap, broken=True)
+            raise
+        except BaseException:
+            self.checkin(imap)
+            raise
+        else:
+            self.checkin(imap)
+
+    def is_ok(self):
+        """ test if the pool has a working connection
+        :returns: True if connection is ok
+        """
+        if self._closed:
+            return False
+        with self.connection() as imap:
+            return imap.is_ok()
+
+    def clean_folder_path(self, folder):
+        """see Imap.clean_folder_path (needs no connection)"""
+        return Imap.clean_folder_path(self, folder)
+
+    def logout(self):
+        """logout all idle connections and close the pool
+        Connections that are checked out get closed on checkin
+        :returns: response of the last logout or False
+        """
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._cond.notify_all()
+        result = False
+        for imap, _ in idle:
+            result = imap.logout()
+            with self._cond:
+                self._size -= 1
+        return result
+
+    def uninstall(self):
+        """delete root folder (self.config.directory) and logout"""
+        with self.connection() as imap:
+            imap.delete_folder(self.config.directory, allow_base=True)
+        return self.logout()
+
+    def __getattr__(self, name):
+        """forward everything else to a checked out connection
+        Attributes like current_folder belong to a single connection, they
+        are read from the one that the current thread has checked out
+        """
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if not callable(getattr(Imap, name, None)):
+            imap = getattr(self._local, 'imap', None)
+            if imap is None:
+                raise AttributeError(
+                    '{} of a pool can only be read inside of '
+                    'connection()'.format(name))
+            return getattr(imap, name)
+
+        if isgeneratorfunction(getattr(Imap, name)):
+            def forward(*args, **kwargs):
+                """checked out while the generator runs, not only while
+                it is created (e.g. iter_fetch)
+                """
+                with self.connection() as imap:
+                    yield from getattr(imap, name)(*args, **kwargs)
+        else:
+            def forward(*args, **kwargs):
+                with self.connection() as imap:
+                    return getattr(imap, name)(*args, **kwargs)
+        forward.__name__ = name
+        return forward
+
+    def __str__(self):
+        return self.config.imap.user
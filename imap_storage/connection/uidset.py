@@ -0,0 +1,171 @@
+"""UidSet class
+Compact set of uids as sorted ranges, rendered as IMAP sequence set
+"""
+from bisect import bisect_right
+
+__all__ = ['UidSet', 'MAX_LENGTH']
+
+MAX_LENGTH = 8000  # characters of a set in one command (RFC 7162: 8192)
+
+
+class UidSet:
+    """sorted, non-overlapping and non-adjacent ranges of uids
+    Iteration yields the uids in ascending order, str() renders
+    '1:500,502,510:900'.
+    :param uids: iterable of uids, a UidSet or a sequence set like b'1:3,7'
+    """
+    def __init__(self, uids=()):
+        if isinstance(uids, UidSet):
+            self._ranges = list(uids.ranges)
+        elif isinstance(uids, (str, bytes)):
+            self._ranges = self._merge(self._parse(uids))
+        elif isinstance(uids, int):
+            self._ranges = [(uids, uids)]
+        else:
+            self._ranges = self._merge((uid, uid) for uid in uids)
+
+    @classmethod
+    def from_ranges(cls, ranges):
+        """
+        :param ranges: iterable of tuples (first, last), inclusive
+        :returns: new UidSet
+        """
+        uid_set = cls()
+        uid_set._ranges = cls._merge(ranges)  # pylint: disable=protected-access
+        return uid_set
+
+    @classmethod
+    def expand(cls, text):
+        """uids of a sequence set in the order in which they are listed,
+        like the uid sets of APPENDUID and COPYUID (RFC 4315)
+        :param text: sequence set as str or bytes, e.g. '7,3:5'
+        :returns: list of uids, e.g. [7, 3, 4, 5]
+        """
+        return [uid for start, end in cls._parse(text)
+                for uid in range(start, end + 1)]
+
+    @staticmethod
+    def _parse(text):
+        if isinstance(text, bytes):
+            text = text.decode('ascii')
+        for part in text.split(','):
+            if ':' in part:
+                start, end = sorted(int(uid) for uid in part.split(':'))
+                yield start, end
+            elif part.strip():
+                yield int(part), int(part)
+
+    @staticmethod
+    def _merge(ranges):
+        merged = []
+        for start, end in sorted((int(start), int(end))
+                                 for start, end in ranges):
+            if merged and start <= merged[-1][1] + 1:
+                if end > merged[-1][1]:
+                    merged[-1] = (merged[-1][0], end)
+            else:
+                merged.append((start, end))
+        return merged
+
+    @property
+    def ranges(self):
+        """
+        :returns: tuple of (first, last) tuples
+        """
+        return tuple(self._ranges)
+
+    def union(self, other):
+        """
+        :returns: new UidSet with the uids of both
+        """
+        return self.from_ranges(self._ranges + UidSet(other)._ranges)
+
+    def intersection(self, other):
+        """
+        :returns: new UidSet with the uids that are in both
+        """
+        result = []
+        ours, theirs = self._ranges, UidSet(other)._ranges
+        i = j = 0
+        while i < len(ours) and j < len(theirs):
+            start = max(ours[i][0], theirs[j][0])
+            end = min(ours[i][1], theirs[j][1])
+            if start <= end:
+                result.append((start, end))
+            if ours[i][1] < theirs[j][1]:
+                i += 1
+            else:
+                j += 1
+        return self.from_ranges(result)
+
+    def difference(self, other):
+        """
+        :returns: new UidSet with the uids that are not in other
+        """
+        result = []
+        theirs = UidSet(other)._ranges
+        j = 0
+        for start, end in self._ranges:
+            while j < len(theirs) and theirs[j][1] < start:
+                j += 1
+            k = j
+            while start <= end:
+                if k == len(theirs) or theirs[k][0] > end:
+                    result.append((start, end))
+                    break
+                if theirs[k][0] > start:
+                    result.append((start, theirs[k][0] - 1))
+                start = theirs[k][1] + 1
+                k += 1
+        return self.from_ranges(result)
+
+    def split(self, max_length=MAX_LENGTH):
+        """split into sets that can be sent in one command each
+        :param max_length: maximum characters of every rendered set
+        :returns: list of UidSet, together they hold all uids
+        """
+        pieces, current, length = [], [], -1
+        for start, end in self._ranges:
+            text = str(start) if start == end else '{}:{}'.format(start, end)
+            if current and length + 1 + len(text) > max_length:
+                pieces.append(self.from_ranges(current))
+                current, length = [], -1
+            current.append((start, end))
+            length += 1 + len(text)
+        if current:
+            pieces.append(self.from_ranges(current))
+        return pieces
+
+    __or__ = union
+    __and__ = intersection
+    __sub__ = difference
+
+    def __len__(self):
+        return sum(end - start + 1 for start, end in self._ranges)
+
+    def __bool__(self):
+        return bool(self._ranges)
+
+    def __iter__(self):
+        for start, end in self._ranges:
+            yield from range(start, end + 1)
+
+    def __contains__(self, uid):
+        i = bisect_right(self._ranges, (int(uid), float('inf'))) - 1
+        return i >= 0 and self._ranges[i][0] <= int(uid) <= self._ranges[i][1]
+
+    def __eq__(self, other):
+        if not isinstance(other, UidSet):
+            return NotImplemented
+        return self._ranges == other._ranges
+
+    def __hash__(self):
+        return hash(tuple(self._ranges))
+
+    def __str__(self):
+        return ','.join(
+            str(start) if start == end else '{}:{}'.format(start, end)
+            for start, end in self._ranges)
+
+    def __repr__(self):
+        return '{}({!r})'.format(self.__class__.__name__, str(self))
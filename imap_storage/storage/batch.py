@@ -0,0 +1,56 @@
+"""UnitOfWork class
+Saves and deletes that are deferred until the end of a transaction,
+see Storage.transaction and Directory.batch
+"""
+
+__all__ = ['UnitOfWork']
+
+
+class UnitOfWork:
+    """collects the changes of a transaction and sends them at once
+    Emails that are changed or saved more than once are saved once,
+    deleted messages go out in one UID STORE and one EXPUNGE per directory
+    """
+    def __init__(self):
+        self.dirty = []  # emails, in the order of their first change
+        self.deleted = {}  # {path: (directory, set of uids)}
+        self.callbacks = []
+        self.flushing = False
+
+    def save(self, email):
+        """save email when the transaction ends"""
+        if all(email is not other for other in self.dirty):
+            self.dirty.append(email)
+
+    def delete(self, directory, uids):
+        """delete messages of directory when the transaction ends"""
+        self.deleted.setdefault(
+            directory.path, (directory, set()))[1].update(uids)
+
+    def pending(self, directory):
+        """
+        :returns: set of uids of directory that will be deleted
+        """
+        return self.deleted.get(directory.path, (None, set()))[1]
+
+    def after(self, func, *args):
+        """call func(*args) after everything else is sent"""
+        self.callbacks.append((func, args))
+
+    def flush(self):
+        """save the dirty emails, then send the deletes per directory
+        (including the replaced messages of the saved emails)
+        """
+        self.flushing = True
+        try:
+            for email in self.dirty:
+                email.save()
+            for directory, uids in self.deleted.values():
+                with directory.selected() as imap:
+                    imap.delete_messages(sorted(uids))
+                directory.refresh()
+            for func, args in self.callbacks:
+                func(*args)
+        finally:
+            self.dirty, self.deleted, self.callbacks = [], {}, []
+            self.flushing = False
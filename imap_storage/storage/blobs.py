@@ -0,0 +1,177 @@
+"""BlobStore class
+Content addressed storage of file payloads (see Config.dedup and
+Config.layout).
+Every payload is stored once in the blob folder below config.directory,
+file entries in the xml bodies reference it by its sha256.
+"""
+from base64 import b64decode
+from contextlib import contextmanager
+from hashlib import sha256
+from .directory import Directory
+from .email.head import message_id
+
+__all__ = ['BlobStore', 'BLOB_FOLDER']
+
+BLOB_FOLDER = 'blobs'
+BLOB_HEADER = 'X-Imap-Storage-Blob'  # sha256 of the payload
+REF_HEADER = 'X-Imap-Storage-Blob-Ref'  # sha256 of the referenced blob
+
+
+class BlobStore:
+    """payloads stored once in a folder and referenced by their hash
+    Every reference is a small marker message next to the blob, so
+    processes that share the account only append and delete messages and
+    never rewrite shared state. A blob without markers is swept: it is
+    flagged \\Deleted and only expunged if no marker has appeared in the
+    meantime. *put* appends its marker before it looks for the blob and
+    ignores flagged blobs, so it either keeps the blob alive or stores it
+    again. Without UIDPLUS every EXPUNGE removes all flagged messages,
+    blobs are not swept then.
+    :param storage: Storage object
+    """
+    def __init__(self, storage):
+        self.storage = storage
+        self.path = storage.clean_folder_path(BLOB_FOLDER)
+        self.directory = Directory(storage, self.path)
+        self._uids = {}  # {hash: uid}
+
+    @staticmethod
+    def digest(data):
+        """
+        :param data: payload as bytes
+        :returns: sha256 of data as hex string
+        """
+        return sha256(data).hexdigest()
+
+    @contextmanager
+    def selected(self):
+        """connection that has the blob folder selected, creates it"""
+        with self.directory.imap.connection(self.path) as imap:
+            imap.create_folder(self.path)
+            imap.select_folder(self.path)
+            yield imap
+
+    def _search(self, header, value):
+        """
+        :returns: uids of the messages that are not flagged \\Deleted
+        """
+        with self.selected() as imap:
+            return imap.search(
+                criteria=['UNDELETED', 'HEADER', header, value])
+
+    def _add_refs(self, digests):
+        """append one marker message per digest"""
+        markers = [self.directory.data_message(
+            'blob ref {}'.format(digest), {REF_HEADER: digest}, b'')
+                   for digest in digests]
+        with self.selected() as imap:
+            imap.append_messages(self.path, markers)
+
+    def _sweep(self, imap, digest):
+        """delete the blob if it has no marker, see the class
+        :returns: True if it is gone
+        """
+        if not imap.has_capability('UIDPLUS'):
+            return False
+        uids = self._search(BLOB_HEADER, digest)
+        if uids:
+            imap.add_flags(uids, [b'\\Deleted'])
+            if self._search(REF_HEADER, digest):  # referenced meanwhile
+                imap.remove_flags(uids, [b'\\Deleted'])
+                return False
+            imap.expunge(uids)
+        self._uids.pop(digest, None)
+        return True
+
+    def uid(self, digest):
+        """
+        :param digest: hash of the blob
+        :returns: uid of the blob message or None
+        """
+        if digest not in self._uids:
+            uids = self._search(BLOB_HEADER, digest)
+            if not uids:
+                return None
+            self._uids[digest] = uids[0]
+        return self._uids[digest]
+
+    def refs(self, digest):
+        """
+        :param digest: hash of the blob
+        :returns: number of references to the blob
+        """
+        return len(self._search(REF_HEADER, digest))
+
+    def put(self, data):
+        """add a reference and store data if it is not stored yet
+        A duplicate only appends a marker
+        :param data: payload as bytes
+        :returns: hash of data
+        """
+        digest = self.digest(data)
+        self._add_refs([digest])  # before looking for the blob
+        self._uids.pop(digest, None)
+        if self.uid(digest) is None:
+            msg_id = message_id(digest)
+            message = self.directory.data_message(
+                'blob {}'.format(digest), {
+                    BLOB_HEADER: digest,
+                    'Message-ID': msg_id,
+                    }, data)
+            with self.selected() as imap:
+                self._uids[digest] = self.directory.appended_uid(
+                    imap, imap.append(self.path, message), msg_id)
+        return digest
+
+    def retain(self, digests):
+        """add a reference to stored blobs, e.g. for copied emails
+        :param digests: hashes of the blobs, once per reference
+        :raises KeyError: if a blob is not stored
+        """
+        digests = list(digests)
+        self._add_refs(digests)  # before looking for the blobs, like put
+        for digest in set(digests):
+            self._uids.pop(digest, None)
+            if self.uid(digest) is None:
+                for _ in range(digests.count(digest)):
+                    self.release(digest)
+                raise KeyError('Blob {} is not stored'.format(digest))
+
+    def release(self, digest):
+        """remove a reference, sweep the blob if it was the last one
+        :param digest: hash of the blob
+        :returns: number of references left
+        """
+        with self.selected() as imap:
+            markers = self._search(REF_HEADER, digest)
+            if markers:
+                imap.delete_messages(markers[:1])
+            if len(markers) <= 1:
+                self._sweep(imap, digest)
+        return max(len(markers) - 1, 0)
+
+    def fetch_part(self, digest, offset=None, length=None):
+        """fetch the stored (base64 encoded) data of a blob
+        :param digest: hash of the blob
+        :param offset: first byte of a partial fetch
+        :param length: maximum bytes of a partial fetch
+        :returns: bytes
+        """
+        with self.selected():
+            try:
+                return self.storage.get_part(
+                    self.uid(digest), '1', offset, length)
+            except KeyError:  # cached uid, stored again by someone else
+                self._uids.pop(digest, None)
+                return self.storage.get_part(
+                    self.uid(digest), '1', offset, length)
+
+    def get(self, digest):
+        """
+        :param digest: hash of the blob
+        :returns: data of the blob as bytes
+        """
+        data = b64decode(b''.join(self.fetch_part(digest).split()))
+        if self.digest(data) != digest:
+            raise ValueError('Blob {} is damaged'.format(digest))
+        return data
@@ -1,13 +1,26 @@
 """Directory class
 This represents a physical directory at storage level (imap)
 """
-from .email.email import Email
+from base64 import b64decode
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from email import encoders
+from email.mime.base import MIMEBase
+from email.utils import formatdate
+from ..connection.imap import appended_uids
+from ..connection.uidset import UidSet
+from .email.email import Email, FIELDS
 from .email.address import Address
-from ..tools.compare import list_compare
+from .email.head import message_id, parse_header_fields
+from .index import EmailIndex
+
+CHUNK_HEADER = 'X-Imap-Storage-Chunk'  # file id, index, count
 
 
 class Directory:  # :TODO: # pylint: disable=too-many-public-methods
     """Directory class"""
+    email_class = Email  # class of the emails that new_email creates
+
     def __init__(self, storage, folder):
         self.storage = storage
         self.imap = storage.imap
@@ -17,6 +30,7 @@ class Directory:  # :TODO: # pylint: disable=too-many-public-methods
         self.path = folder
         self._emails = None
         self._uids = None
+        self._uid_state = None
 
     @property
     def parent(self):
@@ -64,39 +78,125 @@ class Directory:  # :TODO: # pylint: disable=too-many-public-methods
 
     @property
     def uids(self):
-        """keep this uptodate because self.emails compares to it"""
-        if self._uids is None or True:  # ever refreshing
-            self.imap.create_folder(self.path)
-            self._uids = self.imap.search()
+        """keep this uptodate because self.emails compares to it
+        Cached, SEARCH is only sent again if the uid state of the folder
+        (UIDVALIDITY, UIDNEXT, MESSAGES) has changed and the changes
+        cannot be synchronized incrementally (see *sync*)
+        """
+        with self.imap.connection(self.path) as imap:
+            imap.create_folder(self.path)
+            state = imap.uid_state(self.path)
+            if self._uids is None or state[0] != self._uid_state[0]:
+                self._uids = imap.search()
+            elif state != self._uid_state and not self.sync(imap, state):
+                self._uids = imap.search()
+            self._uid_state = state
+        work = self.storage.work
+        if work is not None and work.pending(self):  # deleted at the end
+            pending = work.pending(self)
+            return [uid for uid in self._uids if uid not in pending]
         return self._uids
 
     @property
     def emails(self):
-        """cannot be dynamic because of self.fetch methods"""
+        """cannot be dynamic because of self.fetch methods
+
+        Returns:
+            EmailIndex: emails ordered and indexed by uid
+        """
+        uids = self.uids
         if self._emails is None:
-            self._emails = [Email(self, uid) for uid in self.uids]
+            self._emails = EmailIndex(Email(self, uid) for uid in uids)
         else:
-            email_uids = [email.uid for email in self._emails if email.uid]
-            rem, add = list_compare(email_uids, self.uids)
-            for uid in rem:
-                self._emails.remove(Email(self, uid))
-            for uid in add:
-                self._emails.append(Email(self, uid))
+            self._emails.sync(uids, lambda uid: Email(self, uid))
         return self._emails
 
+    def indexed(self, email):
+        """
+        Args:
+            email(Email): email of this directory
+
+        Returns:
+            bool: True if email is the object in the cached *emails*
+        """
+        return self._emails is not None and \
+            self._emails.get(email.uid) is email
+
     @property
     def files(self):
         """List files of all emails inside this directory
+        Only metadata, it is fetched for all emails at once
 
         Returns:
             list: of files
         """
         files = []
-        for email in self.emails:
+        emails = self.emails
+        self.fetch_files(
+            [email for email in emails if not email.files_loaded])
+        for email in emails:
             for file in email.files:
                 files.append(file)
         return files
 
+    def iter_emails(self, prefetch=FIELDS, batch=100, files=False):
+        """generator of the emails of this directory, batch by batch
+        With a pool the next batch is fetched in the background while the
+        current one is consumed. New emails are not cached in *emails*,
+        so the memory does not grow with the folder.
+
+        Args:
+            prefetch(tuple, optional): fields to fetch (see *prefetch*),
+                None fetches nothing
+            batch(int, optional): emails per batch
+            files(bool, optional): fetch the file metadata, too
+
+        Yields:
+            Email: ordered by uid
+        """
+        uids = self.uids
+        cached = self._emails or {}
+
+        def load(chunk):
+            emails = [cached.get(uid) or Email(self, uid) for uid in chunk]
+            if prefetch:
+                self.prefetch(prefetch, emails)
+            if files:
+                self.fetch_files(
+                    [email for email in emails if not email.files_loaded])
+            return emails
+
+        batches = (uids[i:i + batch] for i in range(0, len(uids), batch))
+        if self.transfer_workers < 2:  # one connection, no read-ahead
+            for chunk in batches:
+                yield from load(chunk)
+            return
+        with ThreadPoolExecutor(1) as executor:
+            loading = None
+            for chunk in batches:
+                following = executor.submit(load, chunk)
+                if loading is not None:
+                    yield from loading.result()
+                loading = following
+            if loading is not None:
+                yield from loading.result()
+
+    def iter_files(self, batch=100, prefetch=FIELDS):
+        """generator of the files of this directory, like *files* but the
+        metadata is fetched batch by batch (see *iter_emails*)
+
+        Args:
+            batch(int, optional): emails per batch
+            prefetch(tuple, optional): fields of the emails of the files
+                to fetch with them (see *prefetch*)
+
+        Yields:
+            File: ordered by uid of their email
+        """
+        for email in self.iter_emails(prefetch=prefetch, batch=batch,
+                                      files=True):
+            yield from email.files
+
     @property
     def app_name(self):  # :TODO:
         """the name of the application of this directory
@@ -130,6 +230,49 @@ class Directory:  # :TODO: # pylint: disable=too-many-public-methods
             url = self.path
         return url.replace('.', '/')
 
+    @contextmanager
+    def selected(self):
+        """checkout a connection that has this directory selected
+        Storage methods that are called inside use the same connection
+
+        Returns:
+            Imap: connection
+        """
+        with self.imap.connection(self.path) as imap:
+            imap.select_folder(self.path)
+            yield imap
+
+    def sync(self, imap, state):
+        """apply the changes since the cached uid state to the cached uids
+        and emails, so the cost depends on the changes, not the folder size.
+        Needs CONDSTORE, without QRESYNC only if no message was removed.
+
+        Args:
+            imap(Imap): connection that has this directory selected
+            state(tuple): new uid state (see Imap.uid_state)
+
+        Returns:
+            bool: False if the changes are unknown and a SEARCH is needed
+        """
+        old_state = self._uid_state
+        if state[3] is None or old_state[3] is None:
+            return False
+        changed, vanished = imap.changes_since(old_state[3])
+        new = [uid for uid in changed if uid >= old_state[1]]
+        if not imap.qresync and state[2] != old_state[2] + len(new):
+            return False  # something has been removed
+        if new:
+            new = [uid for piece in UidSet(new).split()
+                   for uid in imap.search(criteria=[
+                       'UID', str(piece), 'SUBJECT', self.imap.config.tag])]
+        vanished = set(vanished)
+        self._uids = sorted(
+            set(uid for uid in self._uids if uid not in vanished) | set(new))
+        if self._emails is not None:
+            self._emails.discard_many(vanished)
+            self._emails.update(Email(self, uid) for uid in new)
+        return True
+
     def refresh(self):
         """refresh the directories cached properties"""
         self._uids = None
@@ -143,11 +286,7 @@ class Directory:  # :TODO: # pylint: disable=too-many-public-methods
         Returns:
             Email: if email with uid exists in this directory or None
         """
-        uid = int(uid)
-        for email in self.emails:
-            if email.uid == uid:
-                return email
-        return None
+        return self.emails.get(int(uid))
 
     def add_file_email(self, file):
         """Create new Email with one file
@@ -163,9 +302,41 @@ class Directory:  # :TODO: # pylint: disable=too-many-public-methods
         email = self.new_email(file.name)
         email.add_file(file)
         email.save()
+        if email.uid is None:  # saved at the end of the transaction
+            return email
         self.refresh()
         return self.email_by_uid(email.uid)
 
+    def add_files(self, files, batch=100):
+        """Create one Email per file like *add_file_email*, for many files
+        The names of the stored files are read once, files with a name
+        that exists (or came before in files) are skipped. The emails are
+        sent batch by batch, see *save_messages*. Unlike *save* this is
+        not deferred by a transaction.
+
+        Args:
+            files(iterable): File objects
+            batch(int, optional): emails per MULTIAPPEND
+
+        Returns:
+            list: uids of the new emails in the order of files
+        """
+        names = {file.name for file in self.files}
+        uids, emails = [], []
+        for file in files:
+            if file.name in names:
+                continue
+            names.add(file.name)
+            email = self.new_email(file.name)
+            email.add_file(file)
+            emails.append(email)
+            if len(emails) >= batch:
+                uids += self.save_messages(emails)
+                emails = []
+        if emails:
+            uids += self.save_messages(emails)
+        return uids
+
     def file_by_name(self, name):
         """get file by name
 
@@ -191,7 +362,7 @@ class Directory:  # :TODO: # pylint: disable=too-many-public-methods
             addr_spec=config.imap.user,
             display_name=config.imap.user
             )
-        email = Email(self, None)
+        email = self.email_class(self, None)
         email.head = email.new_head(
             '{} {}'.format(self.imap.config.tag, item_name),
             from_addr_obj,
@@ -210,13 +381,326 @@ class Directory:  # :TODO: # pylint: disable=too-many-public-methods
         Returns:
             bool: True if success
         """
-        if isinstance(email_uid_or_obj, Email):
-            uid = email_uid_or_obj.uid
-        else:
-            uid = email_uid_or_obj
-        result = self.imap.delete_messages([uid])  # immer true :-(
+        return self.delete_emails([email_uid_or_obj])
+
+    def delete_emails(self, emails):
+        """delete many emails within this directory at once
+        Their chunks are deleted with them, their blobs are released.
+
+        Args:
+            emails(iterable): Email objects or uids
+
+        Returns:
+            bool: True if success
+        """
+        emails = self._email_objects(emails)
+        if not emails:
+            return True
+        uids, blobs = self._stored_with(emails)
+        result = self.expunge_uids(uids)
+        if result:
+            for digest in blobs:
+                self.storage.deferred(self.storage.blobs.release, digest)
+            if self._emails is not None:
+                self._emails.discard_many(uids)
         return result
 
+    def _email_objects(self, emails):
+        """
+        :param emails: iterable of Email objects or uids of this directory
+        :returns: list of Email objects
+        """
+        emails = list(emails)
+        if all(isinstance(item, Email) for item in emails):
+            return emails
+        index = self.emails  # checks the uid state once, not per uid
+        return [item if isinstance(item, Email) else
+                index.get(int(item)) or Email(self, int(item))
+                for item in emails]
+
+    def _stored_with(self, emails):
+        """messages and blobs that belong to emails
+        :returns: tuple ([uids of the emails and their chunks], [blobs])
+        """
+        self.fetch_files([email for email in emails if not email.files_loaded])
+        uids, blobs = [], []
+        for email in emails:
+            uids.append(email.uid)
+            for file in email.files:
+                if file.chunked:
+                    uids.extend(self.find_chunks(file).values())
+                elif file.blob:
+                    blobs.append(file.blob)
+        return uids, blobs
+
+    def move_emails(self, emails, directory):
+        """move emails with their chunk messages to another directory on
+        the server (UID MOVE or UID COPY and UID EXPUNGE), nothing is
+        downloaded or uploaded. The Email objects move with them, the
+        cached emails of both directories are updated from COPYUID.
+        Unlike *delete_emails* this is not deferred by a transaction.
+
+        Args:
+            emails(iterable): Email objects or uids of this directory
+            directory(Directory): target directory
+
+        Returns:
+            dict: {old uid: new uid} of the emails, new uid is None if
+                the server has no UIDPLUS
+        """
+        emails = self._email_objects(emails)
+        moved = self._transfer(emails, directory, move=True)
+        for email in emails:
+            email.directory = directory
+            email.uid = moved[email.uid]
+        if directory._emails is not None:  # pylint: disable=protected-access
+            directory._emails.update(  # pylint: disable=protected-access
+                email for email in emails if email.uid)
+        return moved
+
+    def copy_emails(self, emails, directory):
+        """copy emails with their chunk messages to another directory on
+        the server, like *move_emails*. Their blobs get a reference more.
+
+        Args:
+            emails(iterable): Email objects or uids of this directory
+            directory(Directory): target directory
+
+        Returns:
+            dict: {old uid: new uid} of the emails, new uid is None if
+                the server has no UIDPLUS
+        """
+        return self._transfer(self._email_objects(emails), directory)
+
+    def _transfer(self, emails, directory, move=False):
+        """UID MOVE or UID COPY of emails to directory, see *move_emails*
+        :returns: {old uid: new uid or None}
+        """
+        if not emails:
+            return {}
+        uids, blobs = self._stored_with(emails)
+        with self.selected() as imap:
+            imap.create_folders([directory.path])
+            if move:
+                copied = imap.move_messages(uids, directory.folder)
+            else:
+                copied = imap.copy_messages(uids, directory.folder)
+        if blobs and not move:
+            self.storage.blobs.retain(blobs)
+        if move and self._emails is not None:
+            self._emails.discard_many(uids)
+        transferred = {email.uid: copied.get(email.uid) for email in emails}
+        if None in transferred.values():
+            directory.refresh()
+        else:
+            directory.appended(sorted(transferred.values()))
+        return transferred
+
+    # ### Chunked files ###
+    @property
+    def transfer_workers(self):
+        """
+        Returns:
+            int: number of chunks that are transferred in parallel
+        """
+        return max(1, getattr(self.imap, 'max_size', 1))
+
+    def data_message(self, subject, headers, data):
+        """build a message that only holds data (base64 encoded)
+        Its subject has no tag, so it is not listed in self.emails
+
+        Args:
+            subject(str): subject of the message
+            headers(dict): more header fields {name: value}
+            data(bytes): payload
+
+        Returns:
+            str: message
+        """
+        msg = MIMEBase('application', 'octet-stream')
+        msg.set_payload(data)
+        encoders.encode_base64(msg)
+        msg['From'] = msg['To'] = self.imap.config.imap.user
+        msg['Subject'] = subject
+        msg['Date'] = formatdate(localtime=True)
+        for name, value in headers.items():
+            msg[name] = value
+        return str(msg)
+
+    def chunk_message(self, file, index, count, data):
+        """build the message of one chunk
+
+        Args:
+            file(File): chunked file
+            index(int): number of the chunk, starting at 0
+            count(int): number of chunks of the file
+            data(bytes): data of the chunk
+
+        Returns:
+            str: message
+        """
+        return self.data_message(
+            'chunk {} {}/{}'.format(file.id_, index + 1, count),
+            {CHUNK_HEADER: '{} {} {}'.format(file.id_, index, count),
+             'Message-ID': message_id('{}.{}'.format(file.id_, index))},
+            data,
+            )
+
+    def upload_chunks(self, file):
+        """append the chunk messages of a file, in parallel
+        Chunks that are already stored (e.g. by an interrupted upload of
+        the same file) are not uploaded again
+
+        Args:
+            file(File): chunked file with data and id
+
+        Returns:
+            list: [(index, uid, size), ...]
+        """
+        data = file.payload()
+        size = file.chunk_size
+        count = max(1, -(-len(data) // size))
+        stored = self.find_chunks(file)
+
+        def upload(index):
+            message = self.chunk_message(
+                file, index, count, data[index * size:(index + 1) * size])
+            with self.imap.connection(self.path) as imap:
+                return self.appended_uid(
+                    imap, imap.append(self.folder, message),
+                    message_id('{}.{}'.format(file.id_, index)))
+
+        missing = [index for index in range(count) if index not in stored]
+        with ThreadPoolExecutor(self.transfer_workers) as executor:
+            stored.update(zip(missing, executor.map(upload, missing)))
+        return [(index, stored[index],
+                 len(data[index * size:(index + 1) * size]))
+                for index in range(count)]
+
+    def find_chunks(self, file):
+        """search the stored chunk messages of a file
+
+        Args:
+            file(File): chunked file
+
+        Returns:
+            dict: {index: uid}
+        """
+        chunks = {}
+        with self.selected() as imap:
+            uids = imap.search(criteria=['HEADER', CHUNK_HEADER, file.id_])
+            if uids:
+                fetched = self.storage.get_header_fields(uids, [CHUNK_HEADER])
+                for uid, fields in fetched.items():
+                    value = fields.get(CHUNK_HEADER.lower(), '').split()
+                    if len(value) == 3 and value[0] == file.id_:
+                        chunks[int(value[1])] = uid
+        return chunks
+
+    def fetch_chunk(self, file, index):
+        """fetch and decode one chunk of a file
+        The stored uid is only a hint, the chunk is searched if it is gone
+        or is another message (e.g. after a move to another directory)
+
+        Args:
+            file(File): chunked file with chunks
+            index(int): number of the chunk
+
+        Returns:
+            bytes: data of the chunk
+        """
+        _, uid, size = file.chunks[index]
+        with self.selected() as imap:
+            data = self.chunk_part(imap, file, index, uid)
+            if data is None:  # moved, copied or gone
+                uid = self.find_chunks(file).get(index)
+                if uid is None:
+                    raise KeyError('Chunk {} of {} is missing'.format(
+                        index, file.name))
+                file.chunks[index] = (index, uid, size)
+                data = self.storage.get_part(uid, '1')
+        data = b64decode(b''.join(data.split()))
+        if len(data) != size:
+            raise ValueError('Chunk {} of {} is incomplete'.format(
+                index, file.name))
+        return data
+
+    @staticmethod
+    def chunk_part(imap, file, index, uid):
+        """fetch the data of a chunk message together with its chunk header
+
+        Args:
+            imap(Imap): connection that has this directory selected
+            file(File): chunked file
+            index(int): number of the chunk
+            uid(int): uid of the chunk message
+
+        Returns:
+            bytes: stored data or None if uid is not this chunk
+        """
+        item = 'BODY.PEEK[HEADER.FIELDS ({})]'.format(CHUNK_HEADER)
+        fetched = imap.fetch([uid], [item, 'BODY.PEEK[1]']).get(uid, {})
+        fields = {}
+        for key, value in fetched.items():
+            if key.startswith(b'BODY[HEADER'):
+                fields = parse_header_fields(value)
+        value = fields.get(CHUNK_HEADER.lower(), '').split()
+        if value[:2] != [file.id_, str(index)]:
+            return None
+        return fetched.get(b'BODY[1]') or b''
+
+    def fetch_chunks(self, file):
+        """fetch all chunks of a file in parallel
+
+        Args:
+            file(File): chunked file with chunks
+
+        Returns:
+            bytes: data of the file
+        """
+        with ThreadPoolExecutor(self.transfer_workers) as executor:
+            return b''.join(executor.map(
+                lambda index: self.fetch_chunk(file, index),
+                range(len(file.chunks))))
+
+    def delete_chunks(self, file):
+        """delete the chunk messages of a file
+
+        Args:
+            file(File): chunked file
+
+        Returns:
+            bool: True if success
+        """
+        uids = list(self.find_chunks(file).values())
+        return self.expunge_uids(uids) if uids else True
+
+    def expunge_uids(self, uids):
+        """delete messages of this directory by uid
+        Inside of a transaction (see *batch*) they are deleted at its end
+
+        Args:
+            uids(list): uids of the messages
+
+        Returns:
+            bool: True if success (or deferred)
+        """
+        work = self.storage.work
+        if work is not None:
+            work.delete(self, uids)
+            return True
+        with self.selected() as imap:
+            return imap.delete_messages(uids)
+
+    def batch(self):
+        """unit of work for the emails of this directory, see
+        Storage.transaction (it covers the whole storage)
+
+        Returns:
+            contextmanager: with directory.batch(): ...
+        """
+        return self.storage.transaction()
+
     def delete(self):
         """Delete this storage
 
@@ -229,6 +713,31 @@ class Directory:  # :TODO: # pylint: disable=too-many-public-methods
         return self.storage.delete_directory(self.path)
 
     # ### Fetch methods ###
+    def prefetch(self, fields=FIELDS, emails=None):
+        """fetch the listing fields of all emails in one chunked UID FETCH
+        and set them on the Email objects, so a listing needs no other
+        command. Bodies and files are not downloaded.
+
+        Args:
+            fields(tuple, optional): any of 'subject', 'sender', 'date',
+                'size' and 'flags'
+            emails(list, optional): fetch only these emails
+
+        Returns:
+            dict: {uid: {field: value}}
+        """
+        if emails is None:
+            emails = self.emails
+        emails = {email.uid: email for email in emails if email.uid}
+        if not emails:
+            return {}
+        with self.selected():
+            fetched = self.storage.get_fields(sorted(emails), fields)
+        for uid, values in fetched.items():
+            if uid in emails:
+                emails[uid].set_fields(values)
+        return fetched
+
     def fetch_subjects(self, email=None):
         """fetch subjects
 
@@ -236,18 +745,46 @@ class Directory:  # :TODO: # pylint: disable=too-many-public-methods
             email(Email, optional): fetch only from this email
 
         Returns:
-            dict: {uid: subject}
+            dict: {subject: [uid, ...]}
         """
-        if email:
-            uids = [email.uid]
-        else:
-            uids = self.uids
-        subjects = self.storage.get_subjects(folder=self.path)
-        for subject, uids in subjects.items():
-            for uid in uids:
-                self.email_by_uid(uid).subject = subject
+        fetched = self.prefetch(
+            fields=('subject',), emails=[email] if email else None)
+        subjects = {}
+        for uid, values in sorted(fetched.items()):
+            subjects.setdefault(values['subject'], []).append(uid)
         return subjects
 
+    def fetch_files(self, emails):
+        """fetch the file metadata (BODYSTRUCTURE and xml body) of emails
+        in one chunked FETCH and set it with Email.set_files
+
+        Args:
+            emails(list): Email objects of this directory
+        """
+        emails = {email.uid: email for email in emails if email.uid}
+        if not emails:
+            return
+        with self.selected():
+            fetched = self.storage.get_structures(sorted(emails))
+        for uid, (bodystructure, body) in fetched.items():
+            if uid in emails:
+                emails[uid].set_files(bodystructure, body)
+
+    def fetch_part(self, email, part, offset=None, length=None):
+        """fetch one part of an email as it is stored (still encoded)
+
+        Args:
+            email(Email): email of the part
+            part(str): part number, e.g. '2'
+            offset(int, optional): first byte of a partial fetch
+            length(int, optional): maximum bytes of a partial fetch
+
+        Returns:
+            bytes: data of the part (or of the requested range)
+        """
+        with self.selected():
+            return self.storage.get_part(email.uid, part, offset, length)
+
     def fetch_head(self, email):
         """fetch email head
 
@@ -257,7 +794,8 @@ class Directory:  # :TODO: # pylint: disable=too-many-public-methods
         Returns:
             str: head of email
         """
-        return self.storage.get_heads(email.uid)[email.uid]
+        with self.selected():
+            return self.storage.get_heads(email.uid)[email.uid]
 
     def fetch_body(self, email):
         """fetch email body
@@ -268,24 +806,112 @@ class Directory:  # :TODO: # pylint: disable=too-many-public-methods
         Returns:
             str: body of email
         """
-        return self.storage.get_bodies(email.uid)[email.uid]
+        with self.selected():
+            return self.storage.get_bodies(email.uid)[email.uid]
 
     def fetch_payloads(self, email):
         """
         :returns: payloads as string
         """
-        return self.storage.get_file_payloads(email.uid)[email.uid]
+        with self.selected():
+            return self.storage.get_file_payloads(email.uid)[email.uid]
 
     def save_message(self, msg_obj):
         """save msg_obj to imap directory
+        The new uid goes into the cached uids and emails, no refresh
         :returns: new uid on success or False
         """
         old_uid = msg_obj.uid
-        result = self.imap.append(self.folder, str(msg_obj.plain))
-        if old_uid:
-            self.imap.delete_messages(old_uid)
-        self.refresh()
-        return int(result.decode('utf-8').split(']')[0].split()[-1])
+        msg_id = msg_obj.head.set_message_id(message_id())
+        plain = str(msg_obj.plain)
+        with self.selected() as imap:
+            result = imap.append(self.folder, plain)
+            uid = self.appended_uid(imap, result, msg_id)
+            if old_uid:
+                self.expunge_uids([old_uid])
+        if uid is None:
+            self.refresh()
+            return False
+        self.appended([uid], [old_uid] if old_uid else [])
+        if self._emails is not None:
+            self._emails.discard(old_uid)
+            msg_obj.uid = uid
+            self._emails.add(msg_obj)
+        return uid
+
+    def save_messages(self, emails):
+        """save new emails (without uid) at once, with MULTIAPPEND if the
+        server supports it, else with pipelined APPENDs
+
+        Args:
+            emails(list): new Email objects of this directory
+
+        Returns:
+            list: uids of the emails
+        """
+        for email in emails:
+            email.upload_chunks()
+            email.upload_blobs()
+        msg_ids = [email.head.set_message_id(message_id())
+                   for email in emails]
+        plains = [str(email.plain) for email in emails]
+        with self.selected() as imap:
+            results = imap.append_messages(self.folder, plains)
+            uids = [uid for result in results
+                    for uid in appended_uids(result) or []]
+            if len(uids) != len(emails):  # no UIDPLUS
+                uids = [self.appended_uid(imap, None, msg_id)
+                        for msg_id in msg_ids]
+        if None in uids:
+            self.refresh()
+        else:
+            self.appended(uids)
+        for email, uid in zip(emails, uids):
+            email.uid = uid
+            email._files = None  # pylint: disable=protected-access
+        if self._emails is not None:
+            self._emails.update(email for email in emails if email.uid)
+        return uids
+
+    def appended_uid(self, imap, result, msg_id):
+        """uid of a message that has just been appended to this directory
+        from the APPENDUID response code, without UIDPLUS from one
+        UID SEARCH for its Message-ID
+
+        Args:
+            imap(Imap): connection of the APPEND
+            result(bytes): text of the tagged response of the APPEND
+            msg_id(str): Message-ID of the message
+
+        Returns:
+            int: uid or None if it has not been found
+        """
+        uids = appended_uids(result)
+        if uids:
+            return uids[-1]
+        found = imap.search(self.path, ['HEADER', 'Message-ID', msg_id])
+        return found[-1] if found else None
+
+    def appended(self, uids, replaced=()):
+        """put the uids of messages that have just been appended into the
+        cached uids instead of a refresh. If nothing has been replaced the
+        cached uid state is moved on as well, so the next *uids* only
+        searches if someone else has changed the folder in between.
+
+        Args:
+            uids(list): uids of the new listed messages
+            replaced(list): uids of the messages they replace
+        """
+        if self._uids is None or not uids:
+            return
+        replaced = set(replaced)
+        self._uids = sorted(
+            set(uid for uid in self._uids if uid not in replaced) | set(uids))
+        state = self._uid_state
+        if replaced or state is None or min(uids) < state[1]:
+            return
+        self._uid_state = (state[0], max(uids) + 1, state[2] + len(uids),
+                           state[3])
 
     def __hash__(self):
         return hash(self.path)
@@ -0,0 +1,59 @@
+"""Codecs to compress file payloads before they are base64 encoded
+zlib and lzma are always available, zstd if zstandard is installed.
+More codecs can be added with *register*.
+"""
+import lzma
+import zlib
+
+__all__ = ['CODECS', 'RATIO', 'register', 'compress', 'decompress']
+
+RATIO = 0.9  # compress only if the result is smaller than this * size
+CODECS = {
+    'zlib': (zlib.compress, zlib.decompress),
+    'lzma': (lzma.compress, lzma.decompress),
+    }
+
+
+def register(name, compress_func, decompress_func):
+    """add a codec
+    :param name: name of the codec as it is stored in the xml body
+    :param compress_func: function bytes -> compressed bytes
+    :param decompress_func: function compressed bytes -> bytes
+    """
+    CODECS[name] = (compress_func, decompress_func)
+
+
+def _get(codec):
+    if codec not in CODECS:
+        raise ValueError('Unknown codec {}'.format(codec))
+    return CODECS[codec]
+
+
+def compress(data, codec):
+    """
+    :param data: bytes to compress
+    :param codec: name of the codec
+    :returns: compressed bytes
+    """
+    return _get(codec)[0](data)
+
+
+def decompress(data, codec):
+    """
+    :param data: compressed bytes
+    :param codec: name of the codec
+    :returns: bytes
+    """
+    return _get(codec)[1](data)
+
+
+try:
+    import zstandard
+except ImportError:
+    pass
+else:
+    register(
+        'zstd',
+        lambda data: zstandard.ZstdCompressor().compress(data),
+        lambda data: zstandard.ZstdDecompressor().decompress(data),
+        )
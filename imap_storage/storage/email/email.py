@@ -4,9 +4,12 @@ from email.mime.multipart import MIMEMultipart
 from email.utils import formatdate
 from copy import deepcopy
 
-from .head import Head
+from .head import Head, message_id
 from .body import Body
-from .file import file_from_payload, file_from_xml
+from .file import (file_from_payload, file_from_xml,
+                   file_from_bodystructure, attachment_parts)
+
+FIELDS = ('subject', 'sender', 'date', 'size', 'flags')  # see prefetch
 
 
 class Email:
@@ -21,6 +24,10 @@ class Email:
         self.directory = directory
         self.uid = uid
         self._subject = None
+        self._sender = None
+        self._date = None
+        self._size = None
+        self._flags = None
         self._head = None
         self._body = None
         self._files = None
@@ -42,9 +49,64 @@ class Email:
         Returns:
             str: subject
         """
-        if self._subject is None:
-            self.directory.fetch_subjects()
-        return self._subject
+        return self._prefetched('subject')
+
+    @property
+    def sender(self):
+        """sender (From header) of the email, cached like subject
+
+        Returns:
+            str: sender
+        """
+        return self._prefetched('sender')
+
+    @property
+    def date(self):
+        """date when the email was stored (INTERNALDATE), cached like subject
+
+        Returns:
+            datetime: date
+        """
+        return self._prefetched('date')
+
+    @property
+    def size(self):
+        """size of the whole email (RFC822.SIZE), cached like subject
+
+        Returns:
+            int: size in bytes
+        """
+        return self._prefetched('size')
+
+    @property
+    def flags(self):
+        """flags of the email, cached like subject
+
+        Returns:
+            tuple: flags
+        """
+        return self._prefetched('flags')
+
+    def _prefetched(self, field):
+        """value of a listing field, prefetch the whole directory if missing
+        Emails that are not in the cached index of the directory (e.g. of
+        Directory.iter_emails) only fetch their own fields
+        """
+        if getattr(self, '_' + field) is None and self.uid is not None:
+            if self.directory.indexed(self):
+                self.directory.prefetch()
+            else:
+                self.directory.prefetch(emails=[self])
+        return getattr(self, '_' + field)
+
+    def set_fields(self, fields):
+        """set prefetched listing fields
+
+        Args:
+            fields(dict): {field: value} see Directory.prefetch
+        """
+        for field, value in fields.items():
+            setattr(self, '_' + field, value)
 
     @property
     def name(self):
@@ -95,6 +157,7 @@ class Email:
         head['To'] = str(to_addr_obj)
         head['Subject'] = subject
         head['Date'] = formatdate(localtime=True)
+        head['Message-ID'] = message_id()
         self.head = head
         return self.head
 
@@ -119,24 +182,74 @@ class Email:
 
     @property
     def files(self):
-        """access to the file objects, fetch if not already done"""
+        """access to the file objects, fetch if not already done
+        Only the metadata is fetched (BODYSTRUCTURE), see File.data
+        """
         if self._files is None:
-            self._files = []
-            self.fetch_payloads()
+            if self.uid is not None:
+                self.directory.fetch_files([self])
+            if self._files is None:
+                self._files = []
         return self._files
 
+    @property
+    def files_loaded(self):
+        """
+        Returns:
+            bool: True if the file objects exist (fetched or added)
+        """
+        return self._files is not None
+
+    def set_files(self, bodystructure, body=None):
+        """create the file objects from the BODYSTRUCTURE of this email
+        Size, time, id and codec are taken from the xml body if it is
+        available
+
+        Args:
+            bodystructure(BodyData): fetched BODYSTRUCTURE
+            body(str, optional): fetched body (xml)
+        """
+        if body is not None and not self._body:
+            self.body = body
+        self._files = [file_from_bodystructure(self, part, structure)
+                       for part, structure in attachment_parts(bodystructure)]
+        if self._body:
+            xml_files = self._merge_xml_files(self._files)
+            self._files.extend(  # they have no part in this email
+                file for file in xml_files.values() if file.stored_apart)
+
+    def _merge_xml_files(self, files):
+        """take the attributes of the xml entries over to the files
+        :returns: dict of the xml files {name: File}
+        """
+        xml_files = {file.name: file for file in self.xml_files}
+        for file in files:
+            xml_file = xml_files.get(file.name)
+            if xml_file is not None:
+                file.size = int(xml_file.size)
+                file.time = xml_file.time
+                file.id_ = xml_file.id_
+                if xml_file.codec:  # stored as application/octet-stream
+                    file.codec = xml_file.codec
+                    file.mime = xml_file.mime
+        return xml_files
+
     def fetch_payloads(self):
         """fetch payloads of this email
+        Downloads the whole email, self.files only fetches metadata
 
         Returns:
-            list: self.files with appended payloads
+            list: self.files with data
         """
+        files = []
         if self.uid is not None:
             payloads = self.directory.fetch_payloads(self)
             for payload in payloads:
                 if not payload['Content-Type'].startswith(
                         'multipart/alternative;'):
-                    self.files.append(file_from_payload(self, payload))
+                    files.append(file_from_payload(self, payload))
+            self._merge_xml_files(files)
+        self._files = files
         return self.files
 
     @property
@@ -190,7 +303,8 @@ class Email:
 
         files = self.files
         for file in files:
-            msg.attach(file.mime_obj)
+            if not file.stored_apart:  # only referenced in the body
+                msg.attach(file.mime_obj)
         return str(msg)
 
     def file_by_name(self, name):
@@ -219,8 +333,15 @@ class Email:
                 return self.file_by_name(file.name)
         return False
 
+    def _touch(self):
+        """inside of a transaction a changed email is saved at its end"""
+        work = self.directory.storage.work
+        if work is not None and not work.flushing:
+            work.save(self)
+
     def add_item(self, tag, text=None, attribs=None, parent=None):
         """forwards to body method"""
+        self._touch()
         return self.body.add_item(
             tag,
             text=text,
@@ -245,6 +366,15 @@ class Email:
                 }
             if file_obj.time:
                 attribs['time'] = file_obj.time
+            codec = self.directory.imap.config.codec
+            if codec and file_obj.apply_codec(codec):
+                attribs['codec'] = codec
+            chunk_size = self.directory.imap.config.chunk_size
+            if not file_obj.chunked and chunk_size and \
+                    int(file_obj.size) > chunk_size:
+                file_obj.chunk_size = chunk_size
+            if file_obj.chunked:
+                attribs['chunk_size'] = file_obj.chunk_size
             child = self.add_item('file', attribs=attribs)
             file_obj.id_ = child.attrib['id']
             self.files.append(file_obj)
@@ -264,6 +394,11 @@ class Email:
         for file in self.files:
             if file.name == name:
                 self.files.remove(file)
+                if file.chunked:
+                    self.directory.delete_chunks(file)
+                elif file.blob:
+                    self.directory.storage.deferred(
+                        self.directory.storage.blobs.release, file.blob)
         self.save()
 
     def remove_file(self, file):
@@ -274,12 +409,87 @@ class Email:
         """
         self.remove_file_by_attrib('name', file.name)
 
+    def _xml_file(self, file):
+        """xml entries of a file in the body"""
+        return self.body.xml.xpath("//file[@id='{}']".format(file.id_))
+
+    def upload_blobs(self):
+        """store the payloads of files in the blob folder and reference
+        them in their xml entries (blob=hash), if Config.dedup is set or
+        Config.layout is 'split'. Files that are stored in this email
+        move to the blob folder on save.
+        """
+        config = self.directory.imap.config
+        as_blob = config.dedup or config.layout == 'split'
+        blobs = self.directory.storage.blobs
+        for file in self.files:
+            xml = self._xml_file(file)
+            if file.chunked or not xml:
+                continue
+            if as_blob and not file.blob:
+                file.blob = blobs.digest(file.payload())
+            if file.blob and 'blob' not in xml[0].attrib:
+                blobs.put(file.payload())
+                xml[0].attrib['blob'] = file.blob
+
+    def upload_chunks(self):
+        """upload the chunk messages of new chunked files and add the
+        manifest (<chunk index= uid= size=/>) to their xml entries
+        """
+        for file in self.files:
+            if file.chunked and not file.chunks:
+                file.chunks = self.directory.upload_chunks(file)
+                for xml in self._xml_file(file):
+                    for chunk in xml.findall('chunk'):
+                        xml.remove(chunk)
+                    for index, uid, size in file.chunks:
+                        self.add_item('chunk', parent=xml, attribs={
+                            'index': index, 'uid': uid, 'size': size})
+
     def save(self):
-        """Produce new Email from body, head and files, save it, delete old"""
-        self.uid = int(self.directory.save_message(self))
+        """Produce new Email from body, head and files, save it, delete old
+        Chunked files and blobs are uploaded before, see
+        *upload_chunks* and *upload_blobs*.
+        Inside of a transaction it is saved at its end (see
+        Storage.transaction), the uid stays the old one until then
+        """
+        work = self.directory.storage.work
+        if work is not None and not work.flushing:
+            work.save(self)
+            return self.uid
+        self.upload_chunks()
+        self.upload_blobs()
+        uid = self.directory.save_message(self)
+        self.uid = int(uid) if uid else None
         self._files = None
         return self.uid
 
+    def move_to(self, directory):
+        """move this email to directory on the server, nothing is
+        downloaded (see Directory.move_emails)
+
+        Args:
+            directory(Directory): target directory
+
+        Returns:
+            int: new uid or None if the server has no UIDPLUS
+        """
+        self.directory.move_emails([self], directory)
+        return self.uid
+
+    def copy_to(self, directory):
+        """copy this email to directory on the server, nothing is
+        downloaded (see Directory.copy_emails)
+
+        Args:
+            directory(Directory): target directory
+
+        Returns:
+            Email: the copy or None if the server has no UIDPLUS
+        """
+        uid = self.directory.copy_emails([self], directory)[self.uid]
+        return directory.email_by_uid(uid) if uid else None
+
     def delete(self):
         """delete this email
 
@@ -2,11 +2,19 @@
 from datetime import datetime
 from mimetypes import MimeTypes
 from email import encoders
+from email.header import decode_header, make_header
+from email.message import Message
+from email.utils import collapse_rfc2231_value, decode_rfc2231
+from quopri import decodestring
 from email.mime.text import MIMEText
 from email.mime.image import MIMEImage
 from email.mime.audio import MIMEAudio
 from email.mime.base import MIMEBase
 from base64 import decodebytes
+import re
+from io import BytesIO, SEEK_END
+from .codec import RATIO, compress, decompress
+from .reader import FileReader, ChunkReader
 # :TODO: constructor functions are in wrong place
 
 
@@ -15,6 +23,9 @@ __all__ = [
     'file_from_upload',
     'file_from_payload',
     'file_from_xml',
+    'file_from_bodystructure',
+    'attachment_parts',
+    'parse_range',
     ]
 
 
@@ -52,7 +63,10 @@ def file_from_payload(email_obj, payload):
     file.name = payload['Content-Disposition'].split(
         'filename=')[-1].strip('"')
     file.data = payload.get_payload()
-    file.mime = payload['Content-Type']
+    file.mime = payload.get_content_type()
+    file.params = {key.lower(): collapse_rfc2231_value(value)
+                   for key, value in (payload.get_params() or [])[1:]}
+    file.encoding = payload.get('Content-Transfer-Encoding', '7bit').lower()
     return file
 
 
@@ -65,9 +79,120 @@ def file_from_xml(email_obj, xml):
     file.size = xml.attrib['size']
     file.time = float(xml.attrib['time'])
     file.id_ = xml.attrib['id']
+    file.blob = xml.attrib.get('blob')
+    file.codec = xml.attrib.get('codec')
+    if 'chunk_size' in xml.attrib:
+        file.chunk_size = int(xml.attrib['chunk_size'])
+        file.chunks = sorted(
+            (int(chunk.attrib['index']), int(chunk.attrib['uid']),
+             int(chunk.attrib['size']))
+            for chunk in xml.findall('chunk')) or None
     return file
 
 
+def file_from_bodystructure(email_obj, part, structure):
+    """create File object from the BODYSTRUCTURE of a message part
+    Only metadata, the data is fetched when it is accessed
+    :param part: part number as string, e.g. '2'
+    :param structure: BODYSTRUCTURE of the part (not multipart)
+    """
+    file = File()
+    file.email = email_obj
+    file.part = part
+    file.mime = '{}/{}'.format(
+        _text(structure[0]), _text(structure[1])).lower()
+    file.params = _pairs(structure[2])
+    file.encoding = _text(structure[5] or b'7bit').lower()
+    file.encoded_size = structure[6]
+    file.name = _disposition_filename(structure) \
+        or _pairs(structure[2]).get('name') or 'part_{}'.format(part)
+    return file
+
+
+def attachment_parts(bodystructure):
+    """find the file parts of a message in its BODYSTRUCTURE
+    These are the non-multipart parts that follow the body part
+    :returns: list of tuples [(part number, structure of the part), ...]
+    """
+    if not bodystructure.is_multipart:
+        return []
+    parts = bodystructure[0]
+    return [(str(number), part)
+            for number, part in enumerate(parts, start=1)
+            if number > 1 and not part.is_multipart]
+
+
+def _text(value):
+    return value.decode('utf-8', 'replace') if isinstance(value, bytes) \
+        else str(value)
+
+
+def _pairs(params):
+    """BODYSTRUCTURE parameter list to dict with lowercase keys"""
+    params = params or ()
+    return {_text(key).lower(): _text(value)
+            for key, value in zip(params[::2], params[1::2])}
+
+
+def _disposition_filename(structure):
+    """filename from the disposition of a non-multipart BODYSTRUCTURE
+    Some servers send the disposition as raw header value
+    """
+    for item in structure[7:]:
+        if isinstance(item, tuple) and item and isinstance(item[0], bytes):
+            params = _pairs(item[1] if len(item) > 1 else None)
+            if 'filename*' in params:
+                return collapse_rfc2231_value(
+                    decode_rfc2231(params['filename*']))
+            if 'filename' in params:
+                return str(make_header(decode_header(params['filename'])))
+        elif isinstance(item, bytes) and item.lower().startswith(
+                (b'attachment', b'inline')):
+            header = Message()
+            header['Content-Disposition'] = _text(item)
+            return header.get_filename()
+    return None
+
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def parse_range(header, size):
+    """parse the value of a Range header (only single byte ranges)
+    :param header: e.g. 'bytes=0-499', 'bytes=500-' or 'bytes=-500'
+    :param size: size of the complete data
+    :returns: (start, end) with exclusive end, () if the header has to be
+        ignored (invalid or multiple ranges) or None if not satisfiable
+    """
+    match = RANGE_RE.match(header.replace(' ', ''))
+    if not match or not any(match.groups()):
+        return ()
+    first, last = match.groups()
+    if not first:  # suffix range: the last n bytes
+        if not int(last) or not size:
+            return None
+        return max(0, size - int(last)), size
+    if last and int(last) < int(first):
+        return ()
+    if int(first) >= size:
+        return None
+    return int(first), min(int(last) + 1, size) if last else size
+
+
+def _iter_range(reader, start, end, block_size):
+    """yield the data of reader from start to end in blocks"""
+    try:
+        reader.seek(start)
+        while start < end:
+            chunk = reader.read(min(block_size, end - start))
+            if not chunk:
+                break
+            start += len(chunk)
+            yield chunk
+    finally:
+        reader.close()
+
+
 class File():  # :TODO: # pylint: disable=too-many-instance-attributes
     """Attachment class
     Maybe the following type later:
@@ -79,31 +204,84 @@ class File():  # :TODO: # pylint: disable=too-many-instance-attributes
         self.email = None
         self.name = None
         self.mime = None
+        self.params = {}  # content-type parameters, e.g. charset
         self.time = datetime.now().timestamp()
         self.id_ = None
+        self.part = None  # part number inside of the stored email
+        self.encoding = None  # content-transfer-encoding of stored data
+        self.encoded_size = None
+        self.chunk_size = None  # set if stored in chunk messages
+        self.chunks = None  # [(index, uid, size), ...] once uploaded
+        self.blob = None  # sha256 of the payload if deduplicated
+        self.codec = None  # compression of the payload, see codec
         self._data = None
         self._size = None
 
     @property
     def data(self):
+        """data as it is stored (see encoding)
+        Stored files are fetched on first access
         """
-        :TODO: Get automatically
-        """
-        return self._data or self.email.file_by_name(self.name)
+        if self._data is None and self.email:
+            if self.chunks:
+                self._data = self.email.directory.fetch_chunks(self)
+            elif self.blob:
+                self._data = self.email.directory.storage.blobs.get(
+                    self.blob)
+            elif self.part is not None:
+                self._data = self.fetch_part()
+        return self._data
 
     @data.setter
     def data(self, data):
+        """new data, set encoding after it if data is encoded"""
         self._data = data
+        self.encoding = None
 
     @property
     def size(self):
-        """Size of the file as timestamp"""
-        return self._size or len(self.data)
+        """size of the file in bytes
+        Without a size from the xml body it is estimated from the size of
+        the stored part (BODYSTRUCTURE) instead of fetching the data
+        :returns: size or None if nothing is known about it
+        """
+        if self._size is not None:
+            return self._size
+        if self._data is not None:  # decoded locally, not fetched
+            return len(self.payload())
+        if self.encoded_size is None:
+            return None
+        if self.encoding == 'base64':  # lines of 76 chars and CRLF
+            chars = self.encoded_size * 76 // 78
+            return (chars - chars % 4) // 4 * 3
+        return self.encoded_size  # quoted-printable: at most this
 
     @size.setter
     def size(self, size):
         self._size = size
 
+    def fetch_part(self, offset=None, length=None):
+        """fetch the stored data of the file (still encoded)
+        :param offset: first byte of a partial fetch
+        :param length: maximum bytes of a partial fetch
+        :returns: bytes
+        """
+        if self.blob:
+            return self.email.directory.storage.blobs.fetch_part(
+                self.blob, offset, length)
+        return self.email.directory.fetch_part(
+            self.email, self.part, offset, length)
+
+    @property
+    def stored_apart(self):
+        """True if the data is not a part of the email of the file"""
+        return self.chunked or bool(self.blob)
+
+    @property
+    def chunked(self):
+        """True if the file is stored in chunk messages (see Config)"""
+        return self.chunk_size is not None
+
     @property
     def htime(self):
         """Size as human readable"""
@@ -112,6 +290,8 @@ class File():  # :TODO: # pylint: disable=too-many-instance-attributes
     @property
     def hsize(self):
         '''self.size as human readable string'''
+        if self.size is None:
+            return None
         return self.human_readable_size(self.size)
 
     @property
@@ -122,6 +302,8 @@ class File():  # :TODO: # pylint: disable=too-many-instance-attributes
     @property
     def mime_obj(self):
         """This is for adding the File to a Multipart Message
+        Stored base64 data that did not change is used as it is,
+        without decoding and encoding it again
         :returns: self as (hopefully) correct Mime Object
         """
         ctype = self.mime
@@ -130,8 +312,21 @@ class File():  # :TODO: # pylint: disable=too-many-instance-attributes
                 ctype = 'application/octet-stream'
             else:
                 ctype = 'text/plain'
+        if self.codec:  # the xml body knows the real type
+            ctype = 'application/octet-stream'
         maintype, subtype = ctype.split('/', 1)
-        if maintype == 'text':
+        if self.encoding == 'base64' and self.data:  # unchanged, passthrough
+            msg = MIMEBase(maintype, subtype, **self.params)
+            data = self.data
+            if isinstance(data, bytes):
+                data = data.decode('ascii', 'surrogateescape')
+            msg.set_payload(data.replace('\r\n', '\n').rstrip() + '\n')
+            msg['Content-Transfer-Encoding'] = 'base64'
+        elif self.codec:
+            msg = MIMEBase(maintype, subtype)
+            msg.set_payload(self.payload())
+            encoders.encode_base64(msg)
+        elif maintype == 'text':
             try:
                 msg = MIMEText(str(self.read(), 'utf-8'), _subtype=subtype)
             except (TypeError, UnicodeDecodeError):
@@ -151,12 +346,64 @@ class File():  # :TODO: # pylint: disable=too-many-instance-attributes
         )
         return msg
 
+    def payload(self):
+        """data without the transfer encoding, still compressed (see codec)
+        :returns: bytes as they are stored
+        """
+        data = self.data
+        if self.encoding is None:  # not stored yet
+            return data
+        if isinstance(data, str):
+            data = data.encode('utf-8', 'surrogateescape')
+        if self.encoding == 'base64':
+            return decodebytes(data)
+        if self.encoding == 'quoted-printable':
+            return decodestring(data)
+        return data
+
     def read(self):
-        """Read the data of the object"""
-        maintype, _ = self.mime.split('/') if self.mime else '', ''  # subtype
-        if maintype != 'text' and isinstance(self.data, str):
-            return decodebytes(self.data.encode())
-        return self.data
+        """Read the data of the object
+        :returns: decoded and decompressed data as bytes
+        """
+        data = self.payload()
+        if self.codec:
+            data = decompress(data, self.codec)
+        return data
+
+    def apply_codec(self, codec):
+        """compress the data with codec if that makes it smaller than
+        RATIO * size, read() decompresses it again
+        :param codec: name of the codec, see codec.CODECS
+        :returns: True if the data is compressed now
+        """
+        if self.codec:
+            return self.codec == codec
+        data = self.read()
+        compressed = compress(data, codec)
+        if len(compressed) > len(data) * RATIO:
+            return False
+        self.size = len(data)
+        self.data = compressed
+        self.codec = codec
+        return True
+
+    def open(self, block_size=1024 * 1024):
+        """open the file for reading without loading it completely
+        Stored files are fetched in ranges of about block_size bytes,
+        compressed, quoted-printable and unsaved files are read as a whole
+        :param block_size: decoded bytes per fetch
+        :returns: read-only, seekable file object
+        """
+        if self.codec:  # no random access into compressed data
+            return BytesIO(self.read())
+        if self.chunks and self._data is None:
+            return ChunkReader(self, self._size)
+        if self.blob and self._data is None and self.email:
+            return FileReader(self, self._size, block_size, 'base64')
+        if self.part is None or self._data is not None or \
+                self.encoding == 'quoted-printable':
+            return BytesIO(self.read())
+        return FileReader(self, self._size, block_size)
 
     def as_response(self):
         """
@@ -170,6 +417,48 @@ class File():  # :TODO: # pylint: disable=too-many-instance-attributes
             )
         return response
 
+    def as_streaming_response(self, request=None, block_size=256 * 1024):
+        """Download response that fetches the data while it is sent
+        Handles single byte ranges (Range and If-Range header of request)
+        :param request: django HttpRequest (optional, needed for ranges)
+        :param block_size: decoded bytes per fetch
+        :returns: StreamingHttpResponse, or HttpResponse 416 for ranges
+            that are not satisfiable
+        """
+        from django.http.response import HttpResponse, StreamingHttpResponse
+        from django.utils.http import http_date
+        reader = self.open(block_size)
+        size = reader.seek(0, SEEK_END)  # from the stored size if known
+        etag = '"{}-{}-{}"'.format(self.id_, int(self.time), size)
+        last_modified = http_date(self.time)
+        meta = request.META if request is not None else {}
+        byte_range = meta.get('HTTP_RANGE')
+        if meta.get('HTTP_IF_RANGE') not in (None, etag, last_modified):
+            byte_range = None  # changed since the client got the first part
+        byte_range = parse_range(byte_range, size) if byte_range else ()
+        if byte_range is None:
+            reader.close()
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */{}'.format(size)
+            return response
+        start, end = byte_range or (0, size)
+        response = StreamingHttpResponse(
+            _iter_range(reader, start, end, block_size),
+            status=206 if byte_range else 200,
+            content_type=self.mime or 'application/octet-stream',
+            )
+        if byte_range:
+            response['Content-Range'] = 'bytes {}-{}/{}'.format(
+                start, end - 1, size)
+        response['Content-Length'] = str(end - start)
+        response['Accept-Ranges'] = 'bytes'
+        response['ETag'] = etag
+        response['Last-Modified'] = last_modified
+        response['Content-Disposition'] = 'attachment;filename="{}"'.format(
+            self.name
+            )
+        return response
+
     @staticmethod
     def human_readable_size(num, suffix='B'):
         '''changes the format of num into a human readable format'''
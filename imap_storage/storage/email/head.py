@@ -1,10 +1,53 @@
 """Head class"""
-from email.utils import formatdate, parseaddr
+from email.header import decode_header, make_header
+from email.utils import formatdate, make_msgid, parseaddr
 from email.mime.multipart import MIMEMultipart
 from email import message_from_string
 from .address import Address
 
 
+def parse_header_fields(data):
+    """lightweight parser for a block of header fields
+    It only unfolds lines and decodes encoded words, which is enough for
+    fetched HEADER.FIELDS and much cheaper than building a Message.
+    :param data: header block as bytes or str
+    :returns: dict {lowercase field name: decoded value}
+    """
+    if isinstance(data, bytes):
+        data = data.decode('utf-8', 'replace')
+    fields = {}
+    name = None
+    for line in data.splitlines():
+        if line[:1] in (' ', '\t'):
+            if name:
+                fields[name] += ' ' + line.strip()
+        elif ':' in line:
+            name, value = line.split(':', 1)
+            name = name.strip().lower()
+            fields[name] = value.strip()
+    for name, value in fields.items():
+        try:
+            fields[name] = str(make_header(decode_header(value)))
+        except (LookupError, UnicodeDecodeError, ValueError):
+            pass  # keep it undecoded
+    return fields
+
+
+def message_id(key=None):
+    """Message-ID for a message of this library, e.g. to find it again
+    with a UID SEARCH if the server has no UIDPLUS
+
+    Args:
+        key(str, optional): unique part, random if not given
+
+    Returns:
+        str: e.g. '<key@imap-storage>'
+    """
+    if key is None:
+        return make_msgid(domain='imap-storage')
+    return '<{}@imap-storage>'.format(key)
+
+
 class Head(MIMEMultipart):
     """Represents the head of an Email
     :param msg_obj: either pass a msg_obj to parse or run Head().new(*)
@@ -21,3 +64,12 @@ class Head(MIMEMultipart):
         self['To'] = str(Address(parseaddr(email_obj['To'])))
         self['Subject'] = email_obj['Subject']
         self['Date'] = formatdate(localtime=True)
+
+    def set_message_id(self, msg_id):
+        """replace the Message-ID
+        :param msg_id: new Message-ID, see *message_id*
+        :returns: msg_id
+        """
+        del self['Message-ID']
+        self['Message-ID'] = msg_id
+        return msg_id
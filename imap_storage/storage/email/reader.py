@@ -0,0 +1,156 @@
+"""FileReader class
+Read-only, seekable file object for stored files that fetches only the
+byte ranges that are read (BODY.PEEK[<part>]<offset.length>)
+"""
+import io
+from base64 import b64decode
+
+__all__ = ['FileReader', 'ChunkReader']
+
+
+class FileReader(io.RawIOBase):
+    """file object for a File that is stored in an email
+    The data is fetched and decoded block by block, one block is cached.
+    Base64 blocks are whole encoded lines, so they always start at a
+    4 byte boundary and decode on their own.
+    :param file: File object with part and encoding
+    :param size: decoded size if known, else it is computed on demand
+    :param block_size: decoded bytes per fetch (rounded to whole lines)
+    :param encoding: transfer encoding of the stored data (file.encoding)
+    """
+    PROBE = 8192  # encoded bytes fetched to find the line length
+
+    def __init__(self, file, size=None, block_size=1024 * 1024,
+                 encoding=None):
+        super().__init__()
+        self.file = file
+        self.encoding = encoding or file.encoding
+        self.block_size = block_size
+        self._size = int(size) if size is not None else None
+        self._pos = 0
+        self._cache = (None, b'')  # (block index, decoded data)
+        self._layout = None
+
+    @property
+    def name(self):
+        """name of the file"""
+        return self.file.name
+
+    def _fetch(self, offset, length):
+        return self.file.fetch_part(offset, length)
+
+    @property
+    def layout(self):
+        """
+        :returns: tuple (encoded bytes per block, decoded bytes per block)
+        """
+        if self._layout is None:
+            if self.encoding != 'base64':
+                self._layout = (self.block_size, self.block_size)
+            else:
+                probe = self._fetch(0, self.PROBE)
+                end = probe.find(b'\n')
+                if end == -1:  # not wrapped, one long line
+                    decoded = max(3, self.block_size - self.block_size % 3)
+                    self._layout = (decoded // 3 * 4, decoded)
+                else:
+                    sep = 2 if probe[end - 1:end] == b'\r' else 1
+                    line = end + 1 - sep
+                    lines = max(1, self.block_size // (line // 4 * 3))
+                    self._layout = (
+                        lines * (line + sep), lines * (line // 4 * 3))
+        return self._layout
+
+    def _block(self, index):
+        """decoded data of block number index"""
+        if self._cache[0] == index:
+            return self._cache[1]
+        encoded_length, _ = self.layout
+        data = self._fetch(index * encoded_length, encoded_length)
+        if self.encoding == 'base64':
+            data = b64decode(b''.join(data.split()))
+        self._cache = (index, data)
+        return data
+
+    @property
+    def size(self):
+        """decoded size of the file"""
+        if self._size is None:
+            encoded_length, decoded_length = self.layout
+            last = max(0, (self.file.encoded_size - 1) // encoded_length)
+            while last and not self._block(last):  # only line breaks
+                last -= 1
+            self._size = last * decoded_length + len(self._block(last))
+        return self._size
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise ValueError('negative seek position {}'.format(offset))
+        self._pos = offset
+        return self._pos
+
+    def readinto(self, buffer):
+        """read up to len(buffer) bytes, at most to the end of a block"""
+        _, decoded_length = self.layout
+        index, skip = divmod(self._pos, decoded_length)
+        data = self._block(index)[skip:skip + len(buffer)]
+        buffer[:len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+    def readall(self):
+        return self.read(max(0, self.size - self._pos))
+
+    def read(self, size=-1):
+        """read size bytes, or everything until the end if size is < 0"""
+        if size is None or size < 0:
+            return self.readall()
+        chunks = []
+        while size > 0:
+            chunk = super().read(size)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            size -= len(chunk)
+        return b''.join(chunks)
+
+
+class ChunkReader(FileReader):
+    """file object for a File that is stored in chunk messages
+    Every block is one chunk, it is fetched when it is read
+    :param file: File object with chunk_size and chunks
+    :param size: decoded size of the file
+    """
+    def __init__(self, file, size=None):
+        super().__init__(file, size, file.chunk_size)
+
+    @property
+    def layout(self):
+        return (self.file.chunk_size, self.file.chunk_size)
+
+    @property
+    def size(self):
+        if self._size is None:
+            self._size = sum(size for _, _, size in self.file.chunks)
+        return self._size
+
+    def _block(self, index):
+        if self._cache[0] != index:
+            data = b''
+            if index < len(self.file.chunks):
+                data = self.file.email.directory.fetch_chunk(self.file, index)
+            self._cache = (index, data)
+        return self._cache[1]
@@ -0,0 +1,90 @@
+"""EmailIndex class
+Collection of the emails of a directory, ordered and indexed by uid
+"""
+from bisect import bisect_left, insort
+
+__all__ = ['EmailIndex']
+
+
+class EmailIndex:
+    """dict of {uid: Email} plus a sorted list of the uids
+    Lookup by uid is O(1), iteration and indexing are ordered by uid
+    :param emails: iterable of Email objects to start with
+    """
+    def __init__(self, emails=()):
+        self._emails = {}
+        self._uids = []
+        self.update(emails)
+
+    @property
+    def uids(self):
+        """
+        :returns: sorted list of all uids
+        """
+        return list(self._uids)
+
+    def get(self, uid, default=None):
+        """get email by uid
+        :param uid: uid of the email
+        :returns: Email object or default
+        """
+        return self._emails.get(uid, default)
+
+    def add(self, email):
+        """add or replace an email"""
+        if email.uid not in self._emails:
+            insort(self._uids, email.uid)
+        self._emails[email.uid] = email
+
+    def update(self, emails):
+        """add or replace many emails, sorts only once"""
+        for email in emails:
+            self._emails[email.uid] = email
+        self._uids = sorted(self._emails)
+
+    def discard(self, uid):
+        """remove email by uid if it is in the index"""
+        if self._emails.pop(uid, None) is not None:
+            del self._uids[bisect_left(self._uids, uid)]
+
+    def discard_many(self, uids):
+        """remove many emails by uid, filters the uid list only once"""
+        uids = set(uids) & self._emails.keys()
+        if uids:
+            for uid in uids:
+                del self._emails[uid]
+            self._uids = [uid for uid in self._uids if uid not in uids]
+
+    def sync(self, uids, factory):
+        """make the index contain exactly the given uids
+        :param uids: the uids that should be in the index
+        :param factory: function that creates an Email from a new uid
+        :returns: tuple (removed uids, added uids)
+        """
+        if uids == self._uids:
+            return [], []
+        uid_set = set(uids)
+        removed = [uid for uid in self._uids if uid not in uid_set]
+        added = [uid for uid in uids if uid not in self._emails]
+        self.discard_many(removed)
+        self.update(factory(uid) for uid in added)
+        return removed, added
+
+    def __len__(self):
+        return len(self._uids)
+
+    def __iter__(self):
+        # snapshot, so emails can be deleted while iterating
+        return iter([self._emails[uid] for uid in self._uids])
+
+    def __contains__(self, email_or_uid):
+        uid = getattr(email_or_uid, 'uid', email_or_uid)
+        return uid in self._emails
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._emails[uid] for uid in self._uids[index]]
+        return self._emails[self._uids[index]]
+
+    def __repr__(self):
+        return '{}: {} emails'.format(self.__class__.__name__, len(self))
@@ -1,15 +1,74 @@
 """Factory for Storage
 This is the layer between bare Imap and the directories that hold the data
 """
+import threading
+from contextlib import contextmanager
 from email import message_from_bytes
+from .batch import UnitOfWork
+from .blobs import BlobStore, BLOB_FOLDER
 from .directory import Directory
+from .email.email import FIELDS
+from .email.head import parse_header_fields
+
+
+def field_items(fields):
+    """
+    Args:
+        fields(tuple): listing fields, see Storage.get_fields
+
+    Returns:
+        list: FETCH items that hold these fields
+    """
+    headers = [name for field, name in (
+        ('subject', 'SUBJECT'), ('sender', 'FROM')) if field in fields]
+    items = []
+    if headers:
+        items.append(
+            'BODY.PEEK[HEADER.FIELDS ({})]'.format(' '.join(headers)))
+    for field, item in (('date', 'INTERNALDATE'),
+                        ('size', 'RFC822.SIZE'),
+                        ('flags', 'FLAGS')):
+        if field in fields:
+            items.append(item)
+    return items
+
+
+def parse_fields(data, fields):
+    """
+    Args:
+        data(dict): FETCH response of one message to *field_items*
+        fields(tuple): listing fields, see Storage.get_fields
+
+    Returns:
+        dict: {field: value}
+    """
+    values = {}
+    for key, value in data.items():
+        if key.startswith(b'BODY[HEADER'):
+            header = parse_header_fields(value)
+            if 'subject' in fields:
+                values['subject'] = header.get('subject', '')
+            if 'sender' in fields:
+                values['sender'] = header.get('from', '')
+        elif key == b'INTERNALDATE':
+            values['date'] = value
+        elif key == b'RFC822.SIZE':
+            values['size'] = value
+        elif key == b'FLAGS':
+            values['flags'] = value
+    return values
 
 
 class Storage:
     """Storage is the view of the IMAP directory"""
+    FETCH_CHUNK = 1000  # uids per FETCH command
+    PAYLOAD_CHUNK = 20  # uids per FETCH of whole messages
+
     def __init__(self, imap):
         self.imap = imap
         self._directories = None
+        self._blobs = None
+        self._local = threading.local()
 
     @property
     def directories(self):
@@ -19,12 +78,59 @@ class Storage:
             list: Containing Directory objects
         """
         if self._directories is None:
+            blob_folder = self.clean_folder_path(BLOB_FOLDER)
             folders = self.imap.list_folders()
             self._directories = sorted(
-                [Directory(self, path) for path in folders]
+                [Directory(self, path) for path in folders
+                 if path != blob_folder]
                 )
         return self._directories
 
+    @property
+    def blobs(self):
+        """
+        Returns:
+            BlobStore: content addressed payloads of this storage
+        """
+        if self._blobs is None:
+            self._blobs = BlobStore(self)
+        return self._blobs
+
+    @property
+    def work(self):
+        """
+        Returns:
+            UnitOfWork: of the running transaction of this thread or None
+        """
+        return getattr(self._local, 'work', None)
+
+    @contextmanager
+    def transaction(self):
+        """unit of work: saves and deletes inside are sent at the end
+        Changed and saved emails are saved once, deletes go out in one
+        UID STORE and one EXPUNGE per directory. Nothing is sent if an
+        exception leaves the block. Nested transactions join the outer one.
+
+        Returns:
+            UnitOfWork: of the transaction
+        """
+        if self.work is not None:
+            yield self.work
+            return
+        work = self._local.work = UnitOfWork()
+        try:
+            yield work
+            work.flush()
+        finally:
+            self._local.work = None
+
+    def deferred(self, func, *args):
+        """call func(*args) at the end of the transaction or now"""
+        if self.work is not None:
+            self.work.after(func, *args)
+        else:
+            func(*args)
+
     def directory_by_path(self, path):
         """
         Args:
@@ -49,11 +155,12 @@ class Storage:
         """
         path = self.clean_folder_path(path)
         splitted = path.split('.')
-        for i in range(len(splitted)):
-            subpath = '.'.join(splitted[0:i+1])
-            self.imap.create_folder(subpath)
+        subpaths = ['.'.join(splitted[0:i+1]) for i in range(len(splitted))]
+        self.imap.create_folders(subpaths)  # pipelined, one round trip
+        for subpath in subpaths:
             directory = Directory(self, subpath)
-            self.directories.append(directory)
+            if directory not in self.directories:
+                self.directories.append(directory)
         return directory
 
     def delete_directory(self, path):
@@ -103,12 +210,23 @@ class Storage:
         Returns:
             dict: with heads of uids {int(uid): str(head)}
         """
-        heads = {}
+        return dict(self.iter_heads(uids))
+
+    def iter_heads(self, uids, chunk_size=None):
+        """fetch the heads chunk by chunk
+
+        Args:
+            uids: like *get_heads*
+            chunk_size(int, optional): uids per FETCH, default FETCH_CHUNK
+
+        Yields:
+            tuple: (int(uid), str(head)), ordered by uid
+        """
         if isinstance(uids, (int, str, float)):
-            uids = [str(int(uids))]
-        for uid, head in self.imap.fetch(uids, 'BODY[HEADER]').items():
-            heads[uid] = head[b'BODY[HEADER]'].decode('utf-8')
-        return heads
+            uids = [int(uids)]
+        for uid, head in self.imap.iter_fetch(
+                uids, 'BODY[HEADER]', chunk_size or self.FETCH_CHUNK):
+            yield uid, head[b'BODY[HEADER]'].decode('utf-8')
 
     def get_bodies(self, uids):
         """fetch the body of one or multiple messages
@@ -120,12 +238,23 @@ class Storage:
         Returns:
             dict: with bodies of uids {int(uid): str(body)}
         """
-        bodies = {}
+        return dict(self.iter_bodies(uids))
+
+    def iter_bodies(self, uids, chunk_size=None):
+        """fetch the bodies chunk by chunk
+
+        Args:
+            uids: like *get_bodies*
+            chunk_size(int, optional): uids per FETCH, default FETCH_CHUNK
+
+        Yields:
+            tuple: (int(uid), str(body)), ordered by uid
+        """
         if isinstance(uids, (int, str, float)):
-            uids = [str(int(uids))]
-        for uid, body in self.imap.fetch(uids, 'BODY[1.1]').items():
-            bodies[uid] = body[b'BODY[1.1]'].decode('utf-8')
-        return bodies
+            uids = [int(uids)]
+        for uid, body in self.imap.iter_fetch(
+                uids, 'BODY[1.1]', chunk_size or self.FETCH_CHUNK):
+            yield uid, body[b'BODY[1.1]'].decode('utf-8')
 
     def get_file_payloads(self, uids):
         """fetch the payload of one or multiple messages
@@ -136,17 +265,117 @@ class Storage:
         Returns:
             dict: with payloads of uids {int(uid): payloads of uid}
         """
-        payloads = {}
+        return dict(self.iter_payloads(uids))
+
+    def iter_payloads(self, uids, chunk_size=None):
+        """fetch the payloads chunk by chunk, whole messages are
+        downloaded, so only PAYLOAD_CHUNK of them are held in memory
+
+        Args:
+            uids: like *get_file_payloads*
+            chunk_size(int, optional): uids per FETCH, default PAYLOAD_CHUNK
+
+        Yields:
+            tuple: (int(uid), list of payloads), ordered by uid
+        """
         if isinstance(uids, (int, str, float)):
-            uids = [str(int(uids))]
-        for uid, payload in self.imap.fetch(uids, 'RFC822').items():
+            uids = [int(uids)]
+        for uid, payload in self.imap.iter_fetch(
+                uids, 'RFC822', chunk_size or self.PAYLOAD_CHUNK):
             if b'RFC822' in payload:
-                payloads[uid] = message_from_bytes(
+                yield uid, message_from_bytes(
                     payload[b'RFC822']
                     ).get_payload()[1:]
             else:
-                payloads[uid] = []
-        return payloads
+                yield uid, []
+
+    def get_fields(self, uids, fields=FIELDS):
+        """fetch the listing fields of many messages at once
+        One UID FETCH per FETCH_CHUNK uids, without downloading bodies
+
+        Args:
+            uids(list): which messages should get fetched
+            fields(tuple): any of 'subject', 'sender' (From), 'date'
+                (INTERNALDATE), 'size' (RFC822.SIZE) and 'flags'
+
+        Returns:
+            dict: {int(uid): {field: value}}
+        """
+        return {uid: parse_fields(data, fields)
+                for uid, data in self.imap.iter_fetch(
+                    uids, field_items(fields), self.FETCH_CHUNK)}
+
+    def get_header_fields(self, uids, names):
+        """fetch some header fields of many messages at once
+
+        Args:
+            uids(list): which messages should get fetched
+            names(list): names of the header fields
+
+        Returns:
+            dict: {int(uid): {lowercase name: value}}
+        """
+        item = 'BODY.PEEK[HEADER.FIELDS ({})]'.format(' '.join(names))
+        result = {}
+        for uid, data in self.imap.iter_fetch(uids, item, self.FETCH_CHUNK):
+            for key, value in data.items():
+                if key.startswith(b'BODY[HEADER'):
+                    result[uid] = parse_header_fields(value)
+        return result
+
+    def get_structures(self, uids):
+        """fetch BODYSTRUCTURE and body of many messages at once
+        One UID FETCH per FETCH_CHUNK uids, attachments are not downloaded
+
+        Args:
+            uids(list): which messages should get fetched
+
+        Returns:
+            dict: {int(uid): (BodyData, str(body) or None)}
+        """
+        return dict(self.iter_structures(uids))
+
+    def iter_structures(self, uids, chunk_size=None):
+        """fetch BODYSTRUCTURE and body chunk by chunk
+
+        Args:
+            uids(list): which messages should get fetched
+            chunk_size(int, optional): uids per FETCH, default FETCH_CHUNK
+
+        Yields:
+            tuple: (int(uid), (BodyData, str(body) or None)), ordered by uid
+        """
+        for uid, data in self.imap.iter_fetch(
+                uids, ['BODYSTRUCTURE', 'BODY.PEEK[1.1]'],
+                chunk_size or self.FETCH_CHUNK):
+            body = data.get(b'BODY[1.1]')
+            yield uid, (
+                data[b'BODYSTRUCTURE'],
+                body.decode('utf-8') if body is not None else None,
+                )
+
+    def get_part(self, uid, part, offset=None, length=None):
+        """fetch one part of a message as it is stored (still encoded)
+
+        Args:
+            uid(int): uid of the message
+            part(str): part number, e.g. '2'
+            offset(int, optional): first byte of a partial fetch
+            length(int, optional): maximum bytes of a partial fetch
+
+        Returns:
+            bytes: data of the part (or of the requested range)
+        """
+        item = 'BODY.PEEK[{}]'.format(part)
+        if offset is not None:
+            item += '<{}.{}>'.format(offset, length)
+        prefix = 'BODY[{}]'.format(part).encode()
+        for _ in range(2):  # the answer can be a flag update of the server
+            fetched = self.imap.fetch([uid], item)[uid]
+            for key, value in fetched.items():  # key of ranges is BODY[2]<0>
+                if key.startswith(prefix):
+                    return value or b''
+        return b''
 
     def get_subjects(self, folder=None):
         """Fetch subjects
@@ -158,23 +387,26 @@ class Storage:
         Returns:
             dict: of subjects and uids {subject: [uid, uid]}
         """
-        if folder:
-            self.imap.create_folder(folder)
         subjects_cleaned = {}
-        uids = self.imap.search()
-        if uids:
-            subjects = self.imap.fetch(
-                uids,
-                'BODY.PEEK[HEADER.FIELDS (SUBJECT)]'
-                )
-            for uid, subject in subjects.items():
-                subject = message_from_bytes(
-                    subject[b'BODY[HEADER.FIELDS (SUBJECT)]']
-                    )['Subject']
-                if subject not in subjects_cleaned:
-                    subjects_cleaned[subject] = [uid]
-                else:
-                    subjects_cleaned[subject].append(uid)
+        with self.imap.connection(folder) as imap:
+            if folder:
+                imap.create_folder(folder)
+            uids = imap.search()
+            if uids:
+                subjects = imap.fetch(
+                    uids,
+                    'BODY.PEEK[HEADER.FIELDS (SUBJECT)]'
+                    )
+            else:
+                subjects = {}
+        for uid, subject in subjects.items():
+            subject = message_from_bytes(
+                subject[b'BODY[HEADER.FIELDS (SUBJECT)]']
+                )['Subject']
+            if subject not in subjects_cleaned:
+                subjects_cleaned[subject] = [uid]
+            else:
+                subjects_cleaned[subject].append(uid)
         return subjects_cleaned
 
     def uninstall(self):
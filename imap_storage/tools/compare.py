@@ -3,6 +3,7 @@
 
 def list_compare(old, new):
     """ compare """
-    remove = [x for x in old if x not in new]
-    add = [x for x in new if x not in old]
+    old_set, new_set = set(old), set(new)
+    remove = [x for x in old if x not in new_set]
+    add = [x for x in new if x not in old_set]
     return remove, add
@@ -0,0 +1,355 @@
+"""in-process IMAP server for the tests of imap_storage.aio
+Folders and messages are kept in memory, it knows only the commands and
+fetch items that imap_storage uses
+"""
+import asyncio
+import re
+from collections import OrderedDict
+from datetime import datetime, timezone
+from email import message_from_bytes
+from email.utils import collapse_rfc2231_value
+from imapclient.response_parser import parse_response
+from imap_storage.aio.imap import LITERAL_RE
+from imap_storage.connection.uidset import UidSet
+
+SECTION_RE = re.compile(r'^BODY(?:\.PEEK)?\[([^\]]*)\](?:<(\d+)\.(\d+)>)?$')
+
+
+def text(value):
+    """parsed argument as str"""
+    return value.decode('utf-8') if isinstance(value, bytes) else str(value)
+
+
+def quote(value):
+    """quoted string or literal"""
+    if isinstance(value, str):
+        value = value.encode('utf-8')
+    if value is None:
+        return b'NIL'
+    if re.search(br'[^\x20-\x7e]|["\\]', value):
+        return b'{%d}\r\n%s' % (len(value), value)
+    return b'"' + value + b'"'
+
+
+def params(pairs):
+    """parameter list of a BODYSTRUCTURE"""
+    if not pairs:
+        return b'NIL'
+    return b'(' + b' '.join(quote(key) + b' ' + quote(
+        collapse_rfc2231_value(value)) for key, value in pairs) + b')'
+
+
+def bodystructure(part):
+    """BODYSTRUCTURE of a message part (email.message.Message)"""
+    if part.is_multipart():
+        return b'(' + b''.join(bodystructure(sub) for sub in
+                               part.get_payload()) + b' ' + quote(
+            part.get_content_subtype()) + b' ' + params(
+                part.get_params()[1:]) + b' NIL NIL NIL)'
+    payload = part.get_payload().encode('ascii', 'surrogateescape')
+    fields = [quote(part.get_content_maintype()),
+              quote(part.get_content_subtype()),
+              params(part.get_params()[1:]), b'NIL', b'NIL',
+              quote(part.get('Content-Transfer-Encoding', '7bit')),
+              str(len(payload)).encode()]
+    if part.get_content_maintype() == 'text':
+        fields.append(str(payload.count(b'\n')).encode())
+    disposition = part.get_params(header='content-disposition')
+    fields.append(b'NIL')  # md5
+    fields.append(b'(' + quote(disposition[0][0]) + b' ' + params(
+        disposition[1:]) + b')' if disposition else b'NIL')
+    fields.append(b'NIL')  # language
+    return b'(' + b' '.join(fields) + b')'
+
+
+class Message:
+    """stored message"""
+    def __init__(self, raw, flags=()):
+        self.raw = raw
+        self.flags = set(flags)
+        self.date = datetime.now(timezone.utc)
+        self.parsed = message_from_bytes(raw)
+
+    @property
+    def header(self):
+        """raw header block including the empty line"""
+        return self.raw[:self.raw.find(b'\r\n\r\n') + 4]
+
+    def section(self, section):
+        """
+        :param section: e.g. 'HEADER', 'HEADER.FIELDS (SUBJECT)' or '1.1'
+        :returns: data of the section as bytes
+        """
+        if not section:
+            return self.raw
+        if section == 'HEADER':
+            return self.header
+        if section.startswith('HEADER.FIELDS'):
+            names = section.split('(')[1].rstrip(')').upper().split()
+            lines = [b'%s: %s\r\n' % (
+                name.encode(), value.encode('utf-8', 'surrogateescape'))
+                for name, value in self.parsed.items()
+                if name.upper() in names]
+            return b''.join(lines) + b'\r\n'
+        part = self.parsed
+        for number in section.split('.'):
+            if part.is_multipart():
+                part = part.get_payload()[int(number) - 1]
+        return part.get_payload().encode('ascii', 'surrogateescape')
+
+    def matches(self, uid, criteria):
+        """
+        :param criteria: parsed search keys
+        :returns: True if the message matches all of them
+        """
+        criteria = list(criteria)
+        while criteria:
+            key = criteria.pop(0).upper()
+            if key == b'ALL':
+                continue
+            if key == b'UNDELETED':
+                if b'\\Deleted' in self.flags:
+                    return False
+                continue
+            if key == b'UID':
+                if uid not in UidSet(criteria.pop(0)):
+                    return False
+                continue
+            name = criteria.pop(0).decode() if key == b'HEADER' \
+                else key.decode()
+            value = text(criteria.pop(0)).lower()
+            if not any(value in str(header).lower()
+                       for header in self.parsed.get_all(name, [])):
+                return False
+        return True
+
+
+class Mailbox:
+    """folder with its messages {uid: Message}"""
+    def __init__(self, uid_validity):
+        self.uid_validity = uid_validity
+        self.uid_next = 1
+        self.messages = OrderedDict()
+
+
+class ImapStandIn:
+    """IMAP server on 127.0.0.1 without TLS
+    Every command waits for the event loop once, so the commands that a
+    client pipelines queue up (see *pipelined*)
+    :param literal_plus: announce LITERAL+, else literals need a '+'
+    """
+    def __init__(self, literal_plus=True):
+        self.capabilities = b'IMAP4rev1 UIDPLUS MOVE' + (
+            b' LITERAL+' if literal_plus else b'')
+        self.mailboxes = {'INBOX': Mailbox(1)}
+        self.commands = []  # names of all received commands
+        self.pipelined = 0  # most commands that waited at once
+        self.server = None
+        self.port = None
+
+    async def start(self):
+        """listen on a free port"""
+        self.server = await asyncio.start_server(
+            self.handle, '127.0.0.1', 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        """stop listening"""
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def handle(self, reader, writer):
+        """serve one connection"""
+        queue = asyncio.Queue()
+        writer.write(b'* OK IMAP stand-in ready\r\n')
+        worker = asyncio.ensure_future(self.work(queue, writer))
+        try:
+            while True:
+                items = await self.read_command(reader, writer)
+                if items is None:
+                    break
+                await queue.put(items)
+        finally:
+            await queue.put(None)
+            await worker
+
+    async def read_command(self, reader, writer):
+        """
+        :returns: command line(s) with literals like imaplib responses
+        """
+        items = []
+        line = await reader.readline()
+        while line.endswith(b'\n'):
+            line = line.rstrip(b'\r\n')
+            match = LITERAL_RE.search(line)
+            if not match:
+                items.append(line)
+                return items
+            if line.endswith(b'+}'):  # LITERAL+
+                line = line[:-2] + b'}'
+            else:
+                writer.write(b'+ Ready\r\n')
+            items.append((line, await reader.readexactly(
+                int(match.group(1)))))
+            line = await reader.readline()
+        return None
+
+    async def work(self, queue, writer):
+        """answer the commands in order"""
+        state = {'folder': None}
+        while True:
+            await asyncio.sleep(0)
+            self.pipelined = max(self.pipelined, queue.qsize())
+            items = await queue.get()
+            if items is None or writer.is_closing():
+                break
+            args = parse_response(items)
+            tag, name, args = args[0], args[1].upper(), list(args[2:])
+            if name == b'UID':
+                name = b'UID ' + args.pop(0).upper()
+            self.commands.append(name.decode())
+            try:
+                untagged, done = self.execute(state, name, args)
+            except Exception as error:  # pylint: disable=broad-except
+                writer.write(b'%s NO %s\r\n' % (tag, str(error).encode()))
+                continue
+            writer.write(b''.join(b'* %s\r\n' % line for line in untagged))
+            writer.write(b'%s OK %s\r\n' % (tag, done))
+            if name == b'LOGOUT':
+                writer.close()
+                break
+
+    def execute(self, state, name, args):
+        # pylint: disable=too-many-return-statements,too-many-branches
+        """
+        :returns: (untagged lines, text of the tagged OK)
+        """
+        if name in (b'LOGIN', b'NOOP'):
+            return [], b'done'
+        if name == b'CAPABILITY':
+            return [b'CAPABILITY ' + self.capabilities], b'done'
+        if name == b'LOGOUT':
+            return [b'BYE'], b'done'
+        if name == b'LIST':
+            pattern = re.escape(args[1].decode()).replace(
+                r'\*', '.*').replace('%', '[^.]*')
+            return [b'LIST () "." ' + quote(folder)
+                    for folder in sorted(self.mailboxes)
+                    if re.match(pattern + '$', folder)], b'done'
+        if name == b'CREATE':
+            folder = args[0].decode()
+            if folder in self.mailboxes:
+                raise KeyError('[ALREADYEXISTS] {}'.format(folder))
+            self.mailboxes[folder] = Mailbox(len(self.mailboxes) + 1)
+            return [], b'done'
+        if name == b'DELETE':
+            del self.mailboxes[args[0].decode()]
+            return [], b'done'
+        if name == b'SELECT':
+            mailbox = self.mailboxes[args[0].decode()]
+            state['folder'] = mailbox
+            return [
+                b'%d EXISTS' % len(mailbox.messages),
+                b'OK [UIDVALIDITY %d]' % mailbox.uid_validity,
+                b'OK [UIDNEXT %d]' % mailbox.uid_next,
+                ], b'[READ-WRITE] done'
+        if name == b'APPEND':
+            mailbox = self.mailboxes[args[0].decode()]
+            flags = args[1] if len(args) > 2 else ()
+            uid = mailbox.uid_next
+            mailbox.uid_next += 1
+            mailbox.messages[uid] = Message(args[-1], flags)
+            return [], b'[APPENDUID %d %d] done' % (mailbox.uid_validity, uid)
+        mailbox = state['folder']
+        if name == b'UID SEARCH':
+            uids = [uid for uid, message in mailbox.messages.items()
+                    if message.matches(uid, args)]
+            return [b'SEARCH' + b''.join(
+                b' %d' % uid for uid in uids)], b'done'
+        if name == b'UID FETCH':
+            items = args[1] if isinstance(args[1], tuple) else (args[1],)
+            return [self.fetch(mailbox, uid, items)
+                    for uid in UidSet(args[0])
+                    if uid in mailbox.messages], b'done'
+        if name == b'UID STORE':
+            flags = args[2] if isinstance(args[2], tuple) else (args[2],)
+            for uid in UidSet(args[0]):
+                if uid not in mailbox.messages:
+                    continue
+                if args[1].startswith(b'-'):
+                    mailbox.messages[uid].flags.difference_update(flags)
+                else:
+                    mailbox.messages[uid].flags.update(flags)
+            return [], b'done'
+        if name in (b'UID COPY', b'UID MOVE'):
+            return self.transfer(mailbox, name == b'UID MOVE', args)
+        if name in (b'UID EXPUNGE', b'EXPUNGE'):
+            uids = UidSet(args[0]) if args else None
+            expunged = []
+            for number, (uid, message) in reversed(list(enumerate(
+                    mailbox.messages.items(), start=1))):
+                if b'\\Deleted' in message.flags and \
+                        (uids is None or uid in uids):
+                    expunged.append(b'%d EXPUNGE' % number)
+                    del mailbox.messages[uid]
+            return expunged, b'done'
+        raise ValueError('Unknown command {}'.format(name))
+
+    def transfer(self, mailbox, move, args):
+        """UID COPY or UID MOVE with COPYUID"""
+        target = self.mailboxes[args[1].decode()]
+        old, new, untagged = [], [], []
+        for uid in UidSet(args[0]):
+            if uid in mailbox.messages:
+                message = mailbox.messages[uid]
+                old.append(uid)
+                new.append(target.uid_next)
+                target.messages[target.uid_next] = Message(
+                    message.raw, message.flags)
+                target.uid_next += 1
+        code = b'[COPYUID %d %s %s]' % (
+            target.uid_validity, str(UidSet(old)).encode(),
+            str(UidSet(new)).encode()) if old else b''
+        if not move:
+            return [], code + b' done'
+        for uid in reversed(old):
+            number = list(mailbox.messages).index(uid) + 1
+            untagged.append(b'%d EXPUNGE' % number)
+            del mailbox.messages[uid]
+        return [b'OK ' + code + b' moved'] + untagged, b'done'
+
+    @staticmethod
+    def fetch(mailbox, uid, items):
+        """untagged FETCH response of one message"""
+        message = mailbox.messages[uid]
+        number = list(mailbox.messages).index(uid) + 1
+        values = [b'UID %d' % uid]
+        for item in items:
+            item = item.decode().upper() if isinstance(item, bytes) \
+                else str(item)
+            if item == 'UID':
+                continue
+            if item == 'FLAGS':
+                values.append(b'FLAGS (' + b' '.join(
+                    sorted(message.flags)) + b')')
+            elif item == 'INTERNALDATE':
+                values.append(b'INTERNALDATE "%s"' % message.date.strftime(
+                    '%d-%b-%Y %H:%M:%S +0000').encode())
+            elif item == 'RFC822.SIZE':
+                values.append(b'RFC822.SIZE %d' % len(message.raw))
+            elif item == 'RFC822':
+                values.append(b'RFC822 ' + quote(message.raw))
+            elif item == 'BODYSTRUCTURE':
+                values.append(b'BODYSTRUCTURE ' + bodystructure(
+                    message.parsed))
+            else:
+                section, offset, length = SECTION_RE.match(item).groups()
+                data = message.section(section)
+                key = 'BODY[{}]'.format(section)
+                if offset is not None:
+                    data = data[int(offset):int(offset) + int(length)]
+                    key += '<{}>'.format(offset)
+                values.append(key.encode() + b' {%d}\r\n%s' % (
+                    len(data), data))
+        return b'%d FETCH (%s)' % (number, b' '.join(values))
@@ -0,0 +1,190 @@
+"""test imap_storage.aio against the in-process IMAP stand-in"""
+import asyncio
+from os import path
+from unittest import TestCase, mock
+import imap_storage
+from imap_storage.aio import AsyncAccount, AsyncEmail, AsyncImap
+from imap_storage.aio.imap import Command, UNSOLICITED
+from imap_storage.storage.blobs import BLOB_HEADER
+from imap_storage.connection.uidset import UidSet
+from imap_storage.storage.email.file import file_from_local
+from .imap_server import ImapStandIn
+
+
+class AioTestCase(TestCase):
+    """test aio.* classes"""
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.server = None
+        config = imap_storage.Config()
+        config.imap.user = 'user@localhost'
+        config.imap.password = 'secret'
+        config.imap.host = '127.0.0.1'
+        config.tag = 'PythonUnittest'
+        config.directory = 'imap_storage_tests'
+        self.config = config
+
+    def wait(self, coro):
+        """run coro in the loop of the test"""
+        return self.loop.run_until_complete(coro)
+
+    async def account(self, literal_plus=True):
+        """AsyncAccount of a new stand-in server"""
+        self.server = await ImapStandIn(literal_plus).start()
+        self.config.imap.port = self.server.port
+        return AsyncAccount(self.config, 1, use_ssl=False)
+
+    def tearDown(self):
+        if self.server is not None:
+            self.wait(self.server.stop())
+        self.loop.close()
+
+    def test_account(self):
+        """emails and files are saved, loaded and deleted"""
+        local = path.join(path.dirname(__file__), 'files', 'image.png')
+        with open(local, 'rb') as local_file:
+            data = local_file.read()
+
+        async def scenario(account):
+            storage = account.storage
+            directory = await storage.new_directory('items')
+            self.assertIn(directory, await storage.directories())
+            email = directory.new_email('Item')
+            email.add_item('entry', text='first')
+            uid = await email.save()
+            emails = await directory.emails()
+            self.assertEqual([email.uid for email in emails], [uid])
+            self.assertEqual(emails[0].name, 'Item')
+
+            loaded = await directory.email_by_uid(uid)
+            self.assertEqual(loaded.body.get_by_tag('entry')[0].text, 'first')
+            loaded.add_item('entry', text='second')
+            new_uid = await loaded.save()
+            self.assertNotEqual(new_uid, uid)
+            self.assertEqual(await directory.uids(), [new_uid])
+            self.assertIsNone(await directory.email_by_uid(uid))
+
+            file_email = await directory.add_file_email(file_from_local(local))
+            self.assertFalse(
+                await directory.add_file_email(file_from_local(local)))
+            file = await directory.file_by_name('image.png')
+            self.assertEqual(await file.email.read_file(file), data)
+            file_email = await directory.email_by_uid(file_email.uid)
+            file_email.add_item('entry', text='with file')
+            await file_email.save()  # unchanged file is saved again
+            file = await directory.file_by_name('image.png')
+            self.assertEqual(await file.email.read_file(file), data)
+            await file.email.remove_file(file)
+            self.assertEqual(await directory.files(), [])
+
+            self.assertTrue(await loaded.delete())
+            self.assertEqual(len(await directory.uids()), 1)
+            self.assertEqual(await storage.delete_directory('items'),
+                             [directory.path])
+            self.assertIsNone(await storage.directory_by_path('items'))
+
+        async def run():
+            async with await self.account() as account:
+                self.assertTrue(account.is_ok())
+                await scenario(account)
+            self.assertFalse(account.is_ok())
+        self.wait(run())
+
+    def test_pipelining(self):
+        """concurrent coroutines share the connection"""
+        async def run():
+            async with await self.account(literal_plus=False) as \
+                    account:
+                first = await account.storage.new_directory('first')
+                second = await account.storage.new_directory('second')
+                emails = [directory.new_email(str(i))
+                          for i in range(5) for directory in (first, second)]
+                uids = await asyncio.gather(*(
+                    email.save() for email in emails))
+                loaded = await asyncio.gather(*(
+                    email.directory.email_by_uid(uid)
+                    for email, uid in zip(emails, uids)))
+                self.assertEqual([email.name for email in loaded],
+                                 [str(i) for i in range(5) for _ in 'ab'])
+                self.assertGreater(self.server.pipelined, 1)
+
+                unloaded = AsyncEmail(first, uids[0])
+                with self.assertRaises(RuntimeError):
+                    unloaded.body  # pylint: disable=pointless-statement
+                await account.storage.uninstall()
+        self.wait(run())
+
+    def test_dispatch(self):
+        """untagged responses reach their command, a dead reader fails all"""
+        # pylint: disable=protected-access
+        async def route():
+            imap = AsyncImap(self.config, use_ssl=False)
+            first = Command(b'A1', b'UID FETCH', UidSet([1, 2]))
+            second = Command(b'A2', b'UID FETCH', UidSet([3]))
+            imap._pending.update([(b'A1', first), (b'A2', second)])
+            imap._dispatch([b'* 3 FETCH (UID 3 FLAGS ())'])  # interleaved
+            imap._dispatch([b'* 1 FETCH (UID 1 FLAGS ())'])
+            imap._dispatch([b'* 4 EXISTS'])
+            self.assertEqual(second.responses(b'FETCH'),
+                             [b'3 (UID 3 FLAGS ())'])
+            self.assertEqual(first.responses(b'FETCH'),
+                             [b'1 (UID 1 FLAGS ())'])
+            self.assertEqual(first.responses(b'EXISTS'), [b'4'])
+            imap._pending.clear()
+            for _ in range(UNSOLICITED + 1):
+                imap._dispatch([b'* 4 EXISTS'])
+            self.assertEqual(len(imap.unsolicited), UNSOLICITED)
+        self.wait(route())
+
+        async def run():
+            async with await self.account() as account:
+                imap = account.imap
+                with mock.patch.object(imap, '_untagged',
+                                       side_effect=ValueError('unreadable')):
+                    with self.assertRaises(ValueError):
+                        await asyncio.wait_for(imap.command(b'CAPABILITY'), 5)
+                self.assertFalse(account.is_ok())
+        self.wait(run())
+
+    def test_transfer(self):
+        """emails are moved and copied, blobs of the synchronous API are
+        read and reference counted"""
+        local = path.join(path.dirname(__file__), 'files', 'image.png')
+        with open(local, 'rb') as local_file:
+            data = local_file.read()
+
+        async def run():
+            async with await self.account() as account:
+                storage = account.storage
+                first = await storage.new_directory('first')
+                second = await storage.new_directory('second')
+                email = await first.add_file_email(file_from_local(local))
+                self.assertIsNotNone(await email.move_to(second))
+                self.assertIs(email.directory, second)
+                self.assertEqual(await first.uids(), [])
+                copy = await email.copy_to(first)
+                self.assertEqual(await copy.read_file(copy.files[0]), data)
+
+                blobs = storage.blobs  # like Email.upload_blobs
+                file = copy.files[0]
+                file.blob = blobs.digest(file.payload())
+                xml = copy._xml_file(file)  # pylint: disable=W0212
+                xml[0].attrib['blob'] = file.blob
+                await account.imap.create_folder(blobs.path)
+                await account.imap.append(blobs.path, first.data_message(
+                    'blob', {BLOB_HEADER: file.blob}, file.payload()))
+                await blobs.retain([file.blob])
+                await copy.save()
+                with_blob = await first.file_by_name('image.png')
+                self.assertEqual(
+                    await with_blob.email.read_file(with_blob), data)
+                await with_blob.email.copy_to(second)
+                self.assertEqual(await blobs.release(file.blob), 1)
+                await with_blob.email.remove_file(with_blob)
+                with self.assertRaises(KeyError):  # swept
+                    await blobs.get(file.blob)
+        self.wait(run())
+
+        self.config.dedup = True
+        with self.assertRaises(ValueError):
+            AsyncAccount(self.config, 1, use_ssl=False)
@@ -1,4 +1,5 @@
 """test connection.* classes"""
+from unittest import mock
 from . import CustomTestCase, imap_storage
 
 
@@ -26,6 +27,116 @@ class ConnectionTestCase(CustomTestCase):
         self.assertEqual(account.imap.state(), 'SELECTED')
         account.close()
 
+    def test_pool(self):
+        """test connection.ImapPool class"""
+        from threading import Thread
+        from imap_storage.connection.pool import ImapPool
+        pool = ImapPool(self.config, min_size=1, max_size=2)
+        self.assertEqual(pool.size, 1)
+        with pool.connection() as imap:
+            with pool.connection() as imap2:
+                self.assertIs(imap, imap2)  # same thread, same connection
+            self.assertEqual(pool.size, 1)
+            results = []
+            thread = Thread(target=lambda: results.append(pool.search()))
+            thread.start()
+            thread.join()
+            self.assertEqual(pool.size, 2)  # second thread got a new one
+            self.assertEqual(results, [imap.search()])
+            imap.current_folder = 'checked out'  # not of the idle one
+            self.assertEqual(pool.current_folder, 'checked out')
+            imap.current_folder = None
+        with self.assertRaises(AttributeError):  # no connection of ours
+            pool.current_folder  # pylint: disable=pointless-statement
+
+        def exhaust(errors):
+            try:
+                pool.checkout(timeout=0.1)
+            except TimeoutError as error:
+                errors.append(error)
+        errors = []
+        imap = pool.checkout()
+        thread = Thread(target=pool.checkout)  # never checked in
+        thread.start()
+        thread.join()
+        thread = Thread(target=exhaust, args=(errors,))
+        thread.start()
+        thread.join()
+        self.assertEqual(len(errors), 1)
+        pool.checkin(imap)
+        pool.logout()
+
+        broken = ImapPool(self.config, min_size=1, max_size=1)
+        with self.assertRaises(OSError):
+            with broken.connection() as imap:
+                raise ConnectionResetError
+        self.assertEqual(broken.size, 0)  # evicted
+        self.assertTrue(broken.is_ok())
+        broken.logout()
+        self.assertFalse(broken.is_ok())
+
+    def test_reconnect(self):
+        """lost connections are reopened and idempotent commands retried"""
+        from socket import SHUT_RDWR
+        from imaplib import IMAP4
+        from imap_storage.connection.imap import Imap
+        imap = Imap(self.config)
+        self.assertTrue(imap.optimistic)
+        imap.create_folder('reconnect')
+        imap.socket().shutdown(SHUT_RDWR)
+        self.assertEqual(imap.search(), [])  # retried
+        self.assertEqual(
+            imap.current_folder, self.config.directory + '.reconnect')
+        imap.socket().shutdown(SHUT_RDWR)
+        self.assertRaises(  # not idempotent, but connection is usable again
+            IMAP4.abort, imap.append, imap.current_folder, 'Subject: x')
+        self.assertTrue(imap.is_ok())
+        with mock.patch.object(  # lost while reading pipelined responses
+                imap._imap, '_get_response',
+                side_effect=IMAP4.abort('socket error: EOF')):
+            self.assertEqual(imap.fetch([1], ['UID']), {})  # retried
+        uids = imap.search(criteria=['ALL'])
+        imap.create_folder('other')
+        for _ in range(len(uids) + 1):
+            imap.append(imap.current_folder, 'Subject: y\r\n\r\ny')
+        with mock.patch.object(  # lost during SELECT of 'reconnect'
+                imap._imap, '_get_response',
+                side_effect=IMAP4.abort('socket error: EOF')):
+            imap.create_folder('reconnect')  # retried, not False
+        self.assertEqual(
+            imap.current_folder, self.config.directory + '.reconnect')
+        self.assertEqual(imap.search(criteria=['ALL']), uids)  # not 'other'
+        imap.logout()
+
+    def test_folder_cache(self):
+        """folders are listed once and updated locally afterwards"""
+        from imap_storage.connection.imap import Imap
+        imap = Imap(self.config)
+        other = Imap(self.config)  # has its own FolderCache
+        path = self.config.directory + '.cached'
+        self.assertTrue(other.create_folder('cached'))
+        self.assertNotIn(path, imap.list_folders())  # no new LIST
+        self.assertIn(path, imap.list_folders(refresh=True))
+        imap.folders.invalidate()
+        self.assertFalse(imap.folders.loaded)
+        self.assertFalse(imap.create_folder('cached'))  # LIST again
+
+        other.create_folder('external')  # unknown to imap
+        self.assertNotIn(self.config.directory + '.external', imap.folders)
+        imap.create_folder('external')  # CREATE fails, but it exists
+        self.assertIn(self.config.directory + '.external', imap.folders)
+
+        imap.rename_folder('cached', 'renamed')
+        self.assertNotIn(path, imap.list_folders())
+        self.assertIn(self.config.directory + '.renamed', imap.folders)
+        self.assertFalse(imap.select_folder('cached'))
+        self.assertEqual(imap.delete_folder('renamed'),
+                         [self.config.directory + '.renamed'])
+        self.assertEqual(imap.list_folders(), imap.list_folders(refresh=True))
+        other.delete_folder('external')
+        other.logout()
+        imap.logout()
+
     def test_delete_folder(self):
         imap = self.account.imap
 
@@ -46,6 +157,75 @@ class ConnectionTestCase(CustomTestCase):
         imap.delete_messages(float(email.uid))
         self.assertNotIn(email.uid, imap.search())
 
+    def test_uid_set(self):
+        """uid sets are compressed to ranges and split into commands"""
+        from imap_storage.connection.uidset import UidSet
+        uids = UidSet([7, 1, 2, 3, 3, 9, 8, 20])
+        self.assertEqual(str(uids), '1:3,7:9,20')
+        self.assertEqual(list(uids), [1, 2, 3, 7, 8, 9, 20])
+        self.assertEqual(len(uids), 7)
+        self.assertEqual(UidSet(b'20,9:7,1:3'), uids)
+        self.assertIn(8, uids)
+        self.assertNotIn(4, uids)
+        self.assertEqual(str(uids | [4, 5]), '1:5,7:9,20')
+        self.assertEqual(str(uids & '2:8'), '2:3,7:8')
+        self.assertEqual(str(uids - [2, 8, 20]), '1,3,7,9')
+        self.assertFalse(UidSet())
+        many = UidSet(range(1, 20000, 2))
+        pieces = many.split(100)
+        self.assertTrue(all(len(str(piece)) <= 100 for piece in pieces))
+        self.assertEqual(sum(len(piece) for piece in pieces), len(many))
+
+        imap = self.account.imap
+        emails = [self.create_test_email() for _ in range(3)]
+        uids = [email.uid for email in emails]
+        fetched = imap.fetch(UidSet(uids), 'UID')
+        self.assertEqual(sorted(fetched), sorted(uids))
+        first = '{}:*'.format(min(uids))  # '*' is sent unchanged
+        self.assertEqual(sorted(imap.fetch(first, 'UID')), sorted(uids))
+        self.assertEqual([uid for uid, _ in imap.iter_fetch(
+            first, 'UID', chunk_size=2)], sorted(uids))
+        self.assertTrue(imap.delete_messages(uids))
+        self.assertFalse(set(uids) & set(imap.search()))
+
+    def test_pipeline(self):
+        """independent commands are sent before their responses are read"""
+        from imap_storage.connection.imap import Imap
+        from imap_storage.connection.uidset import UidSet
+        imap = Imap(self.config)
+        events = []
+        send, get_response = imap._imap.send, imap._imap._get_response
+
+        def record(name, func):
+            def recorded(*args):
+                events.append(name)
+                return func(*args)
+            return recorded
+        imap._imap.send = record('send', send)
+        imap._imap._get_response = record('read', get_response)
+        created = imap.create_folders(['piped', 'piped.a', 'piped.a.b'])
+        self.assertEqual(created, [self.config.directory + '.piped' + sub
+                                   for sub in ('', '.a', '.a.b')])
+        self.assertEqual(events[:3], ['send'] * 3)
+        self.assertEqual(imap.create_folders(['piped', 'piped.a']), [])
+        self.assertEqual(imap.list_folders(), imap.list_folders(refresh=True))
+
+        for _ in range(3):
+            self.create_test_email()
+        uids = self.directory.uids[::2]  # not adjacent, two ranges
+        split = UidSet.split
+        imap.select_folder(self.config.directory)
+        del events[:]
+        with mock.patch.object(  # one FETCH per uid
+                UidSet, 'split', lambda uid_set: split(uid_set, 1)):
+            fetched = imap.fetch(uids, ['UID'])
+            self.assertEqual(sorted(fetched), uids)
+            self.assertEqual(events[:2], ['send', 'send'])
+            self.assertTrue(imap.delete_messages(uids))
+        self.assertEqual(len(imap.search()), 1)
+        imap.delete_folder('piped')
+        imap.logout()
+
     def test_config(self):
         """tests of Config class"""
         self.assertTrue(self.config.is_ok)
@@ -67,3 +247,28 @@ class ConnectionTestCase(CustomTestCase):
         request2 = SimpleNamespace(session={})
         config2 = imap_storage.Config.from_request(request2)
         self.assertIsNone(config2)
+
+    def test_response_codes(self):
+        """APPENDUID and COPYUID are parsed, capabilities are cached"""
+        from imap_storage.connection.imap import (
+            response_code, appended_uids, copied_uids)
+        self.assertEqual(appended_uids(b'[APPENDUID 38505 3955] done'),
+                         [3955])
+        self.assertEqual(appended_uids('[APPENDUID 1 7,3:4] done'),
+                         [7, 3, 4])
+        self.assertIsNone(appended_uids(b'APPEND completed'))
+        self.assertIsNone(appended_uids(None))
+        self.assertEqual(
+            copied_uids(b'[COPYUID 38505 304,319:320 3956:3958] Done'),
+            {304: 3956, 319: 3957, 320: 3958})
+        self.assertIsNone(copied_uids(b'[APPENDUID 1 3] done'))
+        self.assertEqual(response_code(b'[READ-WRITE] ok', 'READ-WRITE'), [])
+
+        from imap_storage.connection.imap import Imap
+        imap = Imap(self.config)
+        self.assertIsNotNone(imap.capability_set)
+        with mock.patch.object(imap._imap, 'send') as send:
+            self.assertTrue(imap.has_capability('imap4rev1'))
+            self.assertTrue(imap.has_capability(b'IMAP4REV1'))
+        send.assert_not_called()
+        imap.logout()
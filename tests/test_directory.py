@@ -1,5 +1,8 @@
 """test storage.directory class"""
+from os import path
+from unittest import mock
 from . import CustomTestCase
+from imap_storage.connection.imap import Imap
 from imap_storage.storage.directory import Directory
 from imap_storage.storage.email.file import file_from_local
 from email.message import Message
@@ -71,3 +74,298 @@ class ConnectionTestCase(CustomTestCase):
         self.assertNotIn(email2, parent_dir.emails)
         child_dir.delete()
         # self.assertNotIn(child_dir, storage.directories)
+
+    def test_uids_cache(self):
+        """uids are only searched again if the folder has changed"""
+        directory = self.directory
+        uids = directory.uids
+        self.assertIs(directory.uids, uids)  # no new SEARCH
+        email = self.create_test_email()
+        self.assertIsNot(directory.uids, uids)
+        self.assertIn(email.uid, directory.uids)
+        uids = directory.uids
+        directory.refresh()
+        self.assertIsNot(directory.uids, uids)
+        self.assertEqual(directory.uids, uids)
+
+        other = Imap(self.config)  # another client
+        other.append(directory.path, str(directory.new_email('x').plain))
+        self.assertEqual(len(directory.uids), len(uids) + 1)
+        other.logout()
+
+    def test_sync(self):
+        """changes are applied incrementally with CONDSTORE/QRESYNC"""
+        if not self.account.imap.has_capability('CONDSTORE'):
+            self.skipTest('server has no CONDSTORE')
+        directory = self.directory
+        email = self.create_test_email()
+        uids = directory.uids
+        other = Imap(self.config)
+        other.append(directory.path, str(directory.new_email('x').plain))
+        other.select_folder(directory.path)
+        other.delete_messages(email.uid)
+        uids2 = directory.uids  # CHANGEDSINCE instead of SEARCH
+        self.assertNotIn(email.uid, uids2)
+        self.assertEqual(len(uids2), len(uids))
+        self.assertEqual(uids2, other.search())
+        other.logout()
+
+    def test_email_index(self):
+        """test storage.index.EmailIndex class"""
+        from imap_storage.storage.email.email import Email
+        from imap_storage.storage.index import EmailIndex
+        directory = self.directory
+        index = EmailIndex(Email(directory, uid) for uid in range(20000, 0, -1))
+        self.assertEqual(index.uids, list(range(1, 20001)))
+        self.assertEqual(index[0].uid, 1)
+        self.assertEqual([email.uid for email in index[-2:]], [19999, 20000])
+        self.assertEqual(index.get(500).uid, 500)
+        self.assertIsNone(index.get(30000))
+        self.assertIn(Email(directory, 7), index)
+        removed, added = index.sync(
+            list(range(2, 20001)) + [20005], lambda uid: Email(directory, uid))
+        self.assertEqual((removed, added), ([1], [20005]))
+        index.discard(20005)
+        index.discard_many([2, 3, 30000])
+        index.add(Email(directory, 1))
+        self.assertEqual(index.uids[:2], [1, 4])
+        self.assertEqual(len(index), 19998)
+
+        email = self.create_test_email()
+        emails = directory.emails
+        self.assertIsInstance(emails, EmailIndex)
+        self.assertIs(directory.email_by_uid(email.uid), emails.get(email.uid))
+        email.save()  # new uid, same object
+        self.assertIs(directory.email_by_uid(email.uid), email)
+
+    def test_prefetch(self):
+        """listing fields of all emails come with one FETCH"""
+        from datetime import datetime
+        email = self.create_test_email()
+        directory = self.directory
+        fetched = directory.prefetch()
+        self.assertEqual(
+            set(fetched[email.uid]),
+            {'subject', 'sender', 'date', 'size', 'flags'})
+        listed = directory.email_by_uid(email.uid)
+        self.assertEqual(listed.subject, self.config.tag + ' Testobject')
+        self.assertIn(self.config.imap.user, listed.sender)
+        self.assertIsInstance(listed.date, datetime)
+        self.assertGreater(listed.size, 0)
+        self.assertIsInstance(listed.flags, tuple)
+        self.assertEqual(
+            directory.fetch_subjects(listed), {listed.subject: [email.uid]})
+
+    def test_iter_emails(self):
+        """emails and files are fetched batch by batch"""
+        directory = self.account.storage.new_directory(self.config.directory)
+        for i in range(3):
+            directory.new_email('Iter{}'.format(i)).save()
+        for name in ('image.png', 'text.txt'):
+            directory.add_file_email(file_from_local(
+                path.join(path.dirname(__file__), 'files', name)))
+        self.assertGreater(directory.transfer_workers, 1)  # read-ahead
+
+        emails = directory.iter_emails(batch=2)
+        first = next(emails)
+        self.assertEqual(first.uid, directory.uids[0])
+        self.assertIsNotNone(first._subject)  # pylint: disable=W0212
+        listed = [first] + list(emails)
+        self.assertEqual([email.uid for email in listed], directory.uids)
+        self.assertEqual([email.subject for email in listed],
+                         [email.subject for email in directory.emails])
+
+        files = list(directory.iter_files(batch=2))
+        self.assertEqual(len(files), 2)
+        self.assertEqual([file.name for file in files],
+                         [file.name for file in directory.files])
+
+        fresh = Directory(self.account.storage, directory.path)
+        detached = list(fresh.iter_emails(prefetch=None))
+        self.assertEqual([email.name for email in detached],  # own fields
+                         [email.name for email in directory.emails])
+        self.assertIsNone(fresh._emails)  # pylint: disable=W0212
+        self.assertEqual([file.email.name for file in fresh.iter_files()],
+                         ['image.png', 'text.txt'])
+
+    def test_chunked_file(self):
+        """large files are stored in chunk messages, uploads resume"""
+        self.config.chunk_size = 10000
+        local = path.join(path.dirname(__file__), 'files', 'binary')
+        with open(local, 'rb') as local_file:
+            data = local_file.read()
+        directory = self.account.storage.new_directory(self.config.directory)
+        email = directory.new_email('Chunked')
+        file = file_from_local(local)
+        email.add_file(file)
+        self.assertTrue(file.chunked)
+
+        stored = directory.upload_chunks(file)  # like an interrupted save
+        self.assertEqual([size for _, _, size in stored],
+                         [10000, 10000, 10000, 1464])
+        email.save()  # finds the stored chunks, uploads nothing
+        self.assertEqual(file.chunks, stored)
+        self.assertEqual(len(directory.emails), 1)  # chunks are not listed
+
+        directory = self.account.storage.new_directory(self.config.directory)
+        file = directory.files[0]
+        self.assertTrue(file.chunked)
+        self.assertEqual(file.chunks, stored)
+        reader = file.open()
+        reader.seek(9990)
+        self.assertEqual(reader.read(30), data[9990:10020])
+        self.assertEqual(file.read(), data)
+
+        directory.emails[0].delete()
+        self.assertEqual(directory.find_chunks(file), {})
+
+    def test_batch(self):
+        """changes inside of a batch are sent once at its end"""
+        directory = self.account.storage.new_directory(self.config.directory)
+        emails = [directory.new_email('Batch{}'.format(i)) for i in range(3)]
+        for email in emails:
+            email.save()
+        first, second, third = emails
+        old_uid = first.uid
+
+        with directory.batch():
+            for i in range(3):
+                first.add_item('edit', text=str(i))
+            first.save()
+            second.delete()
+            third.delete()
+            self.assertEqual(first.uid, old_uid)  # nothing sent yet
+            self.assertEqual(directory.emails.uids, [old_uid])
+            with self.account.imap.connection() as imap:
+                uid_next = imap.uid_state(directory.path)[1]
+                self.assertEqual(
+                    len(imap.search(directory.path)), 3)
+
+        self.assertEqual(first.uid, uid_next)  # only one APPEND
+        self.assertEqual(directory.emails.uids, [first.uid])
+        self.assertEqual(len(first.body.get_by_tag('edit')), 3)
+
+        with self.assertRaises(RuntimeError), directory.batch():
+            first.add_item('lost')
+            raise RuntimeError
+        self.assertEqual(directory.emails.uids, [first.uid])
+
+    def test_delete_emails(self):
+        """bulk delete expunges exactly the given emails"""
+        directory = self.account.storage.new_directory(self.config.directory)
+        emails = [directory.new_email('Bulk{}'.format(i)) for i in range(5)]
+        for email in emails:
+            email.save()
+        with directory.selected() as imap:  # flagged by someone else
+            imap.add_flags([emails[0].uid], [b'\\Deleted'])
+
+        self.assertTrue(directory.delete_emails(emails[1:4]))
+        self.assertEqual(
+            directory.emails.uids, [emails[0].uid, emails[4].uid])
+        with mock.patch.object(Imap, 'uid_state', autospec=True,
+                               side_effect=Imap.uid_state) as uid_state:
+            self.assertTrue(directory.delete_emails(
+                [emails[4].uid, 99999, 99998, 99997]))
+        self.assertEqual(uid_state.call_count, 1)  # not once per uid
+        if self.account.imap.has_capability('UIDPLUS'):
+            self.assertEqual(directory.emails.uids, [emails[0].uid])
+
+    def test_add_files(self):
+        """bulk upload with MULTIAPPEND or pipelined APPENDs"""
+        directory = self.account.storage.new_directory(self.config.directory)
+        directory.add_file_email(file_from_local('tests/files/text.txt'))
+        files = [file_from_local('tests/files/text.txt'),
+                 file_from_local('tests/files/image.png')]
+        for name in ('first.txt', 'second.txt', 'first.txt'):
+            files.append(file_from_local('tests/files/text.txt'))
+            files[-1].name = name
+        uids = directory.add_files(files, batch=2)
+        self.assertEqual(len(uids), 3)
+        self.assertEqual(uids, sorted(uids))
+        self.assertEqual(
+            [directory.email_by_uid(uid).name for uid in uids],
+            ['image.png', 'first.txt', 'second.txt'])
+        with directory.selected() as imap:
+            self.assertEqual(imap.search()[-3:], uids)
+        with open('tests/files/image.png', 'rb') as local:
+            self.assertEqual(directory.file_by_name('image.png').read(),
+                             local.read())
+        self.assertEqual(directory.add_files(files), [])
+
+        imap = self.account.imap  # fallback: pipelined APPENDs
+        capability = imap.has_capability
+        with mock.patch.object(imap, 'has_capability',
+                               lambda name: name != 'MULTIAPPEND'
+                               and capability(name)):
+            files[-1].name = 'third.txt'
+            self.assertEqual(len(directory.add_files(files[-1:])), 1)
+        self.assertTrue(directory.file_by_name('third.txt'))
+
+    def test_appended_uid(self):
+        """the uid of a saved email is known without a refresh"""
+        directory = self.account.storage.new_directory(self.config.directory)
+        self.assertEqual(directory.uids, [])
+        email = directory.new_email('First')
+        with mock.patch.object(Imap, 'search', autospec=True,
+                               side_effect=Imap.search) as search:
+            email.save()
+            self.assertEqual(directory.uids, [email.uid])
+        search.assert_not_called()
+
+        append = Imap.append  # without UIDPLUS: search the Message-ID
+        capability = Imap.has_capability
+        with mock.patch.object(Imap, 'append', lambda *args, **kwargs:
+                               append(*args, **kwargs).split(b'] ')[-1]), \
+                mock.patch.object(
+                    Imap, 'has_capability', lambda imap, name: name not in (
+                        'UIDPLUS', 'MULTIAPPEND') and capability(imap, name)):
+            second = directory.new_email('Second')
+            second.save()
+            self.assertEqual(directory.uids, [email.uid, second.uid])
+            files = [file_from_local('tests/files/text.txt')]
+            self.assertEqual(directory.add_files(files), [second.uid + 1])
+            email.add_item('entry', text='changed')
+            old_uid = email.uid
+            email.save()
+        self.assertNotEqual(email.uid, old_uid)
+        directory.refresh()
+        self.assertEqual(directory.uids, [second.uid, second.uid + 1,
+                                          email.uid])
+
+    def test_move_emails(self):
+        """emails and their chunks are moved and copied on the server"""
+        self.config.chunk_size = 10000
+        local = path.join(path.dirname(__file__), 'files', 'binary')
+        with open(local, 'rb') as local_file:
+            data = local_file.read()
+        storage = self.account.storage
+        source = storage.new_directory('source')
+        target = storage.new_directory('target')
+        chunked = source.new_email('Chunked')
+        chunked.add_file(file_from_local(local))
+        chunked.save()
+        other = source.new_email('Other')
+        other.add_item('entry', text='moved')
+        other.save()
+        self.assertEqual(target.uids, [])
+
+        old_uid = chunked.uid
+        new_uid = chunked.move_to(target)
+        self.assertEqual(chunked.directory, target)
+        self.assertEqual(source.uids, [other.uid])
+        self.assertEqual(target.uids, [new_uid])
+        self.assertEqual(target.email_by_uid(new_uid), chunked)
+        self.assertEqual(source.find_chunks(chunked.files[0]), {})
+        file = storage.new_directory('target').files[0]
+        self.assertEqual(file.read(), data)  # chunk uids were hints only
+        self.assertNotIn(old_uid, [uid for _, uid, _ in file.chunks])
+
+        copy = other.copy_to(target)
+        self.assertEqual(copy.body.get_by_tag('entry')[0].text, 'moved')
+        self.assertEqual(source.uids, [other.uid])
+        self.assertEqual(sorted(target.uids), sorted([new_uid, copy.uid]))
+        moved = source.move_emails([other.uid], target)
+        self.assertEqual(list(moved), [other.uid])
+        self.assertEqual(source.uids, [])
+        storage.new_directory('target').refresh()
+        self.assertEqual(len(storage.new_directory('target').uids), 3)
@@ -1,5 +1,10 @@
+from os import path
+from unittest import mock
 from . import CustomTestCase
+from imap_storage.connection.imap import Imap
+from imap_storage.storage.blobs import BlobStore
 from imap_storage.storage.directory import Directory
+from imap_storage.storage.email.file import file_from_local
 
 
 class StorageTestCase(CustomTestCase):
@@ -30,3 +35,102 @@ class StorageTestCase(CustomTestCase):
         self.assertIsInstance(storage.directory_by_path(test_path), Directory)
         self.assertTrue(storage.delete_directory(test_path))
         # self.assertIsNone(storage.directory_by_path(test_path))
+
+    def test_dedup(self):
+        """equal payloads are stored once and reference counted"""
+        self.config.dedup = True
+        storage = self.account.storage
+        local = path.join(path.dirname(__file__), 'files', 'image.png')
+        with open(local, 'rb') as local_file:
+            data = local_file.read()
+        first = storage.new_directory('first')
+        second = storage.new_directory('second')
+        first.add_file_email(file_from_local(local))
+        second.add_file_email(file_from_local(local))
+
+        digest = storage.blobs.digest(data)
+        self.assertEqual(storage.blobs.refs(digest), 2)
+        with storage.blobs.selected() as imap:  # only one blob message
+            self.assertEqual(len(imap.search(
+                criteria=['HEADER', 'X-Imap-Storage-Blob', digest])), 1)
+        self.assertNotIn(storage.blobs.path,
+                         [directory.path for directory in storage.directories])
+
+        file = storage.new_directory('second').files[0]
+        self.assertEqual(file.blob, digest)
+        self.assertEqual(int(file.size), len(data))
+        reader = file.open(block_size=1000)
+        reader.seek(4000)
+        self.assertEqual(reader.read(100), data[4000:4100])
+        self.assertEqual(file.read(), data)
+
+        copy = first.emails[0].copy_to(second)  # one reference more
+        self.assertEqual(storage.blobs.refs(digest), 3)
+        copy.delete()
+        first.emails[0].delete()
+        self.assertEqual(storage.blobs.refs(digest), 1)
+        second.emails[0].delete()
+        self.assertEqual(storage.blobs.refs(digest), 0)
+        self.assertIsNone(storage.blobs.uid(digest))
+
+    def test_dedup_concurrent(self):
+        """references of other processes are kept, not overwritten"""
+        storage = self.account.storage
+        other = BlobStore(storage)  # like the store of another process
+        digest = storage.blobs.put(b'data')
+        self.assertEqual(other.put(b'data'), digest)
+        self.assertEqual(storage.blobs.refs(digest), 2)
+        self.assertEqual(other.release(digest), 1)
+        self.assertEqual(storage.blobs.get(digest), b'data')
+
+        add_flags = Imap.add_flags
+
+        def racing(imap, *args):  # other puts while the blob is swept
+            result = add_flags(imap, *args)
+            other.put(b'data')
+            return result
+        with mock.patch.object(Imap, 'add_flags', racing):
+            self.assertEqual(storage.blobs.release(digest), 0)
+        self.assertEqual(storage.blobs.refs(digest), 1)
+        self.assertEqual(other.get(digest), b'data')
+
+    def test_iter_pooled(self):
+        """iter_fetch keeps its pooled connection until it is done"""
+        # pylint: disable=protected-access
+        storage = self.account.storage
+        pool = self.account.imap
+        uids = sorted(self.create_test_email().uid for _ in range(3))
+        heads = storage.iter_heads(uids, chunk_size=1)  # outside selected()
+        self.assertEqual(next(heads)[0], uids[0])
+        imap = pool._local.imap
+        self.assertIsNotNone(imap)  # still checked out, not idle
+        self.assertNotIn(imap, [idle for idle, _ in pool._idle])
+        self.assertEqual([uid for uid, _ in heads], uids[1:])
+        self.assertIsNone(pool._local.imap)
+        heads = storage.iter_heads(uids, chunk_size=1)
+        next(heads)
+        heads.close()  # abandoned
+        self.assertIsNone(pool._local.imap)
+        self.assertIn(imap, [idle for idle, _ in pool._idle])
+
+    def test_iter_fetch(self):
+        """results are fetched chunk by chunk and ordered by uid"""
+        storage = self.account.storage
+        emails = [self.create_test_email() for _ in range(5)]
+        uids = sorted(email.uid for email in emails)
+        with self.directory.selected() as imap:
+            chunks = []
+            real_fetch = imap.fetch
+            imap.fetch = lambda *args: chunks.append(args[0]) or \
+                real_fetch(*args)
+            heads = list(storage.iter_heads(uids, chunk_size=2))
+            del imap.fetch
+            self.assertEqual([list(chunk) for chunk in chunks],
+                             [uids[0:2], uids[2:4], uids[4:]])
+            self.assertEqual([uid for uid, _ in heads], uids)
+            self.assertEqual(dict(heads), storage.get_heads(uids))
+            bodies = storage.iter_bodies(uids, chunk_size=2)
+            self.assertEqual(next(bodies), (uids[0], storage.get_bodies(
+                uids[0])[uids[0]]))
+            self.assertEqual(dict(storage.iter_payloads(uids)),
+                             storage.get_file_payloads(uids))